@@ -0,0 +1,83 @@
+import struct
+
+import common.config
+
+# Binary encoding of movement commands
+#
+# Frame is MARK, length of body, Nid (uint32), body and checksum - sum of
+# all bytes before it (uint16). MARK isn't ASCII symbol, so MCU tells
+# binary frames from text commands by first byte.
+#
+# Body of linear movement is opcode 1, feeds F, P, L (uint16, mm/min),
+# acceleration T (uint16, mm/sec^2) and X, Y, Z (int32, steps). Body of
+# arc is opcode 2 (G2) or 3 (G3), the same fields, plane (uint8, 17-19)
+# and D (int32, steps), see actions.helix.HelixMovement.command.
+#
+# MCU reports version of encoding, it supports, as B in answer to M800.
+# Host sends movements in binary, if it is enabled with BINARY_COMMANDS
+# in config and MCU supports VERSION.
+
+MARK = 0xFB
+VERSION = 1
+
+LINE = 1
+ARC_CW = 2
+ARC_CCW = 3
+
+_header = struct.Struct("<BBI")
+_line = struct.Struct("<BHHHHiii")
+_arc = struct.Struct("<BHHHHiiiBi")
+_checksum = struct.Struct("<H")
+
+def _steps(mm):
+    return int(round(mm * common.config.STEPS_PER_MM))
+
+def _mm(steps):
+    return steps / common.config.STEPS_PER_MM
+
+def _feeds(feed, feed0, feed1, acc):
+    return int(feed), int(feed0 + 0.5), int(feed1 + 0.5), int(acc)
+
+# body of linear movement, delta is (x, y, z) in axes of MCU, mm
+def line(feed, feed0, feed1, acc, delta):
+    x, y, z = delta
+    return _line.pack(LINE, *_feeds(feed, feed0, feed1, acc), _steps(x), _steps(y), _steps(z))
+
+# body of arc movement, hcl - distance from chord to center, mm
+def arc(ccw, feed, feed0, feed1, acc, delta, plane, hcl):
+    x, y, z = delta
+    return _arc.pack(ARC_CCW if ccw else ARC_CW, *_feeds(feed, feed0, feed1, acc),
+                     _steps(x), _steps(y), _steps(z), plane, _steps(hcl))
+
+def frame(nid, body):
+    data = _header.pack(MARK, len(body), nid) + body
+    return data + _checksum.pack(sum(data) & 0xFFFF)
+
+# does MCU, which answered response to M800, accept binary commands
+def accepted(response):
+    return common.config.BINARY_COMMANDS and response.get("B", 0) >= VERSION
+
+# decode frame to Nid and words of text command,
+# returns None, if frame is damaged
+def parse(data):
+    if len(data) < _header.size + _checksum.size:
+        return None
+    mark, length, nid = _header.unpack_from(data)
+    end = _header.size + length
+    if mark != MARK or len(data) != end + _checksum.size:
+        return None
+    if _checksum.unpack_from(data, end)[0] != sum(data[:end]) & 0xFFFF:
+        return None
+
+    opcode = data[_header.size]
+    if opcode == LINE:
+        _, f, p, l, t, x, y, z = _line.unpack_from(data, _header.size)
+        words = [("G", "1")]
+    elif opcode in (ARC_CW, ARC_CCW):
+        _, f, p, l, t, x, y, z, plane, d = _arc.unpack_from(data, _header.size)
+        words = [("G", str(opcode)), ("D", repr(_mm(d))), ("G", str(plane))]
+    else:
+        return None
+    words += [("F", str(f)), ("P", str(p)), ("L", str(l)), ("T", str(t)),
+              ("X", repr(_mm(x))), ("Y", repr(_mm(y))), ("Z", repr(_mm(z)))]
+    return nid, words
@@ -27,6 +27,34 @@ MAXFEED = 800.0
 PRECISE_FEED = 50.0
 DEFAULT_FEED = 20.0
 
+# feed planner: "linear" or "pairwise"
+PLANNER = "linear"
+
+# build and optimize program while it is running
+STREAMING = False
+
+# store movements of loaded program in columns, not in objects
+COMPACT_PROGRAM = False
+
+# directory for cache of parsed programs and optimized feeds, None - no cache
+CACHE_DIR = None
+
+# maximal size of cache, bytes
+CACHE_SIZE = 256 * 1024 * 1024
+
+# amount of movements in look-ahead window
+LOOKAHEAD = 256
+
+# repeated subprogram calls are built from template of the first call
+SUBPROGRAM_TEMPLATES = True
+
+# merge consecutive colinear linear movements with same feed to one command
+MERGE_COLINEAR = False
+# maximal angle between merged movements, radians
+MERGE_ANGLE = 0.001
+# maximal distance of vertices from merged movement, mm
+MERGE_DISTANCE = 0.005
+
 # communication settings
 TABLE_BAUDRATE = 115200
 TABLE_PORT = "eth0"
@@ -34,6 +62,9 @@ TABLE_PORT = "eth0"
 RS485_BAUDRATE = 9600
 RS485_PORT = "/dev/ttyUSB1"
 
+# send movements to table without waiting answer for each of them
+PIPELINE = False
+
 # spindel options
 N700E_ID = 1
 SPINDLE_MAX = 24000.0
@@ -43,7 +74,39 @@ SPINDLE_DELAY = 5.0
 EMULATE_TABLE = False
 EMULATE_SPINDEL = False
 
+# emulate table with virtual MCU, which executes movements in time,
+# see server/sender/mcuemulator.py
+EMULATE_MCU = False
+EMULATE_MCU_QUEUE = 16
+# wire latency of emulated MCU, seconds
+EMULATE_MCU_LATENCY = 0.001
+
+# send movements to MCU in binary encoding, if MCU supports it,
+# see common/binary.py
+BINARY_COMMANDS = False
+
+# time of collecting commands into one Ethernet frame, seconds,
+# 0 - each command is sent in its own frame, see server/sender/batching.py
+ETHERNET_BATCH_WINDOW = 0
+
+# tracing: level of each category (planner, sender, receiver, state),
+# 0 - off, 1 - errors, 2 - warnings, 3 - info, 4 - debug, see common/trace.py
+TRACE_LEVELS = {}
+# size of ring buffer of trace, entries
+TRACE_BUFFER = 100000
+# print trace messages
+TRACE_ECHO = False
+# file, which buffer of trace is dumped to by dumptrace command
+TRACE_FILE = "/tmp/cnccontrol.trace"
+
 # timeout of request coordinates
 COORDINATE_REQUEST_TIMEOUT = 0.1
 
+# take coordinates from answers of movements instead of M114,
+# M114 is sent only when machine is idle
+COORDINATE_SUBSCRIPTION = False
+
+# minimal time between M114 requests in subscription mode, seconds
+COORDINATE_REQUEST_INTERVAL = 1.0
+
 LISTEN=("0.0.0.0", 10000)
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 
+import asyncio
+import threading
+
 class EventEmitter(object):
 
     def __init__(self):
@@ -20,3 +23,48 @@ class EventEmitter(object):
 
     def dispose(self):
         self.handlers = []
+
+# threading.Event, which can be awaited in asyncio loop too
+#
+# Event can be set from any thread, waiting coroutines are woken
+# in their loops.
+class Event(threading.Event):
+
+    __lock = threading.Lock()
+
+    def __init__(self):
+        threading.Event.__init__(self)
+        self.__waiters = None
+
+    @staticmethod
+    def __wake(future):
+        if not future.done():
+            future.set_result(True)
+
+    def set(self):
+        threading.Event.set(self)
+        with self.__lock:
+            waiters = self.__waiters
+            self.__waiters = None
+        if waiters is not None:
+            for loop, future in waiters:
+                loop.call_soon_threadsafe(self.__wake, future)
+
+    async def wait_async(self):
+        if self.is_set():
+            return True
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self.__lock:
+            if self.is_set():
+                return True
+            if self.__waiters is None:
+                self.__waiters = []
+            self.__waiters.append(waiter)
+        try:
+            await waiter[1]
+        finally:
+            with self.__lock:
+                if self.__waiters is not None and waiter in self.__waiters:
+                    self.__waiters.remove(waiter)
+        return True
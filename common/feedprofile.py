@@ -0,0 +1,30 @@
+# Trapezoidal feed profile of movement
+#
+# Movement accelerates from feed0 to feed, moves with feed and decelerates
+# to feed1. When movement is too short, feed is not reached. Without
+# acceleration movement goes with feed all the time. Lengths are in mm,
+# feeds in mm/min, acceleration in mm/sec^2.
+#
+# Used by machine.actions.action.Movement and by emulator of MCU,
+# machine.simulator.durations is the same for arrays of movements.
+
+# phases of profile: (time, distance, feed) of acceleration,
+# constant feed and deceleration. Feeds of phases are in mm/sec
+def phases(length, feed0, feed, feed1, acc):
+    f0 = feed0 / 60
+    f1 = feed1 / 60
+    f = max(feed / 60, f0, f1, 1e-6)
+    if acc <= 0:
+        return (0, 0, f), (length / f, length, f), (0, 0, f)
+    x0 = (f**2 - f0**2) / (2*acc)
+    x1 = (f**2 - f1**2) / (2*acc)
+    if x0 + x1 > length:
+        # feed is not reached
+        f = max(((2*acc*length + f0**2 + f1**2) / 2)**0.5, f0, f1, 1e-6)
+        x0 = min(max((f**2 - f0**2) / (2*acc), 0), length)
+        x1 = length - x0
+    return ((f - f0) / acc, x0, f0), ((length - x0 - x1) / f, length - x0 - x1, f), ((f - f1) / acc, x1, f)
+
+# time of movement, seconds
+def duration(length, feed0, feed, feed1, acc):
+    return sum(t for t, _, _ in phases(length, feed0, feed, feed1, acc))
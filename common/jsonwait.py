@@ -1,61 +1,176 @@
 #!/usr/bin/python3
 
 import json
-import re
+import struct
+import hashlib
+
+from common import trace
+
+# Framing of JSON messages
+#
+# Protocol 1: \x00, json, \xFF
+# Protocol 2: \x01, length of json (uint32, big endian), json
+#
+# Receiver accepts both kinds of frames. Sender uses protocol 1 until
+# both sides agree on protocol 2 with "hello" message:
+#
+#   client -> {"type" : "hello", "protocol" : 2}
+#   server -> {"type" : "hello", "protocol" : 2}
+#
+# Old server ignores "hello", so old and new sides continue with protocol 1.
+# With protocol 2 program is transferred in chunks of CHUNK_LINES lines:
+#
+#   {"type" : "command", "command" : "load", "lines" : [...], "offset" : 0, "more" : true}
+#   {"type" : "loadlines", "lines" : [...], "offset" : 0}
+
+PROTOCOL = 2
+
+CHUNK_LINES = 4096
+
+START = 0x00
+END = 0xFF
+LENGTH = 0x01
+
+header = struct.Struct(">BI")
+
+# split lines to chunks, returns (offset, chunk, more)
+def chunks(lines, size=CHUNK_LINES):
+    offset = 0
+    chunk = []
+    for line in lines:
+        if len(chunk) == size:
+            yield offset, chunk, True
+            offset += len(chunk)
+            chunk = []
+        chunk.append(line)
+    yield offset, chunk, False
+
+# hash of program, server acknowledges uploaded program with it
+def program_hash(lines):
+    h = hashlib.sha256()
+    for line in lines:
+        h.update(line.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
 
 class JsonReceiver(object):
 
+    __header = header
+
+    __min_free = 4096
+
     def __init__(self, sock):
         self.sock = sock
-        self.buf = bytes()
-        self.relen = re.compile(r"Length: (\d+)")
+        # received data is buf[begin:end]
+        self.buf = bytearray(64 * 1024)
+        self.begin = 0
+        self.end = 0
+        # position, where search of end of delimited frame continues
+        self.scan = 0
 
-    def __acquire_msg(self):
+    def __drop(self, pos):
+        self.begin = pos
+        self.scan = pos
+        if self.begin == self.end:
+            self.begin = 0
+            self.end = 0
+            self.scan = 0
+
+    def __decode(self, begin, end):
         try:
-            #print("\n\nbuf0 = ", self.buf)
-            start = self.buf.find(b"\x00")
-            if start < 0:
-                return None
-            end = self.buf.find(b"\xFF")
-            if end < 0:
-                return None
-            msgbuf = self.buf[start + 1:end]
-            #print("msgbuf = ", msgbuf)
-            msg = json.loads(msgbuf)
-            self.buf = self.buf[end + 1:]
-            #print("Received: ", msg)
-            return msg
-        except:
+            return json.loads(str(memoryview(self.buf)[begin:end], "utf-8"))
+        except ValueError as e:
+            trace.protocol.warning("Invalid message: %s", e)
             return None
 
+    # next received message or None
+    def next_message(self):
+        while self.begin < self.end:
+            first = self.buf[self.begin]
+            if first == START:
+                pos = self.buf.find(END, max(self.scan, self.begin + 1), self.end)
+                if pos < 0:
+                    self.scan = self.end
+                    return None
+                msg = self.__decode(self.begin + 1, pos)
+                self.__drop(pos + 1)
+            elif first == LENGTH:
+                if self.end - self.begin < self.__header.size:
+                    return None
+                _, length = self.__header.unpack_from(self.buf, self.begin)
+                pos = self.begin + self.__header.size
+                if self.end - pos < length:
+                    return None
+                msg = self.__decode(pos, pos + length)
+                self.__drop(pos + length)
+            else:
+                # garbage between frames
+                self.__drop(self.begin + 1)
+                continue
+            if msg is not None:
+                return msg
+        return None
+
+    # bytes, which should be received to finish current frame
+    def __needed(self):
+        if self.end - self.begin >= self.__header.size and self.buf[self.begin] == LENGTH:
+            _, length = self.__header.unpack_from(self.buf, self.begin)
+            return self.__header.size + length - (self.end - self.begin)
+        return self.__min_free
+
+    def __reserve(self):
+        needed = max(self.__needed(), self.__min_free)
+        if len(self.buf) - self.end >= needed:
+            return
+        size = self.end - self.begin
+        if self.begin > 0:
+            self.buf[:size] = self.buf[self.begin:self.end]
+            self.scan -= self.begin
+            self.begin = 0
+            self.end = size
+        if len(self.buf) - self.end < needed:
+            self.buf.extend(bytes(max(needed - (len(self.buf) - self.end), len(self.buf))))
+
+    # free part of buffer for receiving, see asyncio.BufferedProtocol
+    def get_buffer(self):
+        self.__reserve()
+        return memoryview(self.buf)[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+
     def receive_message(self, wait=True):
-        msg = self.__acquire_msg()
+        msg = self.next_message()
         if msg != None:
             return msg, False
         while True:
             try:
-                ser = self.sock.recv(1024)
+                n = self.sock.recv_into(self.get_buffer())
             except BlockingIOError:
                 return None, False
             except OSError as e:
-                print("OS error", type(e), e)
+                trace.protocol.error("OS error %s: %s", type(e).__name__, e)
+                return None, True
+            if n == 0:
                 return None, True
-            self.buf += ser
-            msg = self.__acquire_msg()
+            self.buffer_updated(n)
+            msg = self.next_message()
             if msg != None or wait == False:
                 return msg, False
-        return None, True
 
 class JsonSender(object):
 
+    __header = header
+
     def __init__(self, sock):
         self.sock = sock
+        self.protocol = 1
+
+    def encode(self, msg):
+        ser = json.dumps(msg).encode("utf-8")
+        if self.protocol >= 2:
+            return self.__header.pack(LENGTH, len(ser)) + ser
+        return bytes([START]) + ser + bytes([END])
 
     def send_message(self, msg):
-        ser = bytes(json.dumps(msg), "utf-8")
-        msg = b""
-        msg += b"\x00"
-        msg += ser
-        msg += b"\xFF"
-        #print("Sending: ", ser)
-        self.sock.send(msg)
+        self.sock.sendall(self.encode(msg))
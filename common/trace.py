@@ -0,0 +1,90 @@
+import time
+import collections
+
+import common.config
+
+# Tracing of hot paths
+#
+# Messages of categories planner, sender, receiver, state (state machine)
+# and protocol (messages of clients) are written into ring buffer of
+# TRACE_BUFFER entries, if their level isn't above level of category, see
+# TRACE_LEVELS in config.
+# Message is formatted only when buffer is dumped, so disabled category
+# costs a call and a comparison. With TRACE_ECHO messages are printed too.
+
+OFF = 0
+ERROR = 1
+WARNING = 2
+INFO = 3
+DEBUG = 4
+
+_level_names = {ERROR : "ERROR", WARNING : "WARN", INFO : "INFO", DEBUG : "DEBUG"}
+
+_buffer = collections.deque(maxlen=common.config.TRACE_BUFFER)
+_echo = common.config.TRACE_ECHO
+
+def _format(entry):
+    t, category, level, fmt, args = entry
+    if len(args) > 0:
+        fmt = fmt % args
+    return "%.6f %-8s %-5s %s" % (t, category, _level_names[level], fmt.rstrip())
+
+class Category(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.level = common.config.TRACE_LEVELS.get(name, OFF)
+
+    def write(self, level, fmt, args):
+        entry = (time.time(), self.name, level, fmt, args)
+        _buffer.append(entry)
+        if _echo:
+            print(_format(entry))
+
+    def error(self, fmt, *args):
+        if self.level >= ERROR:
+            self.write(ERROR, fmt, args)
+
+    def warning(self, fmt, *args):
+        if self.level >= WARNING:
+            self.write(WARNING, fmt, args)
+
+    def info(self, fmt, *args):
+        if self.level >= INFO:
+            self.write(INFO, fmt, args)
+
+    def debug(self, fmt, *args):
+        if self.level >= DEBUG:
+            self.write(DEBUG, fmt, args)
+
+planner = Category("planner")
+sender = Category("sender")
+receiver = Category("receiver")
+state = Category("state")
+protocol = Category("protocol")
+
+categories = {category.name : category for category in [planner, sender, receiver, state, protocol]}
+
+# levels - {category name : level}, other categories are not changed
+def configure(levels, echo=None):
+    global _echo
+    for name, level in levels.items():
+        if name not in categories:
+            raise Exception("Unknown trace category %s" % name)
+        categories[name].level = level
+    if echo is not None:
+        _echo = echo
+
+def entries():
+    return [_format(entry) for entry in list(_buffer)]
+
+def clear():
+    _buffer.clear()
+
+# write buffer to file, returns amount of written entries
+def dump(path):
+    lines = entries()
+    with open(path, "w") as f:
+        for line in lines:
+            f.write(line + "\n")
+    return len(lines)
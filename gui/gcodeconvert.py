@@ -42,6 +42,7 @@ class Controller(object):
         self.control.zm_clicked += self.__zm
 
         self.sock.settimeout(0)
+        self.uploaded = None
         self.control.switch_to_initial_mode()
 
     def __send_command(self, command):
@@ -135,28 +136,60 @@ class Controller(object):
         }
         self.msg_sender.send_message(r)
 
-    def __load_file(self, filename):
-        file = open(filename, encoding="utf-8")
-        lines = file.readlines()
-        file.close()
+    def __upload(self, lines):
+        lines = list(lines)
+        # server acknowledges program to uploader instead of sending it back
+        self.uploaded = (common.jsonwait.program_hash(lines), lines)
+        if self.msg_sender.protocol < 2:
+            r = {
+                "type" : "command",
+                "command" : "load",
+                "lines" : lines,
+            }
+            self.msg_sender.send_message(r)
+            return
+        for offset, chunk, more in common.jsonwait.chunks(lines):
+            r = {
+                "type" : "command",
+                "command" : "load",
+                "lines" : chunk,
+                "offset" : offset,
+                "more" : more,
+            }
+            self.msg_sender.send_message(r)
 
-        cmds = []
-        for line in lines:
-            cmds.append(line.strip())
+    def __load_file(self, filename):
+        # program can be bigger than socket buffer
+        self.sock.settimeout(None)
+        try:
+            with open(filename, encoding="utf-8") as file:
+                self.__upload(line.strip() for line in file)
+        finally:
+            self.sock.settimeout(0)
+
+    def __hello(self):
         r = {
-            "type" : "command",
-            "command" : "load",
-            "lines" : cmds,
+            "type" : "hello",
+            "protocol" : common.jsonwait.PROTOCOL,
         }
         self.msg_sender.send_message(r)
 
     def __process_event(self, msg):
         type = msg["type"]
-        if type == "loadlines":
+        if type == "hello":
+            self.msg_sender.protocol = msg["protocol"]
+        elif type == "loadlines":
             lines = msg["lines"]
-            self.control.clear_commands()
+            if msg.get("offset", 0) == 0:
+                self.control.clear_commands()
             for line in lines:
                 self.control.add_command(line)
+        elif type == "loaded":
+            if self.uploaded is not None and self.uploaded[0] == msg["hash"]:
+                self.control.clear_commands()
+                for line in self.uploaded[1]:
+                    self.control.add_command(line)
+                self.uploaded = None
         elif type == "line":
             line = msg["line"]
             self.control.select_line(line)
@@ -206,6 +239,7 @@ class Controller(object):
         self.msg_sender = common.jsonwait.JsonSender(self.sock)
 
         GLib.io_add_watch(self.sock, GLib.IO_IN, self.__on_receive_event)
+        self.__hello()
         self.__reset()
         self.control.run()
 
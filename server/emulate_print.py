@@ -13,7 +13,7 @@ class Controller(object):
     def __init__(self, sender):
         self.sender = sender
         self.machine = machine.machine.Machine(self.sender)
-        self.parser = machine.parser.GLineParser()
+        self.parser = machine.parser.GFastLineParser()
         self.machine.paused += self.continue_on_pause
         self.machine.finished += self.done
 
@@ -24,11 +24,8 @@ class Controller(object):
     def done(self):
         print("Done")
 
-    def load(self, lines):
-        frames = []
-        for line in lines:
-            frame = self.parser.parse(line)
-            frames.append(frame)
+    def load(self, data):
+        frames = self.parser.parse_file(data)
         self.machine.Load(frames)
 
     def run(self):
@@ -38,10 +35,10 @@ file = sys.argv[1]
 
 ctl = Controller(sender.emulatorsender.EmulatorSender())
 
-f = open(file)
-lines = f.readlines()
+f = open(file, "rb")
+data = f.read()
 f.close()
 
-ctl.load(lines)
+ctl.load(data)
 
 ctl.run()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import socket
+import threading
+
+from .common import jsonwait
+
+messages = [
+    {"type" : "state", "state" : "init", "message" : ""},
+    {"type" : "loadlines", "lines" : ["G0 X%i" % i for i in range(20000)], "offset" : 0},
+    {"type" : "line", "line" : 5},
+]
+
+def transfer(protocol, messages, step=None):
+    a, b = socket.socketpair()
+    sender = jsonwait.JsonSender(a)
+    sender.protocol = protocol
+    if step is None:
+        thread = threading.Thread(target=lambda: [sender.send_message(msg) for msg in messages])
+    else:
+        # deliver data by small parts
+        data = []
+        sender.sock = type("Sock", (object,), {"sendall" : lambda self, d: data.append(d)})()
+        for msg in messages:
+            sender.send_message(msg)
+        data = b"".join(data)
+        thread = threading.Thread(target=lambda: [a.sendall(data[i:i + step]) for i in range(0, len(data), step)])
+    thread.start()
+    receiver = jsonwait.JsonReceiver(b)
+    received = []
+    for _ in messages:
+        msg, dis = receiver.receive_message()
+        assert not dis
+        received.append(msg)
+    thread.join()
+    a.close()
+    assert receiver.receive_message() == (None, True)
+    b.close()
+    return received
+
+def test_protocols():
+    for protocol in [1, 2]:
+        assert transfer(protocol, messages) == messages
+        assert transfer(protocol, messages, step=7) == messages
+
+def test_mixed():
+    a, b = socket.socketpair()
+    sender = jsonwait.JsonSender(a)
+    receiver = jsonwait.JsonReceiver(b)
+    sender.send_message(messages[0])
+    sender.protocol = 2
+    sender.send_message(messages[2])
+    a.sendall(b"garbage")
+    sender.protocol = 1
+    sender.send_message(messages[2])
+    assert receiver.receive_message() == (messages[0], False)
+    assert receiver.receive_message() == (messages[2], False)
+    assert receiver.receive_message() == (messages[2], False)
+    b.setblocking(False)
+    assert receiver.receive_message(wait=False) == (None, False)
+    a.close()
+    b.close()
+
+def test_chunks():
+    lines = ["G0 X%i" % i for i in range(10)]
+    assert list(jsonwait.chunks(lines, 4)) == [(0, lines[0:4], True), (4, lines[4:8], True), (8, lines[8:10], False)]
+    assert list(jsonwait.chunks(lines[:4], 4)) == [(0, lines[:4], False)]
+    assert list(jsonwait.chunks([], 4)) == [(0, [], False)]
+
+def test_program_hash():
+    lines = ["G0 X%i" % i for i in range(10)]
+    assert jsonwait.program_hash(lines) == jsonwait.program_hash(list(lines))
+    assert jsonwait.program_hash(lines) != jsonwait.program_hash(lines[1:])
+    assert jsonwait.program_hash(["G0 X1", "Y2"]) != jsonwait.program_hash(["G0 X1Y2"])
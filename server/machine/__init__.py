@@ -1 +1 @@
-all=["machine", "parser", "arguments", "program", "program_builder", "optimizer"]
+all=["machine", "parser", "arguments", "program", "program_builder", "optimizer", "compact_program", "cache"]
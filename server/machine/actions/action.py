@@ -1,22 +1,25 @@
 import abc
-import threading
 import copy
+import time
 import common
 from common import event
+from common import feedprofile
+from common import trace
 
 # Basic class for all actions
 class Action(object):
     def __init__(self, **kwargs):
         self.dropped = False
         self.breaked = False
-        self.completed = threading.Event()
-        self.finished = threading.Event()
+        self.completed = event.Event()
+        self.finished = event.Event()
         self.action_completed = event.EventEmitter()
         self.action_started = event.EventEmitter()
         self.caching = False
         self.is_pause = False
         self.is_moving = False
         self.error = False
+        self.line = None
 
     def run(self):
         return self.act()
@@ -70,6 +73,13 @@ class ToolAction(Action):
         return res
 
 # Actions, which generates commands for MCU
+#
+# Sender gives answers for command directly to action,
+# which has sent it, see sender.dispatch.Dispatcher
+#
+# Action keeps times of stages of its command: start of action, sending,
+# "queued", "started" and "completed" answers, and gives them to
+# statistics of sender, see sender.stats.Stats
 class MCUAction(Action):
 
     def __init__(self, sender, **kwargs):
@@ -77,77 +87,86 @@ class MCUAction(Action):
         self.caching = True
         self.table_sender = sender
         self.Nid = None
-        self.table_sender.dropped += self.__received_dropped
-        self.table_sender.completed += self.__received_completed
-        self.table_sender.started += self.__received_started
-        self.table_sender.error += self.__received_error
-        self.table_sender.queued += self.__received_queued
-        self.__sending = False
-        self.command_received = threading.Event()
+        self.command_received = event.Event()
         self.crc_error = False
         self.is_received = False
+        self.times = None
 
     @abc.abstractmethod
     def command(self):
         return ""
 
+    # binary body of command, None if command is sent only as text,
+    # see common.binary
+    def packet(self):
+        return None
+
     @abc.abstractmethod
     def on_completed(self, response):
         pass
 
-    def dispose(self):
-        Action.dispose(self)
-        self.table_sender.dropped -= self.__received_dropped
-        self.table_sender.completed -= self.__received_completed
-        self.table_sender.started -= self.__received_started
-        self.table_sender.queued -= self.__received_queued
-        self.table_sender.error -= self.__received_error
-
-    def __indexed(self, nid):
-        self.Nid = int(nid)
-
-    def __received_queued(self, nid):
-        if int(nid) == self.Nid:       
-            self.command_received.set()
-            self.is_received = True
-
-    def __received_started(self, nid):
-        if int(nid) == self.Nid:
-            self.action_started(self)
-
-    def __received_dropped(self, nid):
-        nid = int(nid)
-        if nid == self.Nid:
-            self.is_received = True
-            self.dropped = True
-            self.finished.set()
-            self.command_received.set()
-
-    def __received_error(self, error):
-        if self.is_received:
-            return
+    def __stamp(self, stage):
+        times = self.times
+        if times is not None:
+            times[stage] = time.monotonic()
+
+    def received_queued(self, nid):
+        self.__stamp(2)
+        self.command_received.set()
+        self.is_received = True
+
+    def received_started(self, nid):
+        self.__stamp(3)
+        self.action_started(self)
+
+    def received_dropped(self, nid):
+        self.times = None
+        self.table_sender.stats.dropped()
+        self.is_received = True
+        self.dropped = True
+        self.finished.set()
+        self.command_received.set()
+
+    def received_error(self, nid, error):
         if error[-9:] == "CRC error":
             self.crc_error = True
+        self.times = None
+        self.table_sender.stats.error(self.crc_error)
         self.error = True
-
-    def __received_completed(self, nid, response):
-        nid = int(nid)
-        if nid == self.Nid:
-            print("Action %i completed" % nid)
-            self.completed.set()
-            self.finished.set()
-            self.on_completed(response)
-            self.action_completed(self)
+        self.command_received.set()
+
+    def received_completed(self, nid, response):
+        trace.receiver.debug("Action %i completed", nid)
+        times = self.times
+        if times is not None:
+            self.times = None
+            times[4] = time.monotonic()
+            self.table_sender.stats.completed(times, self.is_moving)
+        self.completed.set()
+        self.finished.set()
+        self.on_completed(response)
+        self.action_completed(self)
 
     def act(self):
-        self.table_sender.indexed += self.__indexed
-        cmd = self.command()
+        if self.times is None:
+            self.times = [time.monotonic(), None, None, None, None]
+        cmd = None
+        if self.table_sender.binary:
+            cmd = self.packet()
+        if cmd is None:
+            cmd = self.command()
         self.completed.clear()
         if not self.table_sender.has_slots.is_set():
-            print("No slots")
+            trace.sender.debug("No slots")
             return False
-        self.table_sender.send_command(cmd)
-        self.table_sender.indexed -= self.__indexed
+        self.command_received.clear()
+        self.crc_error = False
+        self.error = False
+        self.times[1] = time.monotonic()
+        self.Nid = self.table_sender.send_command(cmd, handler=self)
+        if not self.is_moving:
+            # single command, it is not sent together with others
+            self.table_sender.flush()
         return True
 
 # Movement actions
@@ -164,6 +183,11 @@ class Movement(MCUAction):
     def length(self):
         return None
 
+    # offset from source of movement after distance s along it
+    @abc.abstractmethod
+    def point(self, s):
+        return None
+
     def __init__(self, feed, acc, **kwargs):
         MCUAction.__init__(self, **kwargs)
         self.feed = feed
@@ -172,6 +196,30 @@ class Movement(MCUAction):
         self.acceleration = acc
         self.is_moving = True
 
+    # phases of feed profile, see common.feedprofile
+    def __profile(self):
+        return feedprofile.phases(self.length(), self.feed0, self.feed, self.feed1, self.acceleration)
+
+    # time of movement, seconds
+    def duration(self):
+        return sum(t for t, _, _ in self.__profile())
+
+    # distance along movement after t seconds from its start
+    def distance(self, t):
+        (t0, x0, f0), (tc, xc, f), (t1, x1, _) = self.__profile()
+        acc = self.acceleration
+        if t <= 0:
+            return 0
+        if t < t0:
+            return f0*t + acc*t**2/2
+        t -= t0
+        if t < tc:
+            return x0 + f*t
+        t -= tc
+        if t < t1:
+            return min(x0 + xc + f*t - acc*t**2/2, self.length())
+        return self.length()
+
     def _convert_axes(self, delta):
         # inverting axes
         if common.config.X_INVERT:
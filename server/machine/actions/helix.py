@@ -5,11 +5,11 @@ import math
 
 import common
 from common import config
+from common import binary
+from common import trace
 
 from . import action
 
-threshold = 1e-4
-
 class HelixMovement(action.Movement):
 
     class Axis(Enum):
@@ -17,25 +17,26 @@ class HelixMovement(action.Movement):
         yz = 18
         zx = 19
 
-    def command(self):
-        x, y, z = self._convert_axes(self.delta)
+    # direction, distance from chord to center and plane of arc
+    # in axes of MCU, plane is 17, 18 or 19
+    def __mcu_arc(self):
         ccw = self.ccw
         left = False
         hcl = self.hcl
         if self.axis == HelixMovement.Axis.xy:
-            dir_cmd = "G17 "
+            plane = 17
             if config.X_INVERT:
                 left = not left
             if config.Y_INVERT:
                 left = not left
         elif self.axis == HelixMovement.Axis.yz:
-            dir_cmd = "G18 "
+            plane = 18
             if config.Y_INVERT:
                 left = not left
             if config.Z_INVERT:
                 left = not left
         else:
-            dir_cmd = "G19 "
+            plane = 19
             if config.Z_INVERT:
                 left = not left
             if config.X_INVERT:
@@ -43,7 +44,13 @@ class HelixMovement(action.Movement):
         if left:
             ccw = not ccw
             hcl = -hcl
-        
+        return ccw, hcl, plane
+
+    def command(self):
+        x, y, z = self._convert_axes(self.delta)
+        ccw, hcl, plane = self.__mcu_arc()
+        dir_cmd = "G%i " % plane
+
         if ccw:
             type_cmd = "G3 "
         else:
@@ -56,6 +63,11 @@ class HelixMovement(action.Movement):
         code = type_cmd + feed_cmd + center_cmd + dir_cmd + delta_cmd
         return code
 
+    def packet(self):
+        ccw, hcl, plane = self.__mcu_arc()
+        return binary.arc(ccw, self.feed, self.feed0, self.feed1, self.acceleration,
+                          self._convert_axes(self.delta), plane, hcl)
+
     # find tangents to arc
     @staticmethod
     def __find_tangents(start_to_center, end_to_center, ccw, big):
@@ -100,7 +112,7 @@ class HelixMovement(action.Movement):
             raise Exception("Too small radius")
 
         # distance from arc center to horde
-        s = (radius**2 - (D/2)**2)**0.5
+        s = max(0, radius**2 - (D/2)**2)**0.5
 
         if (ccw is False and not big_arc) or (ccw is True and big_arc):
             # Clock wise or ccw with angle > 180
@@ -121,10 +133,8 @@ class HelixMovement(action.Movement):
         p0, p1 = HelixMovement.__find_tangents(start_to_center, end_to_center, ccw, big_arc)
 
         sina = D/(2 * radius)
-        if sina > 1 and sina < 1 + threshold:
-            sina = 1
-        if sina < -1 and sina > -1 - threshold:
-            sina = -1
+        # half of circle gives ratio a bit above 1 with rounding
+        sina = max(-1, min(1, sina))
 
         arc_angle = 2 * math.asin(sina)
         if big_arc:
@@ -151,10 +161,8 @@ class HelixMovement(action.Movement):
 
         p0, p1 = HelixMovement.__find_tangents(start_to_center, end_to_center, ccw, big_arc)
         sina = D/(2 * radius)
-        if sina > 1 and sina < 1 + threshold:
-            sina = 1
-        if sina < -1 and sina > -1 - threshold:
-            sina = -1
+        # half of circle gives ratio a bit above 1 with rounding
+        sina = max(-1, min(1, sina))
         
         arc_angle = 2 * math.asin(sina)
         if big_arc:
@@ -175,17 +183,25 @@ class HelixMovement(action.Movement):
             h = delta.y
         return d, h
 
+    # unit vector, ortogonal to plane of arc
+    @staticmethod
+    def normal(axis):
+        if axis == HelixMovement.Axis.xy:
+            return euclid3.Vector3(0, 0, 1)
+        elif axis == HelixMovement.Axis.yz:
+            return euclid3.Vector3(1, 0, 0)
+        return euclid3.Vector3(0, 1, 0)
+
+    # Helix moves along arc in plane and by h ortogonal to plane,
+    # so its tangents have component h / length along normal of plane
     @staticmethod
     def find_geometry(source, target, ccw, axis, **kwargs):
         d, h = HelixMovement.__get_d_h(target - source, axis)
 
-        # Now we don't support 'h'!
-        if abs(h) > 1e-4:
-            raise Exception("Arc don't support 'h'!")
-
         if "r" in kwargs.keys():
             radius = kwargs["r"]
             start_to_center, tan0, tan1, arc_angle = HelixMovement.__find_geometry_from_r(d, radius, ccw)
+            radius = abs(radius)
         else:
             if axis == HelixMovement.Axis.xy:
                 start_to_center = euclid3.Vector2(kwargs["i"], kwargs["j"])
@@ -208,30 +224,37 @@ class HelixMovement(action.Movement):
             dir_1 = euclid3.Vector3(tan1.y, 0, tan1.x)
             center = source + euclid3.Vector3(start_to_center[1], 0, start_to_center[0])
 
+        length = math.hypot(arc_angle * radius, h)
+        if h != 0 and length > 0:
+            normal = HelixMovement.normal(axis) * (h / length)
+            dir_0 = dir_0 * (arc_angle * radius / length) + normal
+            dir_1 = dir_1 * (arc_angle * radius / length) + normal
+
         return center, dir_0, dir_1, arc_angle
 
     @staticmethod
     def __find_horde_center_distance(radius, delta, center_side):
-        s = (radius**2 - (delta/2)**2)**0.5
+        s = max(0, radius**2 - (delta/2)**2)**0.5
         horde_center_distance = s * center_side
-        arc_angle = 2 * math.asin(delta/2 / radius)
+        arc_angle = 2 * math.asin(max(-1, min(1, delta/2 / radius)))
         return horde_center_distance, arc_angle
 
     def __init__(self, delta, source_to_center, axis, ccw, feed, acc, **kwargs):
         action.Movement.__init__(self, feed=feed, acc=acc, **kwargs)
         self.axis = axis
         self.delta = delta
+        self.source_to_center = source_to_center
         self.gcode = None
         self.ccw = ccw
         d, h = HelixMovement.__get_d_h(self.delta, axis)
+        start_to_center, _ = HelixMovement.__get_d_h(source_to_center, axis)
+        # movement ortogonal to plane of arc
+        self.h = h
 
-        # Now we don't support 'h'!
-        if abs(h) > 1e-4:
-            raise Exception("Arc doesn't support 'h'!")
+        radius = (start_to_center.magnitude() + (start_to_center - d).magnitude())/2
+        self.r = radius
 
-        radius = (source_to_center.magnitude() + (source_to_center - delta).magnitude())/2
-
-        center_side = HelixMovement.__find_center_side(source_to_center, delta)
+        center_side = HelixMovement.__find_center_side(start_to_center, d)
         if (center_side == -1 and ccw) or (center_side == 1 and not ccw):
             big_arc = False
         else:
@@ -241,11 +264,42 @@ class HelixMovement(action.Movement):
         if big_arc:
             self.angle = 2*math.pi - self.angle
         
-        self._length = self.angle * radius
+        self._length = math.hypot(self.angle * radius, h)
+
+        # curvature of helix, it limits feed with centripetal acceleration,
+        # pitch - movement ortogonal to plane for 1 radian
+        pitch = h / self.angle if self.angle > 0 else 0
+        self.curvature = radius / (radius**2 + pitch**2) if radius > 0 else math.inf
         if self._length == 0:
-            print("Len = 0")
-            print("radius = ", radius)
-            print("angle = ", self.angle)
+            trace.planner.warning("Zero length of arc, radius = %s, angle = %s", radius, self.angle)
 
     def length(self):
         return self._length
+
+    # coordinates of vector in plane of arc and back
+    def __to_plane(self, v):
+        if self.axis == HelixMovement.Axis.xy:
+            return v.x, v.y
+        elif self.axis == HelixMovement.Axis.yz:
+            return v.y, v.z
+        return v.z, v.x
+
+    def __from_plane(self, a, b):
+        if self.axis == HelixMovement.Axis.xy:
+            return euclid3.Vector3(a, b, 0)
+        elif self.axis == HelixMovement.Axis.yz:
+            return euclid3.Vector3(0, a, b)
+        return euclid3.Vector3(b, 0, a)
+
+    def point(self, s):
+        if self._length == 0 or s >= self._length:
+            return self.delta.copy()
+        part = max(s, 0) / self._length
+        phi = self.angle * part
+        if not self.ccw:
+            phi = -phi
+        a, b = self.__to_plane(-self.source_to_center)
+        c, d = self.__to_plane(self.source_to_center)
+        return self.__from_plane(c + a*math.cos(phi) - b*math.sin(phi),
+                                 d + a*math.sin(phi) + b*math.cos(phi)) + \
+               HelixMovement.normal(self.axis) * (self.h * part)
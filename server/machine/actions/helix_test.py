@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import math
+import random
+import euclid3
+
+from . import helix
+from .. import optimizer
+from ..program_builder_test import build
+
+def arcs(program):
+    return [(action, extra) for (_, action, _, extra) in program.actions
+            if isinstance(action, helix.HelixMovement)]
+
+def close(a, b, eps=1e-6):
+    return (a - b).magnitude() < eps
+
+def test_helix_geometry():
+    # half of turn with r = 5 and pitch 4 mm/turn
+    (arc, extra), = arcs(build("G17 G2 X10 Y0 Z-2 I5 J0 F300\nM2\n"))
+    length = math.hypot(5 * math.pi, 2)
+    assert abs(arc.length() - length) < 1e-9
+    assert abs(arc.h + 2) < 1e-9
+    # tangents go down with pitch
+    assert close(extra["dir0"], euclid3.Vector3(0, 5 * math.pi, -2) / length)
+    assert close(extra["dir1"], euclid3.Vector3(0, -5 * math.pi, -2) / length)
+    assert close(arc.point(length / 2), euclid3.Vector3(5, 5, -1))
+    assert close(arc.point(length), euclid3.Vector3(10, 0, -2))
+    # curvature of helix is smaller, than of its arc
+    p = 2 / math.pi
+    assert abs(arc.curvature - 5 / (25 + p**2)) < 1e-9
+
+def test_planes():
+    for text, h in [("G18 G3 Z10 X0 Y3 K5 F300\n", euclid3.Vector3(0, 3, 0)),
+                    ("G19 G3 Y10 Z0 X3 J5 F300\n", euclid3.Vector3(3, 0, 0))]:
+        (arc, extra), = arcs(build(text + "M2\n"))
+        length = math.hypot(5 * math.pi, 3)
+        assert abs(arc.length() - length) < 1e-9
+        assert abs(extra["dir0"].dot(h / 3) - 3 / length) < 1e-9
+        assert close(arc.point(length), arc.delta)
+        # middle of helix is on circle, lifted by half of h
+        middle = arc.point(length / 2) - h / 2
+        assert abs((middle - arc.source_to_center).magnitude() - 5) < 1e-9
+
+def test_full_turns():
+    # thread milling: 3 turns, pitch 1.5 mm
+    program = build("G91 G17\n" + "G3 X0 Y0 Z-1.5 I4 J0 F200\n" * 3 + "M2\n")
+    items = arcs(program)
+    assert len(items) == 6
+    total = sum(arc.length() for arc, _ in items)
+    assert abs(total - 3 * math.hypot(8 * math.pi, 1.5)) < 1e-6
+    end = items[-1][1]["target"]
+    assert close(end, euclid3.Vector3(0, 0, -4.5))
+    # turns are smooth
+    for (_, extra0), (_, extra1) in zip(items[:-1], items[1:]):
+        assert close(extra0["target"], extra1["source"])
+        assert extra0["dir1"].dot(extra1["dir0"]) > 1 - 1e-9
+
+def test_random_full_turns():
+    # halfs of turn have chord equal to diameter, rounding must not break them
+    rnd = random.Random(1)
+    for _ in range(300):
+        x, y, i, j = [round(rnd.uniform(-a, a), 4) for a in [10, 10, 2, 2]]
+        z = rnd.choice(["", " Z%.4f" % rnd.uniform(-3, 3)])
+        g = rnd.choice(["G2", "G3"])
+        text = "G0 X%.4f Y%.4f\n%s X%.4f Y%.4f%s I%.4f J%.4f F300\nM2\n" % (x, y, g, x, y, z, i, j)
+        items = arcs(build(text))
+        assert len(items) == 2
+        r = math.hypot(i, j)
+        total = sum(arc.angle for arc, _ in items)
+        assert abs(total - 2 * math.pi) < 1e-6
+        for arc, _ in items:
+            assert abs(arc.r - r) < 1e-6
+        assert close(items[0][1]["target"], items[1][1]["source"])
+
+def test_planner_limit():
+    program = build("G91 G17\n" + "G3 X0 Y0 Z-1 I1 J0 F800\n" * 3 + "M2\n")
+    optimizer.Optimizer(20, 40, 800).optimize(program)
+    for arc, _ in arcs(program):
+        assert arc.feed <= (40 / arc.curvature)**0.5 * 60 + 1e-6
+        assert arc.feed > (40 * 1)**0.5 * 60
+    # helix is passed without stops between halfs of turns
+    items = arcs(program)
+    for (arc0, _), (arc1, _) in zip(items[:-1], items[1:]):
+        assert arc0.feed1 > 1 and abs(arc0.feed1 - arc1.feed0) < 1e-6
+
+def test_command():
+    (arc, _), = arcs(build("G17 G2 X10 Y0 Z-2 I5 J0 F300\nM2\n"))
+    arc.feed0 = 0
+    arc.feed1 = 0
+    # one command moves along helix, see sender.mcuemulator
+    x, y, z = arc._convert_axes(arc.delta)
+    command = arc.command()
+    assert command.startswith("G") and ("Z%.2f" % z) in command
@@ -1,6 +1,7 @@
 import euclid3
 import time
 import common
+from common import binary
 
 from . import action
 
@@ -13,6 +14,10 @@ class LinearMovement(action.Movement):
         code = g1 + g2
         return code
 
+    def packet(self):
+        return binary.line(self.feed, self.feed0, self.feed1, self.acceleration,
+                           self._convert_axes(self.delta))
+
     def __init__(self, delta, feed, acc, **kwargs):
         action.Movement.__init__(self, feed=feed, acc=acc, **kwargs)
         self.delta = delta
@@ -21,6 +26,12 @@ class LinearMovement(action.Movement):
     def length(self):
         return self.delta.magnitude()
 
+    def point(self, s):
+        l = self.length()
+        if l == 0:
+            return self.delta.copy()
+        return self.delta * (min(s, l) / l)
+
     @staticmethod
     def find_geometry(source, target):
         delta = target - source
@@ -24,6 +24,10 @@ class SpindleOn(action.ToolAction):
         self.speed = speed
         self.cw = cw
 
+    # time of spindle acceleration, seconds
+    def delay(self):
+        return config.SPINDLE_DELAY * self.speed / config.SPINDLE_MAX
+
     def perform(self):
         print("Spindle on, speed = %lf" % self.speed)
         self.sender.set_speed(self.speed)
@@ -31,7 +35,7 @@ class SpindleOn(action.ToolAction):
             self.sender.start_forward()
         else:
             self.sender.start_reverse()
-        time.sleep(config.SPINDLE_DELAY * self.speed / config.SPINDLE_MAX)
+        time.sleep(self.delay())
         return True
 
 class SpindleSetSpeed(action.ToolAction):
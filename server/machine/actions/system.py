@@ -7,6 +7,7 @@ class TableReset(action.Action):
     
     def act(self):
         self.sender.send_command("M999", wait=False)
+        self.sender.flush()
         return False
 
 class TableUnlock(action.MCUAction):
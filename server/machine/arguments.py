@@ -1,136 +1,75 @@
-class Positioning(object):
+import copy
 
-    is_moving = False
-    X = None
-    Y = None
-    Z = None
-    R = None
-    I = None
-    J = None
-    K = None
+# Words of frame, found in one pass over frame
+#
+# Each word, except N, G and M, can be met only once in frame.
+# N is line number only if it is first word of frame.
+# G and M codes are stored in order of frame, codes - both of them
+# as (type, value) pairs, for processing, which depends on their order.
+class Arguments(object):
 
-    def __init__(self, frame):
-        for cmd in frame.commands:
-            if cmd.type == "X":
-                if self.X != None:
-                    raise Exception("X meets 2 times")
-                self.X = cmd.value
-                self.is_moving = True
-            elif cmd.type == "Y":
-                if self.Y != None:
-                    raise Exception("Y meets 2 times")
-                self.Y = cmd.value
-                self.is_moving = True
-            elif cmd.type == "Z":
-                if self.Z != None:
-                    raise Exception("Z meets 2 times")
-                self.Z = cmd.value
-                self.is_moving = True
-            elif cmd.type == "R":
-                if self.R != None:
-                    raise Exception("R meets 2 times")
-                self.R = cmd.value
-            elif cmd.type == "I":
-                if self.I != None:
-                    raise Exception("I meets 2 times")
-                self.I = cmd.value
-            elif cmd.type == "J":
-                if self.J != None:
-                    raise Exception("J meets 2 times")
-                self.J = cmd.value
-            elif cmd.type == "K":
-                if self.K != None:
-                    raise Exception("K meets 2 times")
-                self.K = cmd.value
-
-    def as_inches(self):
-        if self.X is not None:
-            self.X *= 25.4
-        if self.Y is not None:
-            self.Y *= 25.4
-        if self.Z is not None:
-            self.Z *= 25.4
-        if self.R is not None:
-            self.R *= 25.4
-        if self.I is not None:
-            self.I *= 25.4
-        if self.J is not None:
-            self.J *= 25.4
-        if self.K is not None:
-            self.K *= 25.4
-
-class Feed(object):
-
-    feed = None
-        
-    def __init__(self, frame):
-        for cmd in frame.commands:
-            if cmd.type == "F":
-                if self.feed != None:
-                    raise Exception("F meets 2 times")
-                self.feed = cmd.value
-
-class SpindleSpeed(object):
-        
-    speed = None
-        
-    def __init__(self, frame):
-        for cmd in frame.commands:
-            if cmd.type == "S":
-                if self.speed != None:
-                    raise Exception("S meets 2 times")
-                self.speed = cmd.value
-
-class Tool(object):
+    __slots__ = ("N", "X", "Y", "Z", "R", "I", "J", "K", "F", "S", "T", "P", "L",
+                 "G", "M", "codes", "is_moving")
 
-    tool = None
-        
-    def __init__(self, frame):
-        for cmd in frame.commands:
-            if cmd.type == "T":
-                if self.tool != None:
-                    raise Exception("T meets 2 times")
-                self.tool = cmd.value
+    __words = frozenset("XYZRIJKFSTPL")
+    __lengths = ("X", "Y", "Z", "R", "I", "J", "K")
 
-class ProgramId(object):
-        
-    program = None
-    num = None
- 
     def __init__(self, frame):
-        for cmd in frame.commands:
-            if cmd.type == "P":
-                if self.program != None:
-                    raise Exception("P meets 2 times")
-                self.program = cmd.value
-            if cmd.type == "L":
-                if self.num != None:
-                    raise Exception("L meets 2 times")
-                self.num = cmd.value
-        if self.program != None and self.num is None:
-            self.num = 1
+        self.N = None
+        self.X = None
+        self.Y = None
+        self.Z = None
+        self.R = None
+        self.I = None
+        self.J = None
+        self.K = None
+        self.F = None
+        self.S = None
+        self.T = None
+        self.P = None
+        self.L = None
+        self.G = []
+        self.M = []
+        self.codes = []
 
-class LineNumber(object):
+        commands = frame.commands
+        numbered = len(commands) > 0 and commands[0].type == "N"
+        for cmd in commands:
+            t = cmd.type
+            if t == "G":
+                self.G.append(cmd.value)
+                self.codes.append((t, cmd.value))
+            elif t == "M":
+                self.M.append(cmd.value)
+                self.codes.append((t, cmd.value))
+            elif t in self.__words:
+                if getattr(self, t) is not None:
+                    raise Exception("%s meets 2 times" % t)
+                setattr(self, t, cmd.value)
+            elif t == "N" and numbered:
+                if cmd is not commands[0]:
+                    raise Exception("N can only be first word")
+        if numbered:
+            self.N = int(commands[0].value)
 
-    N = None
+        self.is_moving = self.X is not None or self.Y is not None or self.Z is not None
 
-    def __init__(self, frame):
-        if len(frame.commands) == 0:
-            return
-        if frame.commands[0].type != 'N':
-            return
-            
-        rep = [cmd for cmd in frame.commands[1:] if cmd.type == "N" ]
-        if len(rep) > 0:
-            raise Exception("N can only be first word")
-        self.N = int(frame.commands[0].value)
+    @property
+    def exact_stop(self):
+        return 9 in self.G
 
-class ExactStop(object):
+    # amount of subprogram calls
+    @property
+    def num(self):
+        if self.L is None and self.P is not None:
+            return 1
+        return self.L
 
-    exact_stop = False
-
-    def __init__(self, frame):
-        for cmd in frame.commands:
-            if cmd.type == "G" and cmd.value == 9:
-                self.exact_stop = True
-                break
+    # copy with lengths, converted from inches to mm
+    def as_inches(self):
+        args = copy.copy(self)
+        for name in self.__lengths:
+            value = getattr(args, name)
+            if value is not None:
+                setattr(args, name, value * 25.4)
+        return args
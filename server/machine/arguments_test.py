@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+from . import parser
+
+def decode(line):
+    return parser.GFastLineParser().parse(line).decode()
+
+def fails(line):
+    try:
+        decode(line)
+    except Exception:
+        return True
+    return False
+
+def test_words():
+    args = decode("N10 G1 G91 X1 Y2 Z3 F100 S2000 T2 M3 M8\n")
+    assert args.N == 10
+    assert (args.X, args.Y, args.Z) == (1, 2, 3)
+    assert (args.F, args.S, args.T) == (100, 2000, 2)
+    assert args.G == [1, 91]
+    assert args.M == [3, 8]
+    assert args.codes == [("G", 1), ("G", 91), ("M", 3), ("M", 8)]
+    assert args.is_moving
+    assert not args.exact_stop
+    assert decode("G9 G1 Z1\n").exact_stop
+    assert not decode("G1 F100\n").is_moving
+
+def test_subprogram():
+    assert decode("M97 P3 L5\n").num == 5
+    assert decode("M97 P3\n").num == 1
+    assert decode("M97\n").num is None
+
+def test_duplicates():
+    for line in ["G1 X1 X2\n", "F1 F2\n", "S1 S2\n", "T1 T2\n", "M97 P1 P2\n", "N1 G1 N2\n"]:
+        assert fails(line)
+    # N not in begin of frame is ignored
+    assert decode("G1 N2 N3\n").N is None
+    assert not fails("G1 G2 M3 M5\n")
+
+def test_inches():
+    args = decode("G1 X1 I2 F10\n")
+    inches = args.as_inches()
+    assert inches.X == 25.4 and inches.I == 50.8 and inches.F == 10
+    assert args.X == 1
+
+def test_decoded_once():
+    frame = parser.GFastLineParser().parse("G1 X1\n")
+    assert frame.decode() is frame.decode()
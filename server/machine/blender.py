@@ -0,0 +1,131 @@
+import math
+import euclid3
+
+from .actions import linear
+from .actions import helix
+
+# Blending of corners between linear movements (G64 P)
+#
+# Corner between two linear movements with tolerance is replaced with
+# arc, tangent to both of them, which doesn't deviate from the corner
+# more than tolerance. Feed isn't reduced in the corner then, only
+# radius of arc limits it, see optimizer.Optimizer. Each movement gives
+# not more than half of its length to the arc, so arcs don't overlap.
+#
+# Corners of movements, which don't lie in plane XY, YZ or ZX,
+# reversals and not linear movements are left as they are.
+# Tolerance of movement is extra["tolerance"], see program.Program.
+
+# angles of corners, which are not blended, radians
+MIN_ANGLE = 1e-3
+MAX_ANGLE = math.pi - 1e-3
+
+# normal of plane -> axis of arc, and component of normal, which is positive for ccw arcs
+_planes = [(helix.HelixMovement.Axis.yz, 0),
+           (helix.HelixMovement.Axis.zx, 1),
+           (helix.HelixMovement.Axis.xy, 2)]
+
+def _tolerance(item):
+    _, action, _, extra = item
+    if extra is None or not isinstance(action, linear.LinearMovement):
+        return 0
+    return extra.get("tolerance", 0)
+
+def _shorten(item, begin, end):
+    index, action, line, extra = item
+    extra = dict(extra)
+    extra["source"] = extra["source"] + begin
+    extra["move_source"] = extra["move_source"] + begin
+    extra["target"] = extra["target"] - end
+    extra["move_target"] = extra["move_target"] - end
+    movement = linear.LinearMovement(delta=extra["move_target"] - extra["move_source"],
+                                     feed=action.feed,
+                                     acc=action.acceleration,
+                                     sender=action.table_sender)
+    movement.line = action.line
+    return (index, movement, line, extra)
+
+# replace corner of items with arc, returns (first, arc, second) or None
+def blend_corner(first, second, tolerance):
+    if tolerance <= 0:
+        return None
+    _, action0, _, extra0 = first
+    index, action1, line, extra1 = second
+    l0 = action0.length()
+    l1 = action1.length()
+    if l0 == 0 or l1 == 0:
+        return None
+    u = extra0["dir1"]
+    v = extra1["dir0"]
+    cosa = max(min(u.dot(v), 1), -1)
+    angle = math.acos(cosa)
+    if angle < MIN_ANGLE or angle > MAX_ANGLE:
+        return None
+
+    normal = u.cross(v)
+    normal /= normal.magnitude()
+    for axis, component in _planes:
+        if abs(abs(normal[component]) - 1) < 1e-9:
+            ccw = normal[component] > 0
+            break
+    else:
+        return None
+
+    # arc with radius r deviates from corner by r * (1/cos(angle/2) - 1)
+    # and touches movements on distance r * tan(angle/2) from corner
+    half = angle / 2
+    r = tolerance * math.cos(half) / (1 - math.cos(half))
+    d = r * math.tan(half)
+    if d > min(l0, l1) / 2:
+        d = min(l0, l1) / 2
+        r = d / math.tan(half)
+
+    first = _shorten(first, euclid3.Vector3(), u * d)
+    second = _shorten(second, v * d, euclid3.Vector3())
+    # direction from begin of arc to its center
+    side = v - u * cosa
+    side /= side.magnitude()
+    extra = {
+        "source" : first[3]["target"],
+        "target" : second[3]["source"],
+        "move_source" : first[3]["move_target"],
+        "move_target" : second[3]["move_source"],
+        "dir0" : u,
+        "dir1" : v,
+    }
+    arc = helix.HelixMovement(delta=extra["move_target"] - extra["move_source"],
+                              source_to_center=side * r,
+                              axis=axis,
+                              ccw=ccw,
+                              feed=action1.feed,
+                              acc=action1.acceleration,
+                              sender=action1.table_sender)
+    arc.line = action1.line
+    return first, (index, arc, line, extra), second
+
+# blend corners of actions, given by iterator, and give them out
+def blend(actions):
+    previous = None
+    for item in actions:
+        if previous is None:
+            if _tolerance(item) > 0:
+                previous = item
+            else:
+                yield item
+            continue
+
+        tolerance = min(_tolerance(previous), _tolerance(item))
+        blended = blend_corner(previous, item, tolerance)
+        if blended is None:
+            yield previous
+            previous = item if _tolerance(item) > 0 else None
+            if previous is None:
+                yield item
+            continue
+        first, arc, second = blended
+        yield first
+        yield arc
+        previous = second
+
+    if previous is not None:
+        yield previous
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import math
+
+from . import optimizer
+from . import simulator
+from .actions import helix
+from .actions import linear
+from .program_builder_test import build
+
+def moving(program):
+    return [item for item in program.actions if item[1].is_moving and item[3] is not None]
+
+def kinds(program):
+    return [type(action).__name__ for (_, action, _, _) in program.actions]
+
+# polygon, which approximates circle with radius 20
+def polygon(n, header):
+    lines = [header, "G1 X20 Y0 F800"]
+    for i in range(1, n + 1):
+        a = 2 * math.pi * i / n
+        lines.append("X%.4f Y%.4f" % (20 * math.cos(a), 20 * math.sin(a)))
+    lines.append("M2")
+    return "\n".join(lines) + "\n"
+
+def test_no_tolerance():
+    program = build("G1 X10 F600\nY10\nX0\nM2\n")
+    assert "HelixMovement" not in kinds(program)
+
+def test_square_corners():
+    square = "G1 X10 Y0 F600\nY10\nX0\nY0\nM2\n"
+    program = build("G64 P0.1\n" + square)
+    items = moving(program)
+    assert [type(action) for (_, action, _, _) in items] == \
+        [linear.LinearMovement, helix.HelixMovement] * 3 + [linear.LinearMovement]
+
+    corners = [(10, 0), (10, 10), (0, 10)]
+    for (_, arc, _, extra), corner in zip(items[1::2], corners):
+        assert arc.ccw
+        # arc is tangent to lines and deviates from corner by tolerance
+        center = extra["move_source"] + arc.source_to_center
+        assert abs(arc.source_to_center.magnitude() - arc.r) < 1e-6
+        assert abs((center - extra["move_target"]).magnitude() - arc.r) < 1e-6
+        middle = extra["move_source"] + arc.point(arc.length() / 2)
+        deviation = math.hypot(middle.x - corner[0], middle.y - corner[1])
+        assert abs(deviation - 0.1) < 1e-6
+
+    # path is continuous and goes to programmed end
+    for (_, _, _, extra0), (_, _, _, extra1) in zip(items[:-1], items[1:]):
+        assert (extra0["move_target"] - extra1["move_source"]).magnitude() < 1e-9
+    end = items[-1][3]["move_target"]
+    assert (end.x, end.y, end.z) == (0, 0, 0)
+    total = sum(action.length() for (_, action, _, _) in items)
+    assert total < 40
+
+def test_short_movements():
+    # arc takes not more than half of movement
+    program = build("G64 P5\nG1 X1 F600\nY1\nM2\n")
+    first, arc, second = moving(program)
+    assert abs(first[1].length() - 0.5) < 1e-9
+    assert abs(second[1].length() - 0.5) < 1e-9
+    assert abs(arc[1].r - 0.5) < 1e-9
+
+def test_not_blended():
+    # exact stop, reversal, corner out of planes, G64 without P
+    for text in ["G64 P0.1\nG9 G1 X10 F600\nY10\nM2\n",
+                 "G64 P0.1\nG1 X10 F600\nX0\nM2\n",
+                 "G64 P0.1\nG1 X10 F600\nY10 Z10\nM2\n",
+                 "G64 P0.1\nG64 G1 X10 F600\nY10\nM2\n",
+                 "G64 P0.1\nG61 G1 X10 F600\nY10\nX0\nM2\n"]:
+        assert "HelixMovement" not in kinds(build(text))
+
+def test_exact_stop_mode():
+    program = build("G61\nG1 X10 F600\nY10\nG64\nX0\nY0\nM2\n")
+    names = [name for name in kinds(program) if name in ["LinearMovement", "Break"]]
+    assert names == ["LinearMovement", "Break", "LinearMovement", "Break", "LinearMovement", "LinearMovement"]
+
+def test_planes():
+    program = build("G64 P0.1\nG1 Y10 F600\nZ10\nX-10\nM2\n")
+    arcs = [action for (_, action, _, _) in program.actions if isinstance(action, helix.HelixMovement)]
+    assert [arc.axis for arc in arcs] == [helix.HelixMovement.Axis.yz, helix.HelixMovement.Axis.zx]
+    assert [arc.ccw for arc in arcs] == [True, False]
+
+def test_faster_polygon():
+    times = []
+    for header in ["G64", "G64 P0.05"]:
+        program = build(polygon(40, header))
+        optimizer.Optimizer(20, 40, 800).optimize(program)
+        times.append(simulator.simulate(program).time)
+    assert times[1] < times[0] * 0.7
@@ -0,0 +1,263 @@
+import os
+import gc
+import array
+import struct
+import hashlib
+
+from . import parser
+
+import common.config
+from common import trace
+
+# Cache of parsed programs and optimized feeds on disk
+#
+# Frames are stored by hash of program text. Optimized feeds are stored by
+# hash of program text, state of builder at start, optimizer dynamic
+# properties, tool table and configuration, so they are found before the
+# program is built. Files are removed in least recently used order, when
+# total size of cache exceeds max_size.
+#
+# Each file is a header and arrays in native byte order:
+#   magic (4 bytes), version (uint32), amount of arrays (uint32)
+#   for each array: typecode (1 byte), size in bytes (uint64), data
+class ProgramCache(object):
+
+    VERSION = 2
+
+    __magic = b"NCPC"
+    __header = struct.Struct("<4sII")
+    __array_header = struct.Struct("<cQ")
+
+    # kinds of command values
+    __INT = 0
+    __FLOAT = 1
+    __STR = 2
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    #region files
+    def __file(self, key, kind):
+        return os.path.join(self.path, key + "." + kind)
+
+    def __write(self, key, kind, arrays):
+        name = self.__file(key, kind)
+        tmp = name + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(self.__header.pack(self.__magic, self.VERSION, len(arrays)))
+            for arr in arrays:
+                f.write(self.__array_header.pack(arr.typecode.encode("ascii"), len(arr) * arr.itemsize))
+                arr.tofile(f)
+        os.replace(tmp, name)
+        self.__evict()
+
+    def __read(self, key, kind):
+        name = self.__file(key, kind)
+        try:
+            with open(name, "rb") as f:
+                data = memoryview(f.read())
+        except OSError:
+            return None
+        try:
+            magic, version, n = self.__header.unpack_from(data, 0)
+            if magic != self.__magic or version != self.VERSION:
+                raise Exception("Invalid cache file %s" % name)
+            pos = self.__header.size
+            arrays = []
+            for _ in range(n):
+                typecode, size = self.__array_header.unpack_from(data, pos)
+                pos += self.__array_header.size
+                if pos + size > len(data):
+                    raise Exception("Truncated cache file %s" % name)
+                arr = array.array(typecode.decode("ascii"))
+                arr.frombytes(data[pos:pos + size])
+                pos += size
+                arrays.append(arr)
+        except Exception as e:
+            trace.planner.warning("Can not read cache %s: %s", name, e)
+            os.remove(name)
+            return None
+        # mark as recently used
+        os.utime(name)
+        return arrays
+
+    def __evict(self):
+        files = []
+        total = 0
+        for entry in os.scandir(self.path):
+            if not entry.is_file():
+                continue
+            st = entry.stat()
+            files.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+    #endregion files
+
+    #region frames
+    @staticmethod
+    def lines_key(lines):
+        h = hashlib.sha256()
+        for line in lines:
+            data = line.encode("utf-8")
+            h.update(struct.pack("<Q", len(data)))
+            h.update(data)
+        return h.hexdigest()
+
+    @staticmethod
+    def data_key(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def __text(strings):
+        lengths = array.array('I', [len(s) for s in strings])
+        text = array.array('B', "".join(strings).encode("utf-8"))
+        return lengths, text
+
+    @staticmethod
+    def __split(text, lengths):
+        strings = []
+        pos = 0
+        for length in lengths:
+            strings.append(text[pos:pos + length])
+            pos += length
+        return strings
+
+    def save_frames(self, key, frames):
+        ncmds = array.array('I')
+        ncomments = array.array('I')
+        types = []
+        kinds = array.array('b')
+        ints = array.array('q')
+        floats = array.array('d')
+        strs = []
+        comments = []
+        try:
+            for frame in frames:
+                ncmds.append(len(frame.commands))
+                ncomments.append(len(frame.comments))
+                for cmd in frame.commands:
+                    types.append(cmd.type)
+                    if type(cmd.value) is int:
+                        kinds.append(self.__INT)
+                        ints.append(cmd.value)
+                    elif type(cmd.value) is float:
+                        kinds.append(self.__FLOAT)
+                        floats.append(cmd.value)
+                    else:
+                        kinds.append(self.__STR)
+                        strs.append(cmd.value)
+                comments += frame.comments
+        except OverflowError:
+            trace.planner.warning("Program can not be cached")
+            return
+        str_lengths, str_text = self.__text(strs)
+        comment_lengths, comment_text = self.__text(comments)
+        _, types_text = self.__text(types)
+        self.__write(key, "frames", [ncmds, ncomments, kinds, ints, floats,
+                                     str_lengths, str_text,
+                                     comment_lengths, comment_text,
+                                     types_text])
+
+    def load_frames(self, key):
+        arrays = self.__read(key, "frames")
+        if arrays is None:
+            return None
+        ncmds, ncomments, kinds, ints, floats, \
+            str_lengths, str_text, comment_lengths, comment_text, types_text = arrays
+        strs = str_text.tobytes().decode("utf-8")
+        comments = comment_text.tobytes().decode("utf-8")
+        types = types_text.tobytes().decode("utf-8")
+
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            strs = self.__split(strs, str_lengths)
+            comments = self.__split(comments, comment_lengths)
+            # values in order of commands
+            values = [iter(ints).__next__, iter(floats).__next__, iter(strs).__next__]
+            values = [values[kind]() for kind in kinds]
+            commands = list(map(parser.GCmd.make, types, values))
+
+            frames = []
+            ci = 0
+            ki = 0
+            for n in range(len(ncmds)):
+                frame = parser.GFrame(commands[ci:ci + ncmds[n]])
+                ci += ncmds[n]
+                if ncomments[n] > 0:
+                    frame.comments = comments[ki:ki + ncomments[n]]
+                    ki += ncomments[n]
+                frames.append(frame)
+        finally:
+            if enabled:
+                gc.enable()
+        return frames
+    #endregion frames
+
+    #region feeds
+    # key of optimized feeds. Program, built from same text (source is
+    # lines_key of it) from same state of builder (see
+    # ProgramBuilder.state_key) with same configuration, has same movements
+    def plan_key(self, source, state, optimizer, tools):
+        h = hashlib.sha256()
+        settings = sorted((name, value) for name, value in vars(common.config).items()
+                          if name.isupper())
+        options = (self.VERSION, source, state, optimizer.max_acc, optimizer.max_jerk,
+                   optimizer.max_feed, optimizer.planner, sorted(tools.items()), settings)
+        h.update(repr(options).encode("utf-8"))
+        return h.hexdigest()
+
+    # feeds of compact program, see compact_program.CompactProgram
+    def save_plan(self, key, program):
+        self.__write(key, "plan", [program.feed0, program.feed, program.feed1])
+
+    # set optimized feeds to program, returns False if they are not found
+    def load_plan(self, key, program):
+        arrays = self.__read(key, "plan")
+        if arrays is None:
+            return False
+        feed0, feed, feed1 = arrays
+        if len(feed) != len(program):
+            return False
+        program.feed0 = feed0
+        program.feed = feed
+        program.feed1 = feed1
+        return True
+
+    # optimized movements of program of action objects, see Optimizer.optimize
+    @staticmethod
+    def __movements(program):
+        return [action for (_, action, _, extra) in program.actions
+                if action.is_moving and extra is not None]
+
+    def save_actions_plan(self, key, program):
+        movements = self.__movements(program)
+        self.__write(key, "actions", [array.array('d', [action.feed0 for action in movements]),
+                                      array.array('d', [action.feed for action in movements]),
+                                      array.array('d', [action.feed1 for action in movements])])
+
+    # set optimized feeds to movements of program, returns False if they are not found
+    def load_actions_plan(self, key, program):
+        arrays = self.__read(key, "actions")
+        if arrays is None:
+            return False
+        movements = self.__movements(program)
+        feed0, feed, feed1 = arrays
+        if len(feed) != len(movements):
+            return False
+        for i, action in enumerate(movements):
+            action.feed0 = feed0[i]
+            action.feed = feed[i]
+            action.feed1 = feed1[i]
+        return True
+    #endregion feeds
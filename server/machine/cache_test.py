@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import os
+import time
+
+import common
+
+from . import cache
+from . import parser
+from . import optimizer
+from . import compact_program
+from .parser_test import lines, example_files, same_frames
+from .optimizer_test import build_example
+
+def test_frames(tmp_path):
+    c = cache.ProgramCache(str(tmp_path), 1024 * 1024)
+    fast = parser.GFastLineParser()
+    for text in [lines[:-1]] + [open(name).readlines() for name in example_files()]:
+        expected = fast.parse_lines(text)
+        key = c.lines_key(text)
+        assert c.load_frames(key) is None
+        c.save_frames(key, expected)
+        frames = c.load_frames(key)
+        assert len(frames) == len(expected)
+        for a, b in zip(expected, frames):
+            same_frames(a, b)
+
+def test_keys():
+    assert cache.ProgramCache.lines_key(["G0 X1\n", "G1 Y2\n"]) != \
+           cache.ProgramCache.lines_key(["G0 X1\nG1 Y2\n"])
+    assert cache.ProgramCache.data_key(b"G0 X1\n") != cache.ProgramCache.data_key(b"G0 X2\n")
+
+def compact(name):
+    source = build_example(name)
+    program = compact_program.CompactProgram(source, 16)
+    program.extend(source.actions)
+    return program
+
+def test_plan(tmp_path):
+    c = cache.ProgramCache(str(tmp_path), 1024 * 1024)
+    opt = optimizer.Optimizer(20, 40, 800)
+    program = compact("box.gcode")
+    key = c.plan_key("box", (), opt, {})
+    assert not c.load_plan(key, program)
+    opt.optimize_compact(program)
+    c.save_plan(key, program)
+
+    loaded = compact("box.gcode")
+    assert c.plan_key("box", (), opt, {}) == key
+    assert c.load_plan(key, loaded)
+    assert list(loaded.feed0) == list(program.feed0)
+    assert list(loaded.feed) == list(program.feed)
+    assert list(loaded.feed1) == list(program.feed1)
+
+    assert c.plan_key("other", (), opt, {}) != key
+    assert c.plan_key("box", ((1, 2, 3),), opt, {}) != key
+    assert c.plan_key("box", (), optimizer.Optimizer(20, 50, 800), {}) != key
+    assert c.plan_key("box", (), opt, {1 : 3.0}) != key
+
+def test_plan_config(tmp_path, monkeypatch):
+    c = cache.ProgramCache(str(tmp_path), 1024 * 1024)
+    opt = optimizer.Optimizer(20, 40, 800)
+    key = c.plan_key("box", (), opt, {})
+    monkeypatch.setattr(common.config, "MERGE_COLINEAR", not common.config.MERGE_COLINEAR)
+    assert c.plan_key("box", (), opt, {}) != key
+
+def movements(program):
+    return [(action.feed0, action.feed, action.feed1) for (_, action, _, extra) in program.actions
+            if action.is_moving and extra is not None]
+
+def test_actions_plan(tmp_path):
+    c = cache.ProgramCache(str(tmp_path), 1024 * 1024)
+    opt = optimizer.Optimizer(20, 40, 800)
+    program = build_example("box.gcode")
+    key = c.plan_key("box", (), opt, {})
+    assert not c.load_actions_plan(key, program)
+    opt.optimize(program)
+    c.save_actions_plan(key, program)
+
+    loaded = build_example("box.gcode")
+    assert movements(loaded) != movements(program)
+    assert c.load_actions_plan(key, loaded)
+    assert movements(loaded) == movements(program)
+    # plans of compact and of object programs are different files
+    assert not c.load_plan(key, compact("box.gcode"))
+
+def test_eviction(tmp_path):
+    c = cache.ProgramCache(str(tmp_path), 4096)
+    fast = parser.GFastLineParser()
+    frames = fast.parse_lines(["G1 X%i Y%i\n" % (i, i) for i in range(50)])
+    keys = ["%02i" % i for i in range(10)]
+    for key in keys:
+        c.save_frames(key, frames)
+        # files differ by modification time
+        time.sleep(0.01)
+    assert c.size() <= 4096
+    assert c.load_frames(keys[0]) is None
+    assert c.load_frames(keys[-1]) is not None
+
+def test_broken_file(tmp_path):
+    c = cache.ProgramCache(str(tmp_path), 1024 * 1024)
+    c.save_frames("key", parser.GFastLineParser().parse_lines(lines[:-1]))
+    name = os.path.join(str(tmp_path), "key.frames")
+    data = open(name, "rb").read()
+    open(name, "wb").write(data[:len(data) // 2])
+    assert c.load_frames("key") is None
+    assert not os.path.exists(name)
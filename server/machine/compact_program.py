@@ -0,0 +1,208 @@
+import math
+import array
+import euclid3
+
+from .actions import linear
+from .actions import helix
+
+from .common import event
+
+# Kinds of program items
+KIND_ACTION = 0
+KIND_LINEAR = 1
+KIND_ARC_CW = 2
+KIND_ARC_CCW = 3
+
+# Program, which movements are stored in columns
+#
+# Movement objects are materialized, when they are requested, and only
+# last `keep` of them and ones, which are not finished yet, are stored.
+# Other actions (spindle, tools, pauses, ...) and movements without
+# geometry (homing) are stored as objects, there are few of them.
+class CompactProgram(object):
+
+    __axes = [helix.HelixMovement.Axis.xy,
+              helix.HelixMovement.Axis.yz,
+              helix.HelixMovement.Axis.zx]
+
+    def __init__(self, program, keep):
+        self.table_sender = program.table_sender
+        self.spindle_sender = program.spindle_sender
+        self.reset_coordinates_ev = program.reset_coordinates_ev
+        self.update_current_cs_ev = program.update_current_cs_ev
+        self.action_created = event.EventEmitter()
+        self.keep = keep
+
+        self.kind = array.array('b')
+        self.index = array.array('q')
+        self.line = array.array('q')
+        self.feed = array.array('d')
+        self.acc = array.array('d')
+        self.feed0 = array.array('d')
+        self.feed1 = array.array('d')
+        self.length = array.array('d')
+        # radius of curvature of arc, nan for lines
+        self.radius = array.array('d')
+        self.axis = array.array('b')
+        # 3 values for each item
+        self.source = array.array('d')
+        self.target = array.array('d')
+        self.move_source = array.array('d')
+        self.move_target = array.array('d')
+        self.dir0 = array.array('d')
+        self.dir1 = array.array('d')
+        self.center = array.array('d')
+
+        # lines of merged movements, {position : lines}, see merger.Merger
+        self.merged_lines = {}
+        self.objects = {}
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.kind)
+
+    @staticmethod
+    def __put(column, vec):
+        column.extend((vec.x, vec.y, vec.z))
+
+    @staticmethod
+    def __get(column, i):
+        return euclid3.Vector3(column[3*i], column[3*i+1], column[3*i+2])
+
+    def append(self, item):
+        (index, action, line, extra) = item
+        if not action.is_moving or extra is None:
+            kind = KIND_ACTION
+        elif isinstance(action, helix.HelixMovement):
+            if action.ccw:
+                kind = KIND_ARC_CCW
+            else:
+                kind = KIND_ARC_CW
+        else:
+            kind = KIND_LINEAR
+
+        self.kind.append(kind)
+        self.index.append(index)
+        self.line.append(line)
+        if kind == KIND_ACTION:
+            self.objects[len(self.kind) - 1] = item
+            zero = euclid3.Vector3()
+            self.feed.append(0)
+            self.acc.append(0)
+            self.feed0.append(0)
+            self.feed1.append(0)
+            self.length.append(0)
+            self.radius.append(math.nan)
+            self.axis.append(0)
+            for column in [self.source, self.target, self.move_source, self.move_target,
+                           self.dir0, self.dir1, self.center]:
+                self.__put(column, zero)
+        else:
+            self.feed.append(action.feed)
+            self.acc.append(action.acceleration)
+            self.feed0.append(action.feed0)
+            self.feed1.append(action.feed1)
+            self.length.append(action.length())
+            self.__put(self.source, extra["source"])
+            self.__put(self.target, extra["target"])
+            self.__put(self.move_source, extra["move_source"])
+            self.__put(self.move_target, extra["move_target"])
+            self.__put(self.dir0, extra["dir0"])
+            self.__put(self.dir1, extra["dir1"])
+            if hasattr(action, "lines"):
+                self.merged_lines[len(self.kind) - 1] = action.lines
+            if kind == KIND_LINEAR:
+                self.radius.append(math.nan)
+                self.axis.append(0)
+                self.__put(self.center, euclid3.Vector3())
+            else:
+                self.radius.append(1 / action.curvature)
+                self.axis.append(self.__axes.index(action.axis))
+                self.__put(self.center, extra["move_source"] + action.source_to_center)
+            action.dispose()
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    # ranges [begin, end) of consecutive movements
+    def chains(self):
+        begin = None
+        for i in range(len(self.kind)):
+            if self.kind[i] == KIND_ACTION:
+                if begin is not None:
+                    yield begin, i
+                    begin = None
+            elif begin is None:
+                begin = i
+        if begin is not None:
+            yield begin, len(self.kind)
+
+    def __materialize(self, i):
+        kind = self.kind[i]
+        move_source = self.__get(self.move_source, i)
+        move_target = self.__get(self.move_target, i)
+        if kind == KIND_LINEAR:
+            movement = linear.LinearMovement(delta=move_target - move_source,
+                                             feed=self.feed[i],
+                                             acc=self.acc[i],
+                                             sender=self.table_sender)
+        else:
+            movement = helix.HelixMovement(source_to_center=self.__get(self.center, i) - move_source,
+                                           delta=move_target - move_source,
+                                           axis=self.__axes[self.axis[i]],
+                                           ccw=kind == KIND_ARC_CCW,
+                                           feed=self.feed[i],
+                                           acc=self.acc[i],
+                                           sender=self.table_sender)
+        movement.feed0 = self.feed0[i]
+        movement.feed1 = self.feed1[i]
+        movement.line = self.line[i]
+        if i in self.merged_lines:
+            movement.lines = self.merged_lines[i]
+        extra = {
+            "source" : self.__get(self.source, i),
+            "target" : self.__get(self.target, i),
+            "move_source" : move_source,
+            "move_target" : move_target,
+            "dir0" : self.__get(self.dir0, i),
+            "dir1" : self.__get(self.dir1, i),
+        }
+        return (self.index[i], movement, self.line[i], extra)
+
+    def __trim(self, i):
+        if len(self.cache) < 2 * self.keep:
+            return
+        for n in sorted(self.cache.keys()):
+            if n >= i - self.keep or not self.cache[n][1].finished.is_set():
+                break
+            self.cache.pop(n)[1].dispose()
+
+    def get_action(self, i):
+        if i >= len(self.kind):
+            return None
+        if self.kind[i] == KIND_ACTION:
+            return self.objects[i]
+        item = self.cache.get(i)
+        if item is None:
+            self.__trim(i)
+            item = self.__materialize(i)
+            self.cache[i] = item
+            self.action_created(item[1])
+        return item
+
+    # materialized actions
+    @property
+    def actions(self):
+        items = list(self.objects.items()) + list(self.cache.items())
+        return [item for _, item in sorted(items, key=lambda x: x[0])]
+
+    def dispose(self):
+        for item in self.actions:
+            item[1].dispose()
+        self.merged_lines = {}
+        self.objects = {}
+        self.cache = {}
+        self.reset_coordinates_ev.dispose()
+        self.update_current_cs_ev.dispose()
+        self.action_created.dispose()
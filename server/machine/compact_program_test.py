@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import common
+
+from . import compact_program
+from . import optimizer
+from .machine_test import make_frames, run_program
+from .optimizer_test import build_example, build_text, fillets, assert_same
+from ..sender import emulatorsender
+
+def object_program(name):
+    program = build_example(name)
+    optimizer.Optimizer(20, 40, 800).optimize(program)
+    return program
+
+def compact(name, keep=16):
+    source = build_example(name)
+    program = compact_program.CompactProgram(source, keep)
+    program.extend(source.actions)
+    optimizer.Optimizer(20, 40, 800).optimize_compact(program)
+    return program
+
+def test_box_feeds():
+    expected = object_program("box.gcode")
+    program = compact("box.gcode")
+    assert len(program) == len(expected.actions)
+    feeds = []
+    commands = []
+    for i in range(len(program)):
+        action = program.get_action(i)[1]
+        if action.is_moving:
+            feeds.append((action.feed0, action.feed, action.feed1))
+            commands.append(action.command())
+    expected_feeds = []
+    expected_commands = []
+    for (_, action, _, _) in expected.actions:
+        if action.is_moving:
+            expected_feeds.append((action.feed0, action.feed, action.feed1))
+            expected_commands.append(action.command())
+    assert_same(feeds, expected_feeds)
+    assert commands == expected_commands
+
+def test_lines():
+    expected = object_program("box.gcode")
+    program = compact("box.gcode")
+    for i in range(len(program)):
+        index, action, line, _ = program.get_action(i)
+        assert index == expected.actions[i][0]
+        assert line == expected.actions[i][2]
+        assert action.line == line
+
+def test_machine_compact(monkeypatch):
+    monkeypatch.setattr(common.config, "COMPACT_PROGRAM", True)
+    monkeypatch.setattr(common.config, "LOOKAHEAD", 8)
+    sender = emulatorsender.EmulatorSender()
+    m, _ = run_program(make_frames(100), sender, False)
+    assert isinstance(m.user_program, compact_program.CompactProgram)
+    assert len(m.user_program.cache) <= 3 * 8
+    for (_, action, _, _) in m.user_program.actions:
+        assert action.finished.is_set()
+
+def test_arc_feeds():
+    expected = build_text(fillets)
+    optimizer.Optimizer(20, 40, 800).optimize(expected)
+    source = build_text(fillets)
+    program = compact_program.CompactProgram(source, 16)
+    program.extend(source.actions)
+    optimizer.Optimizer(20, 40, 800).optimize_compact(program)
+    feeds = [(program.feed0[i], program.feed[i], program.feed1[i]) for i in range(len(program))
+             if program.kind[i] != compact_program.KIND_ACTION]
+    expected_feeds = [(action.feed0, action.feed, action.feed1) for (_, action, _, extra) in expected.actions
+                      if action.is_moving and extra is not None]
+    assert_same(feeds, expected_feeds)
+    assert feeds[1][1] < 600
@@ -0,0 +1,278 @@
+import math
+import euclid3
+
+from .actions import linear
+from .actions import helix
+
+# Cutter radius compensation (G41, G42, G40)
+#
+# Path of center of tool is offset from programmed path by radius of tool
+# to the left (G41) or to the right (G42) of direction of movement in
+# plane XY. Offset of movement is extra["compensation"] - radius of tool,
+# positive for G41, negative for G42 and 0 for G40, see
+# modals.positioning.PositioningState.compensation.
+#
+# Movements are offset in stream with look-ahead of one movement:
+#   - in inside corner offset movements are cut in their intersection
+#   - in outside corner arc with radius of tool around corner is inserted
+#   - movement of G41/G42 block should be linear, it goes from not offset
+#     position to offset begin of the next movement
+#   - movement of G40 block should be linear, it goes from offset end
+#     of the previous movement to programmed position
+# Movements, which are cut away by intersection, and arcs with radius
+# smaller than radius of tool are gouges, they are errors. Other actions
+# and movements along Z between compensated movements are kept, they
+# don't break compensation.
+
+EPS = 1e-9
+
+# ends of offset movements, which are closer, are joined without link
+JOIN_DISTANCE = 1e-7
+
+def _xy(v):
+    return euclid3.Vector2(v.x, v.y)
+
+def _left(v):
+    return euclid3.Vector2(-v.y, v.x)
+
+def _cross(a, b):
+    return a.x * b.y - a.y * b.x
+
+def _at(p, z):
+    return euclid3.Vector3(p.x, p.y, z)
+
+# angle of arc from p to q around center
+def _sweep(center, p, q, ccw):
+    a = math.atan2(q.y - center.y, q.x - center.x) - math.atan2(p.y - center.y, p.x - center.x)
+    if not ccw:
+        a = -a
+    return a % (2 * math.pi)
+
+def _compensation(item):
+    _, action, _, extra = item
+    if extra is None or not action.is_moving:
+        return 0
+    return extra.get("compensation", 0)
+
+# linear movement along Z, it hasn't direction in plane XY
+def _vertical(item):
+    _, action, _, extra = item
+    return isinstance(action, linear.LinearMovement) and \
+           _xy(extra["move_target"] - extra["move_source"]).magnitude() < EPS
+
+#region intersections
+
+def _line_line(p1, d1, p2, d2):
+    den = _cross(d1, d2)
+    if abs(den) < EPS:
+        return []
+    return [p1 + d1 * (_cross(p2 - p1, d2) / den)]
+
+def _line_circle(p, d, center, r):
+    f = p - center
+    b = f.dot(d)
+    disc = b * b - f.dot(f) + r * r
+    if disc < 0:
+        return []
+    s = disc ** 0.5
+    return [p + d * (-b - s), p + d * (-b + s)]
+
+def _circle_circle(c1, r1, c2, r2):
+    v = c2 - c1
+    dist = v.magnitude()
+    if dist < EPS:
+        return []
+    a = (r1 * r1 - r2 * r2 + dist * dist) / (2 * dist)
+    h2 = r1 * r1 - a * a
+    if h2 < 0:
+        return []
+    middle = c1 + v * (a / dist)
+    n = _left(v / dist) * h2 ** 0.5
+    return [middle + n, middle - n]
+
+#endregion
+
+# movement of program, which is offset
+class _Element(object):
+
+    def __init__(self, item):
+        self.item = item
+        _, self.action, _, extra = item
+        self.c = extra["compensation"]
+        self.source = extra["move_source"]
+        self.target = extra["move_target"]
+        self.arc = isinstance(self.action, helix.HelixMovement)
+        # movement of G41/G42 block
+        self.lead_in = False
+        if self.arc:
+            self.center = _xy(self.source + self.action.source_to_center)
+            self.ccw = self.action.ccw
+            r = (_xy(self.source) - self.center).magnitude()
+            self.r = r - self.c if self.ccw else r + self.c
+            if self.r <= EPS:
+                raise Exception("Gouge in line %s: radius of arc is smaller than radius of tool" % self.action.line)
+        # ends of offset movement, they are set by junctions
+        self.begin = None
+        self.end = None
+
+    # unit tangent in plane XY in point p of movement
+    def tangent(self, p):
+        if not self.arc:
+            d = _xy(self.target - self.source)
+            return d / d.magnitude()
+        t = _left(p - self.center)
+        t /= t.magnitude()
+        if not self.ccw:
+            t = -t
+        return t
+
+    # point p of programmed movement, offset by compensation
+    def offset(self, p):
+        p = _xy(p)
+        return p + _left(self.tangent(p)) * self.c
+
+    def intersections(self, other):
+        if not self.arc and not other.arc:
+            return _line_line(self.offset(self.source), self.tangent(None),
+                              other.offset(other.source), other.tangent(None))
+        if not self.arc:
+            return _line_circle(self.offset(self.source), self.tangent(None), other.center, other.r)
+        if not other.arc:
+            return _line_circle(other.offset(other.source), other.tangent(None), self.center, self.r)
+        return _circle_circle(self.center, self.r, other.center, other.r)
+
+    # does offset movement from begin to end go forward and isn't longer, than whole
+    def passes(self, begin, end):
+        if not self.arc:
+            return (end - begin).dot(self.tangent(None)) > EPS
+        part = _sweep(self.center, begin, end, self.ccw)
+        whole = _sweep(self.center, self.offset(self.source), self.offset(self.target), self.ccw)
+        return EPS < part <= whole + EPS
+
+    def movement(self):
+        return _movement(self.item, _at(self.begin, self.source.z), _at(self.end, self.target.z),
+                         self.center if self.arc else None, self.arc and self.ccw)
+
+# movement from begin to end with feed of item, arc around center if it is given
+def _movement(item, begin, end, center=None, ccw=False):
+    index, action, line, extra = item
+    extra = dict(extra)
+    if center is None:
+        dir0, dir1 = linear.LinearMovement.find_geometry(begin, end)
+        movement = linear.LinearMovement(delta=end - begin,
+                                         feed=action.feed,
+                                         acc=action.acceleration,
+                                         sender=action.table_sender)
+    else:
+        axis = helix.HelixMovement.Axis.xy
+        to_center = _at(center, begin.z) - begin
+        _, dir0, dir1, _ = helix.HelixMovement.find_geometry(begin, end, ccw, axis,
+                                                             i=to_center.x, j=to_center.y, k=0)
+        movement = helix.HelixMovement(delta=end - begin,
+                                       source_to_center=to_center,
+                                       axis=axis,
+                                       ccw=ccw,
+                                       feed=action.feed,
+                                       acc=action.acceleration,
+                                       sender=action.table_sender)
+    movement.line = action.line
+    extra["source"] = begin
+    extra["target"] = end
+    extra["move_source"] = begin
+    extra["move_target"] = end
+    extra["dir0"] = dir0
+    extra["dir1"] = dir1
+    return (index, movement, line, extra)
+
+# find ends of offset movements in corner between them,
+# returns (begin, end, center) of arc or line, which links them, or None
+def _junction(first, second):
+    corner = _xy(first.target)
+    end = first.offset(first.target)
+    begin = second.offset(second.source)
+    if first.lead_in:
+        first.end = begin
+        second.begin = begin
+        return None
+
+    first.end = end
+    second.begin = begin
+    if (end - begin).magnitude() < JOIN_DISTANCE:
+        second.begin = end
+        return None
+    if first.c != second.c:
+        return (end, begin, None)
+
+    turn = _cross(first.tangent(corner), second.tangent(corner))
+    if turn * first.c <= 0:
+        # outside corner, tool goes around it
+        return (end, begin, corner)
+
+    points = first.intersections(second)
+    points.sort(key=lambda p: (p - corner).magnitude())
+    if len(points) == 0 or not first.passes(first.begin, points[0]) or \
+       not second.passes(points[0], second.offset(second.target)):
+        raise Exception("Gouge in line %s: movement is shorter, than radius of tool" % second.action.line)
+    first.end = points[0]
+    second.begin = points[0]
+    return None
+
+# give out pending element, actions after it and link to the next element
+def _flush(element, between, link=None, following=None):
+    yield element.movement()
+    for item in between:
+        if _compensation(item) != 0 and _vertical(item):
+            _, _, _, extra = item
+            item = _movement(item, _at(element.end, extra["move_source"].z),
+                             _at(element.end, extra["move_target"].z))
+        yield item
+    if link is not None:
+        begin, end, center = link
+        z = following.source.z
+        yield _movement(following.item, _at(begin, z), _at(end, z), center, following.c < 0)
+
+# compensate movements of actions, given by iterator, and give them out
+def compensate(actions):
+    # compensated element, end of which depends on the next one
+    pending = None
+    between = []
+    for item in actions:
+        c = _compensation(item)
+        if pending is None:
+            if c == 0 or _vertical(item):
+                yield item
+                continue
+            pending = _Element(item)
+            if pending.arc:
+                raise Exception("Line %s: compensation can not be started with arc" % pending.action.line)
+            pending.begin = _xy(pending.source)
+            pending.lead_in = True
+            continue
+
+        _, action, _, extra = item
+        if not action.is_moving or (c != 0 and _vertical(item)):
+            between.append(item)
+            continue
+
+        if c == 0:
+            # end of compensation
+            if extra is not None and isinstance(action, helix.HelixMovement):
+                raise Exception("Line %s: compensation can not be finished with arc" % action.line)
+            pending.end = pending.offset(pending.target)
+            yield from _flush(pending, between)
+            if extra is not None:
+                item = _movement(item, _at(pending.end, extra["move_source"].z), extra["move_target"])
+            yield item
+            pending = None
+            between = []
+            continue
+
+        element = _Element(item)
+        link = _junction(pending, element)
+        yield from _flush(pending, between, link, element)
+        pending = element
+        between = []
+
+    if pending is not None:
+        pending.end = pending.offset(pending.target)
+        yield from _flush(pending, between)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import math
+import pytest
+
+from . import parser
+from .actions import helix
+from .actions import linear
+from .program_builder import ProgramBuilder
+from ..sender import emulatorsender
+from ..sender import spindelemulator
+
+# program with tool 1 of radius r
+def build(text, r=1):
+    frames = parser.GFastLineParser().parse_file("M6 T1\n" + text)
+    builder = ProgramBuilder(emulatorsender.EmulatorSender(),
+                             spindelemulator.Spindel_EMU(),
+                             {"tools" : {1 : r}})
+    return builder.build_program(frames)
+
+def moving(program):
+    return [item for item in program.actions if item[1].is_moving and item[3] is not None]
+
+def ends(program):
+    return [(round(extra["move_target"].x, 6), round(extra["move_target"].y, 6))
+            for (_, _, _, extra) in moving(program)]
+
+def continuous(program):
+    items = moving(program)
+    for (_, _, _, extra0), (_, _, _, extra1) in zip(items[:-1], items[1:]):
+        if (extra0["move_target"] - extra1["move_source"]).magnitude() > 1e-9:
+            return False
+    return True
+
+square = "G0 X-5 Y-5\n%s G1 X0 Y0 F600\nX10\nY10\nX0\nY0\nG40 G1 X-5 Y-5\nM2\n"
+
+def test_inside_corners():
+    program = build(square % "G41")
+    assert ends(program) == [(-5, -5), (0, 1), (9, 1), (9, 9), (1, 9), (1, 0), (-5, -5)]
+    assert continuous(program)
+
+def test_outside_corners():
+    program = build(square % "G42")
+    items = moving(program)
+    arcs = [item for item in items if isinstance(item[1], helix.HelixMovement)]
+    assert len(arcs) == 3
+    for (_, arc, _, extra), corner in zip(arcs, [(10, 0), (10, 10), (0, 10)]):
+        # square goes ccw, tool goes around its corners outside
+        assert arc.ccw
+        center = extra["move_source"] + arc.source_to_center
+        assert abs(center.x - corner[0]) < 1e-9 and abs(center.y - corner[1]) < 1e-9
+        assert abs(arc.r - 1) < 1e-9
+    assert ends(program)[1] == (0, -1)
+    assert continuous(program)
+
+def test_tangent_arc():
+    text = "G0 X-5 Y-5\n%s G1 X0 Y0 F600\nX10\nG3 X10 Y10 I0 J5\nG40 G1 X-5 Y10\nM2\n"
+    for crc, r in [("G41", 4), ("G42", 6)]:
+        program = build(text % crc)
+        (_, arc, _, _), = [item for item in moving(program) if isinstance(item[1], helix.HelixMovement)]
+        assert abs(arc.r - r) < 1e-9
+        assert continuous(program)
+
+def test_line_arc_intersection():
+    program = build("G0 X-5 Y-5\nG41 G1 X0 Y0 F600\nX10\nG3 X10 Y10 I-5 J5\nG40 G1 X15 Y15\nM2\n")
+    (_, line, _, extra), = [item for item in moving(program)
+                            if isinstance(item[1], linear.LinearMovement) and item[3]["move_source"].y == 1]
+    corner = extra["move_target"]
+    # end of line is on offset arc
+    assert abs(math.hypot(corner.x - 5, corner.y - 5) - (50 ** 0.5 - 1)) < 1e-9
+    assert corner.x < 10
+    assert continuous(program)
+
+def test_vertical_movements():
+    program = build("G0 X-5 Y-5\nG41 G1 X0 Y0 F600\nX10\nZ-1\nY10\nG40 G1 X20 Y20\nM2\n")
+    items = moving(program)
+    (_, _, _, extra), = [item for item in items if item[3]["move_target"].z == -1 and item[3]["move_source"].z == 0]
+    assert (extra["move_source"].x, extra["move_source"].y) == (9, 1)
+    assert (extra["move_target"].x, extra["move_target"].y) == (9, 1)
+    assert continuous(program)
+
+def test_gouges():
+    # slot narrower than tool, arc with radius smaller than tool
+    for text, r in [(square, 6), ("G0 X-5 Y-5\n%s G1 X0 Y0 F600\nX10\nG3 X10 Y10 I0 J5\nG40 G1 X0 Y10\nM2\n", 6)]:
+        with pytest.raises(Exception, match="Gouge"):
+            build(text % "G41", r)
+
+def test_not_registered():
+    with pytest.raises(Exception, match="not registered"):
+        build("M6 T2\n" + square % "G41")
+
+def test_without_compensation():
+    program = build(square % "G40")
+    assert ends(program) == [(-5, -5), (0, 0), (10, 0), (10, 10), (0, 10), (0, 0), (-5, -5)]
+    for (_, action, _, _) in moving(program):
+        assert isinstance(action, linear.LinearMovement)
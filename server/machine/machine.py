@@ -12,7 +12,11 @@ from . import actions
 from . import parser
 from . import modals
 from . import program as pr
+from . import compact_program
+from . import cache
 from . import runtimestate
+from . import tracker
+from . import simulator
 
 from .actions import linear
 from .actions import helix
@@ -27,7 +31,10 @@ from .actions import state
 import common
 from common import event
 from common import config
+from common import trace
 import threading
+import asyncio
+import time
 
 from .program_builder import ProgramBuilder
 from .modals import positioning
@@ -52,7 +59,7 @@ from . import arguments
 class Machine(object):
 
     def __init__(self, table_sender, spindle_sender):
-        print("Creating machine...")
+        trace.state.info("Creating machine")
         self.registers = {
             "tools" : {}
         }
@@ -70,14 +77,22 @@ class Machine(object):
 
         self.reset = False
         self.action_rdy = threading.Event()
-        self.__table_reseted_ev = threading.Event()
+        self.__table_reseted_ev = event.Event()
         self.current_wait = None
         self.c_actions = []
+        self.c_sent = 0
         self.nc_action = None
-        self.opt = Optimizer(common.config.JERKING, common.config.ACCELERATION, common.config.MAXFEED)
+        self.pipeline = common.config.PIPELINE
+        self.opt = Optimizer(common.config.JERKING, common.config.ACCELERATION, common.config.MAXFEED,
+                             common.config.PLANNER)
+        self.cache = None
+        if common.config.CACHE_DIR is not None:
+            self.cache = cache.ProgramCache(common.config.CACHE_DIR, common.config.CACHE_SIZE)
         # loaded program
         self.user_program = None
         self.user_frames = []
+        # key of loaded program in cache, see cache.ProgramCache.lines_key
+        self.user_key = None
         # actual program
         self.program = None
         self.state = None
@@ -90,10 +105,19 @@ class Machine(object):
         self.table_sender.mcu_reseted += self.__table_reseted
         # current states
         self.runtime_state = runtimestate.RuntimeState({"x":0, "y":0, "z":0}, euclid3.Vector3())
-        print("done")
+        self.tracker = tracker.CoordinateTracker()
+        self.table_sender.indexed += self.tracker.indexed
+        self.table_sender.started += self.tracker.started
+        self.table_sender.completed += self.tracker.completed
+        self.crd_act = None
+        self.crd_requested = 0
+        self.crd_reported = None
+        # line, selected inside of merged movement, see merger.Merger
+        self.line_reported = None
+        trace.state.info("Machine created")
 
     def work_init(self, program):
-        print("INIT")
+        trace.state.info("Init work")
         if self.program != None:
             self.program.dispose()
 
@@ -141,32 +165,109 @@ class Machine(object):
             self.program = self.empty_program
 
     def __action_started(self, action):
-        i = None
-        for i in range(len(self.program.actions)):
-            if self.program.actions[i][1] == action:
+        if action.line is None:
+            return
+        self.line_reported = action.line
+        self.line_selected(action.line)
+
+    # select line of merged movement, which is passed now
+    def __report_line(self, t):
+        progress = self.tracker.progress(t)
+        if progress is None:
+            return
+        action, s = progress
+        lines = getattr(action, "lines", None)
+        if lines is None:
+            return
+        line = lines[0][1]
+        for offset, l in lines:
+            if offset > s:
                 break
-        if i is None or i >= len(self.program.actions):
+            line = l
+        if line != self.line_reported:
+            self.line_reported = line
+            self.line_selected(line)
+
+    def __action_started_subscribe(self, action):
+        action.action_started += self.__action_started
+
+    def __subscribe_started(self, actions):
+        for action in actions:
+            action[1].action_started += self.__action_started
+            yield action
+
+    # key of optimized feeds, found before builder builds program
+    def __plan_key(self, builder):
+        if self.cache is None or self.user_key is None:
+            return None
+        return self.cache.plan_key(self.user_key, builder.state_key(), self.opt, self.registers["tools"])
+
+    def __optimize_compact(self, program, key):
+        if key is None:
+            self.opt.optimize_compact(program)
             return
-        self.line_selected(self.program.actions[i][2])
+        if not self.cache.load_plan(key, program):
+            self.opt.optimize_compact(program)
+            self.cache.save_plan(key, program)
+
+    def __optimize(self, program, key):
+        if key is None:
+            self.opt.optimize(program)
+            return
+        if not self.cache.load_actions_plan(key, program):
+            self.opt.optimize(program)
+            self.cache.save_actions_plan(key, program)
 
     def __build_user_program(self, frames):
         self.builder = ProgramBuilder(self.table_sender, self.spindle_sender, self.registers, self.state)
         self.builder.finish_cb = self.__finished
         self.builder.pause_cb = self.__paused
         self.builder.tool_select_cb = self.__tool_selected
-        self.user_program = self.builder.build_program(frames)
-        self.opt.optimize(self.user_program)
-        for action in self.user_program.actions:
-            action[1].action_started += self.__action_started
-        if len(self.user_program.actions) > 0:
-            self.line_selected(self.user_program.actions[0][2])
-
-    def Load(self, frames):
+        key = self.__plan_key(self.builder)
+        if common.config.STREAMING:
+            actions = self.builder.generate_program(frames)
+            actions = self.opt.optimize_stream(actions, common.config.LOOKAHEAD)
+            self.user_program = pr.StreamProgram(self.builder.program,
+                                                 self.__subscribe_started(actions),
+                                                 common.config.LOOKAHEAD)
+        elif common.config.COMPACT_PROGRAM:
+            self.user_program = compact_program.CompactProgram(self.builder.program,
+                                                               common.config.LOOKAHEAD)
+            self.user_program.extend(self.builder.generate_program(frames))
+            self.__optimize_compact(self.user_program, key)
+            for action in self.user_program.actions:
+                action[1].action_started += self.__action_started
+            self.user_program.action_created += self.__action_started_subscribe
+        else:
+            self.user_program = self.builder.build_program(frames)
+            self.__optimize(self.user_program, key)
+            for action in self.user_program.actions:
+                action[1].action_started += self.__action_started
+        first = self.user_program.get_action(0)
+        if first is not None:
+            self.line_selected(first[2])
+
+    # estimate time of loaded program, see simulator.Simulation
+    def Simulate(self):
+        builder = ProgramBuilder(self.table_sender, self.spindle_sender, self.registers, self.state)
+        key = self.__plan_key(builder)
+        program = compact_program.CompactProgram(builder.program, common.config.LOOKAHEAD)
+        program.extend(builder.generate_program(self.user_frames))
+        self.__optimize_compact(program, key)
+        result = simulator.simulate(program)
+        if builder.merger is not None:
+            result.merged = builder.merger.eliminated
+        program.dispose()
+        return result
+
+    # key - key of program text in cache, feeds are cached with it
+    def Load(self, frames, key=None):
         if self.user_program is not None:
             self.user_program.dispose()
         self.user_frames = frames
+        self.user_key = key
 
-    def Execute(self, frames):
+    def __prepare_execute(self, frames):
         if self.is_running:
             raise Exception("Machine should be stopped")
 
@@ -177,25 +278,33 @@ class Machine(object):
 
         self.work_init(self.builder.build_program(frames))
         self.display_finished = False
+
+    def Execute(self, frames):
+        self.__prepare_execute(frames)
         self.WorkContinue()
 
+    async def ExecuteAsync(self, frames):
+        self.__prepare_execute(frames)
+        await self.WorkContinueAsync()
+
     def __has_cmds(self):
-        return self.iter < len(self.program.actions)
+        return self.program.get_action(self.iter) is not None
 
     def __get_movements(self):
         actions = []
-        while self.__has_cmds():
-            action = self.program.actions[self.iter][1]
-            if not action.caching:
+        while len(actions) < common.config.LOOKAHEAD:
+            item = self.program.get_action(self.iter)
+            if item is None or not item[1].caching:
                 return actions
-            actions.append(action)
+            actions.append(item[1])
             self.iter += 1
         return actions
 
     def __get_nc_action(self):
-        if not self.__has_cmds():
+        item = self.program.get_action(self.iter)
+        if item is None:
             return None
-        action = self.program.actions[self.iter][1]
+        action = item[1]
         if action.caching:
             return None
         self.iter += 1
@@ -208,6 +317,11 @@ class Machine(object):
 
     def __coordinates_cb(self, crds):
         self.crd_act.dispose()
+        self.crd_act = None
+        self.__report_coordinates(crds)
+
+    def __report_coordinates(self, crds):
+        self.crd_reported = crds
         self.runtime_state.update_coordinates(crds)
         self.on_coordinates(self.__vec3dict(self.runtime_state.hw_crds),
                             self.__vec3dict(self.runtime_state.global_crds),
@@ -233,12 +347,32 @@ class Machine(object):
         self.crd_act = state.TableCoordinates(self.table_sender, self.__coordinates_cb)
         self.crd_act.run()
 
+    # report coordinates without occupying MCU queue while table moves:
+    # they are taken from answers of movements and interpolated between
+    # them, see tracker.CoordinateTracker. M114 is sent only when machine
+    # is idle, not more often than COORDINATE_REQUEST_INTERVAL
+    def ReportCoordinates(self):
+        now = time.time()
+        pos = self.tracker.coordinates(now)
+        crds = {"x" : pos.x, "y" : pos.y, "z" : pos.z}
+        if crds != self.crd_reported:
+            self.__report_coordinates(crds)
+        self.__report_line(now)
+        if self.is_running:
+            return
+        if self.crd_act is not None and not self.crd_act.finished.is_set():
+            return
+        if now - self.crd_requested < common.config.COORDINATE_REQUEST_INTERVAL:
+            return
+        self.crd_requested = now
+        self.RequestCoordinates()
+
     def RequestEndstops(self):
         self.es_act = state.TableEndstops(self.table_sender, self.__endstops_cb)
         self.es_act.run()
 
     def WorkReset(self):
-        print("RESET")
+        trace.state.info("Reset work")
         act = system.TableReset(sender=self.table_sender)
         act.run()
         self.reset = True
@@ -260,7 +394,7 @@ class Machine(object):
 
     def __wait_event(self, ev):
         self.current_wait = ev
-        self.current_wait.wait()
+        yield ev
 
         if self.reset:
             self.__abort_actions()
@@ -268,6 +402,8 @@ class Machine(object):
         return False
 
     def __table_reseted(self):
+        self.tracker.reset()
+        self.crd_act = None
         self.sm_state = self.StateMachine.Idle
         self.reset = True
         if self.current_wait is not None:
@@ -298,6 +434,8 @@ class Machine(object):
         BlockFinished = 12
         ProgramFinished = 13
 
+        ResendMovements = 14
+
     #   Program Start
     #          |               ---------------->------------------
     #          v               |                                 |
@@ -329,7 +467,34 @@ class Machine(object):
     #  |     v                     |            |                |
     #  --> Program Finished <-------------------------------------
     #
-    def WorkContinue(self):
+    # In pipeline mode 'Send movement' sends movements while MCU has free slots,
+    # and 'Wait answer' waits answer for the oldest sent movement. If it is
+    # rejected with CRC error, 'Resend movements' waits answers for the rest of
+    # sent movements and sends them again. MCU rejects them too, when it
+    # resyncs after CRC error (see sender.flowcontrol.resyncs), other MCU
+    # gets movements one by one.
+    #
+    def __pipelined(self):
+        return self.pipeline and self.table_sender.resync
+
+    def __send(self, action):
+        self.tracker.sending(action)
+        res = action.run()
+        self.tracker.sending(None)
+        return res
+
+    def __send_movements(self):
+        while self.c_sent < len(self.c_actions) and self.table_sender.has_slots.is_set():
+            # process answer for the oldest movement first
+            if self.c_sent > 0 and self.c_actions[0].command_received.is_set():
+                break
+            if not self.__send(self.c_actions[self.c_sent]):
+                break
+            self.c_sent += 1
+
+    # state machine of execution, yields events to wait and
+    # not cacheable actions to run, see WorkContinue and WorkContinueAsync
+    def __work(self):
         self.reset = False
         self.is_running = True
         self.is_finished = False
@@ -338,13 +503,14 @@ class Machine(object):
         self.sm_state = self.StateMachine.BlockStart
         
         self.c_actions = []
+        self.c_sent = 0
         self.action = None
         self.last_c_action = None
         self.nc_action = None
         self.current_wait = None
 
         while True:
-            print("State = ", self.sm_state)
+            trace.state.debug("State = %s", self.sm_state)
             if self.sm_state is self.StateMachine.BlockStart:
                 if not self.__has_cmds():
                     self.sm_state = self.StateMachine.ProgramFinished
@@ -359,11 +525,17 @@ class Machine(object):
 
             # Segment = (cacheable actions)*n [not cacheable action]
             elif self.sm_state is self.StateMachine.ProcessSegment:
-                self.c_actions = self.__get_movements()
-                self.nc_action = self.__get_nc_action()
+                try:
+                    self.c_actions = self.__get_movements()
+                    self.c_sent = 0
+                    self.nc_action = self.__get_nc_action()
+                except Exception as e:
+                    trace.state.error("Can not process program: %s\n%s", e, traceback.format_exc())
+                    self.sm_state = self.StateMachine.Idle
+                    self.error()
+                    break
                 if len(self.c_actions) > 0:
                     self.sm_state = self.StateMachine.WaitSlots
-                    self.last_c_action = None
                 elif self.nc_action is not None:
                     self.sm_state = self.StateMachine.ExecuteNotCacheable
                 else:
@@ -372,22 +544,31 @@ class Machine(object):
 
             # Table movements
             elif self.sm_state is self.StateMachine.WaitSlots:
-                if self.__wait_event(self.table_sender.has_slots):
+                if (yield from self.__wait_event(self.table_sender.has_slots)):
                     self.sm_state = self.StateMachine.Reset
                     continue
                 self.sm_state = self.StateMachine.SendMovement
                 continue
             elif self.sm_state is self.StateMachine.SendMovement:
-                self.action = self.c_actions[0]
-                self.action.run()
+                if self.__pipelined():
+                    self.__send_movements()
+                else:
+                    self.__send(self.c_actions[0])
+                    self.c_sent = 1
+                # no more commands are ready, send collected ones at once
+                self.table_sender.flush()
                 self.sm_state = self.StateMachine.WaitMCUAnswer
                 continue
             elif self.sm_state == self.StateMachine.WaitMCUAnswer:
-                if self.__wait_event(self.action.command_received):
+                self.action = self.c_actions[0]
+                if (yield from self.__wait_event(self.action.command_received)):
                     self.sm_state = self.StateMachine.Reset
                     continue
                 if self.action.crc_error:
-                    self.sm_state = self.StateMachine.SendMovement
+                    if self.__pipelined():
+                        self.sm_state = self.StateMachine.ResendMovements
+                    else:
+                        self.sm_state = self.StateMachine.SendMovement
                     continue
                 if self.action.error:
                     self.sm_state = self.StateMachine.Idle
@@ -396,14 +577,43 @@ class Machine(object):
                 if not self.action.dropped:
                     self.last_c_action = self.action
                 self.c_actions = self.c_actions[1:]
-                if len(self.c_actions) > 0:
+                self.c_sent -= 1
+                if self.c_sent > 0 and (self.c_sent == len(self.c_actions) or \
+                                        self.c_actions[0].command_received.is_set()):
+                    self.sm_state = self.StateMachine.WaitMCUAnswer
+                elif len(self.c_actions) > 0:
                     self.sm_state = self.StateMachine.WaitSlots
+                elif self.nc_action is None and self.__has_cmds():
+                    # segment was longer, than look-ahead window
+                    self.sm_state = self.StateMachine.ProcessSegment
                 else:
                     self.sm_state = self.StateMachine.WaitMovements
                 continue
+            elif self.sm_state is self.StateMachine.ResendMovements:
+                # movements, sent after rejected one, can be sent again
+                # only if all of them are rejected too
+                reset = False
+                rejected = True
+                for action in self.c_actions[1:self.c_sent]:
+                    if (yield from self.__wait_event(action.command_received)):
+                        reset = True
+                        break
+                    if not action.crc_error:
+                        rejected = False
+                if reset:
+                    self.sm_state = self.StateMachine.Reset
+                    continue
+                if not rejected:
+                    trace.state.error("Movements are queued out of order")
+                    self.sm_state = self.StateMachine.Idle
+                    self.error()
+                    break
+                self.c_sent = 0
+                self.sm_state = self.StateMachine.WaitSlots
+                continue
             elif self.sm_state is self.StateMachine.WaitMovements:
                 if self.last_c_action is not None:
-                    if self.__wait_event(self.last_c_action.finished):
+                    if (yield from self.__wait_event(self.last_c_action.finished)):
                         self.sm_state = self.StateMachine.Reset
                         continue
 
@@ -417,11 +627,11 @@ class Machine(object):
 
             # Not cacheable actions
             elif self.sm_state is self.StateMachine.ExecuteNotCacheable:
-                self.nc_action.run()
+                yield self.nc_action.run
                 self.sm_state = self.StateMachine.WaitNotCacheable
                 continue
             elif self.sm_state is self.StateMachine.WaitNotCacheable:
-                if self.__wait_event(self.nc_action.finished):
+                if (yield from self.__wait_event(self.nc_action.finished)):
                     self.sm_state = self.StateMachine.Reset
                     continue
                 if self.nc_action.is_pause is True:
@@ -437,13 +647,32 @@ class Machine(object):
             elif self.sm_state is self.StateMachine.Reset:
                 act = system.TableReset(sender=self.table_sender)
                 act.run()
-                self.__table_reseted_ev.wait()
+                yield self.__table_reseted_ev
                 self.__finished(None)
                 break
 
         self.is_running = False
 
-    def WorkStart(self):
+    def WorkContinue(self):
+        for job in self.__work():
+            if isinstance(job, threading.Event):
+                job.wait()
+            else:
+                job()
+
+    # same as WorkContinue, but waits in asyncio loop. Not cacheable
+    # actions can block (spindle, tools), so they are run in executor
+    async def WorkContinueAsync(self):
+        loop = asyncio.get_running_loop()
+        for job in self.__work():
+            if isinstance(job, event.Event):
+                await job.wait_async()
+            elif isinstance(job, threading.Event):
+                await loop.run_in_executor(None, job.wait)
+            else:
+                await loop.run_in_executor(None, job)
+
+    def __prepare_start(self):
         if self.is_running:
             raise Exception("Machine should be stopped")
         self.__build_user_program(self.user_frames)
@@ -451,8 +680,16 @@ class Machine(object):
             self.work_init(self.empty_program)  
         else:
             self.work_init(self.user_program)
+
+    def WorkStart(self):
+        self.__prepare_start()
         return self.WorkContinue()
 
+    # building of program takes time, so it is done in executor
+    async def WorkStartAsync(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.__prepare_start)
+        await self.WorkContinueAsync()
+
     def WorkStop(self):
         self.work_init(self.empty_program)
         self.is_running = False
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import time
+import asyncio
+
+import common
+from common import trace
+
+from . import machine
+from . import parser
+from . import simulator
+from ..sender import emulatorsender
+from ..sender import spindelemulator
+from ..sender import mcuemulator
+
+def make_frames(n):
+    gp = parser.GLineParser()
+    lines = ["G1 F600"]
+    for i in range(n):
+        lines.append("X%i Y%i" % (i + 1, (i % 2) * 5))
+    lines.append("M2")
+    return [gp.parse(line) for line in lines]
+
+def run_program(frames, sender, pipeline, key=None):
+    m = machine.Machine(sender, spindelemulator.Spindel_EMU())
+    m.pipeline = pipeline
+    finished = []
+    m.finished += lambda display: finished.append(display)
+    m.Load(frames, key)
+    t = time.time()
+    m.WorkStart()
+    t = time.time() - t
+    assert len(finished) == 1
+    return m, t
+
+def test_program_finished():
+    sender = emulatorsender.EmulatorSender()
+    m, _ = run_program(make_frames(10), sender, False)
+    movements = [action for (_, action, _, _) in m.user_program.actions if action.is_moving]
+    assert len(movements) == 10
+    for action in movements:
+        assert action.finished.is_set()
+
+def test_pipeline_faster():
+    sender = emulatorsender.EmulatorSender(latency=0.01, slots=8)
+    _, t_wait = run_program(make_frames(40), sender, False)
+    sender.close()
+    sender = emulatorsender.EmulatorSender(latency=0.01, slots=8)
+    m, t_pipe = run_program(make_frames(40), sender, True)
+    sender.close()
+    movements = [action for (_, action, _, _) in m.user_program.actions if action.is_moving]
+    for action in movements:
+        assert action.finished.is_set()
+    assert t_pipe * 2 < t_wait
+
+def test_async_execution():
+    sender = emulatorsender.EmulatorSender(latency=0.005, slots=8)
+    m = machine.Machine(sender, spindelemulator.Spindel_EMU())
+    m.pipeline = True
+    finished = []
+    m.finished += lambda display: finished.append(display)
+    m.Load(make_frames(20))
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.time())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        task = asyncio.get_running_loop().create_task(ticker())
+        await m.WorkStartAsync()
+        task.cancel()
+
+    asyncio.run(run())
+    sender.close()
+    assert len(finished) == 1
+    movements = [action for (_, action, _, _) in m.user_program.actions if action.is_moving]
+    for action in movements:
+        assert action.finished.is_set()
+    # loop is not blocked while machine waits answers
+    assert len(ticks) > 2
+
+def test_pipeline_with_faults():
+    sender = mcuemulator.MCUEmulator(depth=8, latency=0.002, speed=200, crc_errors=0.05, drops=0.02, seed=3)
+    m, t = run_program(make_frames(200), sender, True)
+    sender.close()
+    movements = [action for (_, action, _, _) in m.user_program.actions if action.is_moving]
+    for action in movements:
+        assert action.finished.is_set()
+    assert sender.resync
+    assert sender.rejected > 0
+    assert sender.overflows == 0
+    assert sender.executed + sum(1 for action in movements if action.dropped) >= len(movements)
+
+def test_pipeline_without_resync():
+    # MCU queues movements after damaged one, so they are sent one by one
+    sender = mcuemulator.MCUEmulator(depth=8, latency=0.002, speed=200, crc_errors=0.05, seed=3, resync=False)
+    m, t = run_program(make_frames(100), sender, True)
+    sender.close()
+    assert not sender.resync
+    assert sender.rejected > 0
+    movements = [action for (_, action, _, _) in m.user_program.actions if action.is_moving]
+    for action in movements:
+        assert action.finished.is_set()
+    assert sender.executed >= len(movements)
+
+def test_emulated_time():
+    sender = mcuemulator.MCUEmulator(depth=16, speed=20)
+    m, t = run_program(make_frames(40), sender, True)
+    sender.close()
+    estimated = simulator.simulate(m.user_program).time / 20
+    assert estimated * 0.9 < t < estimated * 1.5 + 0.2
+
+def test_binary_commands(monkeypatch):
+    results = []
+    for enabled in [False, True]:
+        monkeypatch.setattr(common.config, "BINARY_COMMANDS", enabled)
+        sender = mcuemulator.MCUEmulator(depth=16, speed=1000)
+        m, _ = run_program(make_frames(50), sender, True)
+        sender.close()
+        assert sender.binary == enabled
+        results.append((sender.executed, sender.bytes))
+    (executed0, bytes0), (executed1, bytes1) = results
+    assert executed0 == executed1
+    assert bytes1 < bytes0 * 0.8
+
+def feeds(program):
+    if common.config.COMPACT_PROGRAM:
+        return list(zip(program.feed0, program.feed, program.feed1))
+    return [(action.feed0, action.feed, action.feed1) for (_, action, _, extra) in program.actions
+            if action.is_moving and extra is not None]
+
+def test_cached_plan(monkeypatch, tmp_path):
+    monkeypatch.setattr(common.config, "CACHE_DIR", str(tmp_path))
+    for compact in [False, True]:
+        monkeypatch.setattr(common.config, "COMPACT_PROGRAM", compact)
+        frames = make_frames(10)
+        m, _ = run_program(frames, emulatorsender.EmulatorSender(), False, "program")
+        expected = feeds(m.user_program)
+        m.WorkReset()
+        # feeds of second start are found in cache before program is built
+        m.opt.optimize = m.opt.optimize_compact = None
+        m.Load(frames, "program")
+        m.WorkStart()
+        assert feeds(m.user_program) == expected
+        m.WorkReset()
+
+def test_trace(monkeypatch, tmp_path):
+    trace.clear()
+    run_program(make_frames(10), emulatorsender.EmulatorSender(), False)
+    # disabled categories write nothing
+    assert trace.entries() == []
+
+    monkeypatch.setattr(trace.state, "level", trace.DEBUG)
+    monkeypatch.setattr(trace.sender, "level", trace.DEBUG)
+    run_program(make_frames(10), emulatorsender.EmulatorSender(), False)
+    entries = trace.entries()
+    assert any(" state    DEBUG State = " in entry for entry in entries)
+    assert any(" sender   DEBUG Command " in entry for entry in entries)
+    assert not any(" planner " in entry for entry in entries)
+
+    path = tmp_path / "trace.txt"
+    assert trace.dump(str(path)) == len(entries)
+    assert path.read_text().splitlines() == entries
+    trace.clear()
+
+def test_stats():
+    sender = mcuemulator.MCUEmulator(depth=8, latency=0.002, speed=200, crc_errors=0.05, seed=3)
+    m, t = run_program(make_frames(100), sender, True)
+    sender.close()
+    snapshot = sender.stats.snapshot()
+    movements = [action for (_, action, _, _) in m.user_program.actions if action.is_moving]
+    assert snapshot["segments"] == len(movements)
+    assert snapshot["commands"] > snapshot["segments"]
+    assert snapshot["bytes"] == sender.bytes
+    assert snapshot["crc_errors"] == sender.rejected
+    assert 0 <= snapshot["min_slots"] < 8
+    assert 0 < snapshot["segments_per_second"] and 0 < snapshot["bytes_per_second"]
+    latency = snapshot["latency"]
+    assert sum(latency["total"]["counts"]) == snapshot["commands"]
+    # answers come with wire latency
+    assert latency["queue"]["mean"] >= 0.004
+    assert sum(latency["execute"]["counts"]) == snapshot["commands"]
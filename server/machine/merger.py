@@ -0,0 +1,174 @@
+import math
+
+from common import trace
+
+from .actions import linear
+
+# Merging of colinear linear movements
+#
+# Consecutive linear movements with same feed and acceleration are
+# replaced with one movement from begin of the first to end of the last,
+# if directions of them differ from it not more than `angle` radians and
+# their vertices are not further than `distance` mm from it. So MCU gets
+# one command instead of many short ones.
+#
+# Merged movement has `lines` - [(distance from its begin, line)], lines
+# of movements, it is made of, see machine.Machine.ReportCoordinates.
+class Merger(object):
+
+    # maximal amount of movements, merged to one
+    max_merged = 256
+
+    def __init__(self, angle, distance):
+        self.angle = angle
+        self.distance = distance
+        # amount of movements, which are merged into others
+        self.eliminated = 0
+        # amount of chords, checked with all movements of run, see Run
+        self.rechecked = 0
+
+    @staticmethod
+    def __mergeable(item):
+        _, action, _, extra = item
+        return extra is not None and isinstance(action, linear.LinearMovement) and action.length() > 0
+
+    @staticmethod
+    def __same_mode(first, second):
+        _, action0, _, extra0 = first
+        _, action1, _, extra1 = second
+        return action0.feed == action1.feed and \
+               action0.acceleration == action1.acceleration and \
+               extra0.get("tolerance", 0) == extra1.get("tolerance", 0)
+
+    # cone of directions, set of unit vectors not further than radius
+    # (radians) from axis
+    class Cone(object):
+
+        # rounding error of angles
+        eps = 1e-12
+
+        def __init__(self, axis, radius):
+            self.axis = axis
+            self.radius = radius
+
+        def angle(self, direction):
+            return math.atan2(self.axis.cross(direction).magnitude(), self.axis.dot(direction))
+
+        def contains(self, direction):
+            return self.angle(direction) <= self.radius + self.eps
+
+        # biggest cone inside of intersection of cones
+        def intersect(self, other):
+            angle = self.angle(other.axis)
+            if angle + other.radius <= self.radius:
+                return other
+            if angle + self.radius <= other.radius:
+                return self
+            if angle >= self.radius + other.radius:
+                return Merger.Cone(self.axis, -1)
+            normal = other.axis - self.axis * self.axis.dot(other.axis)
+            if normal.magnitude() == 0:
+                return Merger.Cone(self.axis, min(self.radius, other.radius))
+            normal = normal / normal.magnitude()
+            shift = (self.radius + angle - other.radius) / 2
+            return Merger.Cone(self.axis * math.cos(shift) + normal * math.sin(shift),
+                               (self.radius + other.radius - angle) / 2)
+
+    # run of movements, which are merged
+    #
+    # Each movement limits direction of chord from begin of run: it should
+    # be inside of cone of `angle` around direction of movement and vertex
+    # of movement should be not further than `distance` from chord. Run
+    # keeps biggest cone inside of intersection of these cones, so only new
+    # movement is checked. The cone is exact for movements in a plane, in
+    # space chord outside of it is checked with all movements of run.
+    class Run(object):
+        def __init__(self, item):
+            self.items = []
+            self.source = item[3]["move_source"]
+            self.feasible = Merger.Cone(item[3]["dir0"], math.pi)
+
+    def __add(self, run, item):
+        _, _, _, extra = item
+        run.items.append(item)
+        run.feasible = run.feasible.intersect(self.Cone(extra["dir0"], self.angle))
+        vertex = extra["move_target"] - run.source
+        length = vertex.magnitude()
+        if length > self.distance:
+            run.feasible = run.feasible.intersect(self.Cone(vertex / length,
+                                                            math.asin(self.distance / length)))
+
+    # can movements of run be replaced with chord of given direction
+    def __fits(self, run, direction):
+        cosa = math.cos(self.angle)
+        for _, _, _, extra in run.items:
+            if extra["dir0"].dot(direction) < cosa:
+                return False
+            v = extra["move_target"] - run.source
+            if (v - direction * v.dot(direction)).magnitude() > self.distance:
+                return False
+        return True
+
+    # add item to run, if movements of run and item can be replaced
+    # with chord from begin of run to end of item
+    def __extend(self, run, item):
+        _, _, _, extra = item
+        chord = extra["move_target"] - run.source
+        length = chord.magnitude()
+        if length == 0:
+            return False
+        direction = chord / length
+        if not self.Cone(extra["dir0"], self.angle).contains(direction):
+            return False
+        if not run.feasible.contains(direction):
+            self.rechecked += 1
+            if not self.__fits(run, direction):
+                return False
+        self.__add(run, item)
+        return True
+
+    def __merged(self, run):
+        if len(run) == 1:
+            return run[0]
+        index, first, line, extra0 = run[0]
+        extra1 = run[-1][3]
+        extra = dict(extra0)
+        extra["target"] = extra1["target"]
+        extra["move_target"] = extra1["move_target"]
+        delta = extra["move_target"] - extra["move_source"]
+        direction = delta / delta.magnitude()
+        extra["dir0"] = direction
+        extra["dir1"] = direction
+        movement = linear.LinearMovement(delta=delta,
+                                         feed=first.feed,
+                                         acc=first.acceleration,
+                                         sender=first.table_sender)
+        movement.line = first.line
+        movement.lines = []
+        for (_, action, _, ext) in run:
+            offset = (ext["move_source"] - extra["move_source"]).dot(direction)
+            for d, l in getattr(action, "lines", [(0, action.line)]):
+                movement.lines.append((offset + d, l))
+        self.eliminated += len(run) - 1
+        return (index, movement, line, extra)
+
+    # merge movements of actions, given by iterator, and give them out
+    def merge(self, actions):
+        run = None
+        for item in actions:
+            if not self.__mergeable(item):
+                if run is not None:
+                    yield self.__merged(run.items)
+                    run = None
+                yield item
+                continue
+            if run is not None:
+                if len(run.items) < self.max_merged and self.__same_mode(run.items[-1], item) and \
+                   self.__extend(run, item):
+                    continue
+                yield self.__merged(run.items)
+            run = self.Run(item)
+            self.__add(run, item)
+        if run is not None:
+            yield self.__merged(run.items)
+        trace.planner.info("Merged movements: %i", self.eliminated)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import math
+import time
+import random
+
+import common
+
+from . import machine
+from . import parser
+from . import compact_program
+from .merger import Merger
+from .actions import linear
+from .program_builder_test import build
+from ..sender import emulatorsender
+from ..sender import spindelemulator
+
+def merged(text, angle=0.001, distance=0.005):
+    merger = Merger(angle, distance)
+    program = build(text)
+    program.actions = list(merger.merge(program.actions))
+    return program, merger
+
+def linears(program):
+    return [action for (_, action, _, _) in program.actions if isinstance(action, linear.LinearMovement)]
+
+# straight run of n movements with length 0.1 along X
+def straight(n, feed=600):
+    return "G1 F%i\n" % feed + "".join("X%.1f\n" % (0.1 * (i + 1)) for i in range(n))
+
+def test_straight_run():
+    program, merger = merged(straight(100) + "M2\n")
+    movements = linears(program)
+    assert len(movements) == 1
+    assert merger.eliminated == 99
+    assert abs(movements[0].delta.x - 10) < 1e-9
+    _, _, _, extra = [item for item in program.actions if item[1] is movements[0]][0]
+    assert abs(extra["target"].x - 10) < 1e-9
+    # lines of movements, it is made of
+    lines = movements[0].lines
+    assert [line for _, line in lines] == list(range(1, 101))
+    for i, (offset, _) in enumerate(lines):
+        assert abs(offset - 0.1 * i) < 1e-9
+
+def test_not_merged():
+    # corner, other feed, exact stop
+    for text in ["G1 F600 X1\nX2 Y0.1\nM2\n",
+                 "G1 F600 X1\nF300 X2\nM2\n",
+                 "G9 G1 F600 X1\nX2\nM2\n"]:
+        program, merger = merged(text)
+        assert merger.eliminated == 0
+
+def test_tolerances():
+    zigzag = "G1 F600\n" + "".join("X%i Y%.3f\n" % (i + 1, 0.004 * (i % 2)) for i in range(10)) + "M2\n"
+    _, merger = merged(zigzag, angle=0.01, distance=0.005)
+    assert merger.eliminated == 9
+    _, merger = merged(zigzag, angle=0.01, distance=0.001)
+    assert merger.eliminated == 0
+    _, merger = merged(zigzag, angle=0.001, distance=0.005)
+    assert merger.eliminated == 0
+
+# merging, which checks all movements of run for each new one
+def reference_merge(actions, angle, distance):
+    runs = []
+    for item in actions:
+        _, action, _, extra = item
+        if extra is None or not isinstance(action, linear.LinearMovement):
+            runs.append(None)
+            continue
+        run = runs[-1] if len(runs) > 0 else None
+        if run is not None and len(run) < Merger.max_merged and run[-1][1].feed == action.feed:
+            source = run[0][3]["move_source"]
+            chord = extra["move_target"] - source
+            direction = chord / chord.magnitude()
+            if all(ext["dir0"].dot(direction) >= math.cos(angle) and
+                   ((ext["move_target"] - source) - direction * (ext["move_target"] - source).dot(direction)).magnitude() <= distance
+                   for _, _, _, ext in run + [item]):
+                run.append(item)
+                continue
+        runs.append([item])
+    return [len(run) for run in runs if run is not None]
+
+def test_same_as_full_check():
+    rnd = random.Random(1)
+    for i in range(20):
+        # movements in plane and in space
+        z = 0.003 * (i % 2)
+        text = "G1 F600\n" + "".join("X%.4f Y%.4f Z%.4f\n" % (0.2 * (j + 1),
+                                                            rnd.uniform(-0.003, 0.003) + 0.0002 * j,
+                                                            rnd.uniform(-z, z))
+                                     for j in range(200)) + "M2\n"
+        program, merger = merged(text, angle=0.05, distance=0.005)
+        expected = reference_merge(build(text).actions, 0.05, 0.005)
+        assert [len(action.lines) if hasattr(action, "lines") else 1 for action in linears(program)] == expected
+        if z == 0:
+            # only chords, which end runs, are checked with all movements
+            assert merger.rechecked < len(expected)
+
+def test_compact_lines():
+    source, _ = merged(straight(10) + "G1 Y1\nM2\n")
+    program = compact_program.CompactProgram(source, 16)
+    program.extend(source.actions)
+    movements = [program.get_action(i)[1] for i in range(len(program))]
+    movements = [action for action in movements if isinstance(action, linear.LinearMovement)]
+    assert len(movements) == 2
+    assert [line for _, line in movements[0].lines] == list(range(1, 11))
+    assert not hasattr(movements[1], "lines")
+
+def test_machine(monkeypatch):
+    monkeypatch.setattr(common.config, "MERGE_COLINEAR", True)
+    frames = parser.GFastLineParser().parse_file(straight(50, 60) + "M2\n")
+    sender = emulatorsender.EmulatorSender()
+    m = machine.Machine(sender, spindelemulator.Spindel_EMU())
+    m.Load(frames)
+    assert m.Simulate().merged == 49
+    m.WorkStart()
+    # unlock, one movement
+    assert sender.id == 2
+
+    # line is selected by progress of merged movement
+    program = m.user_program
+    movement = linears(program)[0]
+    selected = []
+    m.line_selected += selected.append
+    m.tracker.sending(movement)
+    m.tracker.indexed(100)
+    # 60 mm/min, ~2.5 mm are passed
+    m.tracker.started(100, time.time() - 2.5)
+    m.ReportCoordinates()
+    assert len(selected) == 1 and 20 <= selected[0] <= 30
@@ -42,6 +42,10 @@ class Configuration(object):
         feed = 94
         feed_per_revolution = 95
 
+    class PathControlGroup(Enum):
+        exact_stop = 61
+        continuous = 64
+
     class UnitsGroup(Enum):
         inches = 20
         mms = 21
@@ -100,6 +104,9 @@ class Configuration(object):
         self.positioning = self.PositioningGroup.absolute
         self.feed_mode = self.FeedRateGroup.feed
         self.units = self.UnitsGroup.mms
+        self.path = self.PathControlGroup.continuous
+        # tolerance of corner blending, mm, 0 - corners are not blended
+        self.tolerance = 0
         self.CRC = self.CutterRadiusCompenstationGroup.no_compensation
         self.TLO = self.ToolLengthOffsetGroup.no_compensation
         self.Spindle = self.SpindleSpeedGroup.rpm_speed
@@ -123,6 +130,11 @@ class PositioningState(object):
         # global coordinates
         self.pos = euclid3.Vector3(0, 0, 0)
 
+        # selected tool
+        self.tool = None
+        # radiuses of tools, see machine.Machine.RegisterTool
+        self.tool_diameter = {}
+
         # modals
         self.modals = Configuration()
         self.mstack = []
@@ -136,58 +148,74 @@ class PositioningState(object):
         self.modals = self.mstack[-1]
         self.mstack = self.mstack[:len(self.mstack)-1]
 
-    def __process_G(self, cmd):
-        if cmd.value == 0:
+    def __process_G(self, value):
+        if value == 0:
             self.modals.motion = Configuration.MotionGroup.fast_move
-        elif cmd.value == 1:
+        elif value == 1:
             self.modals.motion = Configuration.MotionGroup.line
-        elif cmd.value == 2:
+        elif value == 2:
             self.modals.motion = Configuration.MotionGroup.round_cw
-        elif cmd.value == 3:
+        elif value == 3:
             self.modals.motion = Configuration.MotionGroup.round_ccw
-        elif cmd.value == 17:
+        elif value == 17:
             self.modals.plane = Configuration.PlaneGroup.xy
-        elif cmd.value == 18:
+        elif value == 18:
             self.modals.plane = Configuration.PlaneGroup.zx
-        elif cmd.value == 19:
+        elif value == 19:
             self.modals.plane = Configuration.PlaneGroup.yz
-        elif cmd.value == 20:
+        elif value == 20:
             self.modals.units = Configuration.UnitsGroup.inches
-        elif cmd.value == 21:
+        elif value == 21:
             self.modals.units = Configuration.UnitsGroup.mms
-        elif cmd.value == 53:
+        elif value == 40:
+            self.modals.CRC = Configuration.CutterRadiusCompenstationGroup.no_compensation
+        elif value == 41:
+            self.modals.CRC = Configuration.CutterRadiusCompenstationGroup.compensate_left
+        elif value == 42:
+            self.modals.CRC = Configuration.CutterRadiusCompenstationGroup.compensate_right
+        elif value == 53:
             self.modals.coord_system = Configuration.CoordinateSystemGroup.no_offset
-        elif cmd.value == 54:
+        elif value == 54:
             self.modals.coord_system = Configuration.CoordinateSystemGroup.offset_1
-        elif cmd.value == 55:
+        elif value == 55:
             self.modals.coord_system = Configuration.CoordinateSystemGroup.offset_2
-        elif cmd.value == 56:
+        elif value == 56:
             self.modals.coord_system = Configuration.CoordinateSystemGroup.offset_3
-        elif cmd.value == 57:
+        elif value == 57:
             self.modals.coord_system = Configuration.CoordinateSystemGroup.offset_4
-        elif cmd.value == 58:
+        elif value == 58:
             self.modals.coord_system = Configuration.CoordinateSystemGroup.offset_5
-        elif cmd.value == 59:
+        elif value == 59:
             self.modals.coord_system = Configuration.CoordinateSystemGroup.offset_6
-        elif cmd.value == 90:
+        elif value == 90:
             self.modals.positioning = Configuration.PositioningGroup.absolute
-        elif cmd.value == 91:
+        elif value == 91:
             self.modals.positioning = Configuration.PositioningGroup.relative
-        elif cmd.value == 94:
+        elif value == 94:
             self.modals.feed_mode = Configuration.FeedRateGroup.feed
+        elif value == 61:
+            self.modals.path = Configuration.PathControlGroup.exact_stop
+        elif value == 64:
+            self.modals.path = Configuration.PathControlGroup.continuous
 
-    def __process_M(self, cmd):
-        if cmd.value == 120:
+    def __process_M(self, value):
+        if value == 120:
             self.__push()
-        elif cmd.value == 121:
+        elif value == 121:
             self.__pop()
 
-    def process_frame(self, frame):
-        for cmd in frame.commands:
-            if cmd.type == "G":
-                self.__process_G(cmd)
-            elif cmd.type == "M":
-                self.__process_M(cmd)
+    # args - arguments.Arguments of frame
+    def process_frame(self, args):
+        for type, value in args.codes:
+            if type == "G":
+                self.__process_G(value)
+            else:
+                self.__process_M(value)
+        if 64 in args.G:
+            tolerance = args.P if args.P is not None else 0
+            if self.modals.units == Configuration.UnitsGroup.inches:
+                tolerance *= 25.4
+            self.modals.tolerance = tolerance
 
     def set_coordinate_system(self, x, y, z):
         if self.modals.coord_system == Configuration.CoordinateSystemGroup.no_offset:
@@ -212,5 +240,23 @@ class PositioningState(object):
         cs = Configuration.CoordinateSystem(x0, y0, z0)
         self.modals.offsets[self.modals.coord_system] = cs
 
+    def select_tool(self, tool):
+        self.tool = tool
+
+    # offset of cutter radius compensation: radius of selected tool,
+    # positive for G41, negative for G42 and 0 for G40, see compensation
+    def compensation(self):
+        crc = self.modals.CRC
+        if crc == Configuration.CutterRadiusCompenstationGroup.no_compensation:
+            return 0
+        if self.modals.plane != Configuration.PlaneGroup.xy:
+            raise Exception("Cutter radius compensation is supported only in XY plane")
+        radius = self.tool_diameter.get(self.tool)
+        if radius is None:
+            raise Exception("Radius of tool %s is not registered" % self.tool)
+        if crc == Configuration.CutterRadiusCompenstationGroup.compensate_right:
+            return -radius
+        return radius
+
     def copy(self):
         return copy.copy(self)
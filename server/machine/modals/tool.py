@@ -25,31 +25,28 @@ class ToolState(object):
         self.coolant      = self.CoolantGroup.no_coolant
         self.clamp        = self.ClampGroup.unclamp
 
-    def process_begin(self, frame):
-        for cmd in frame.commands:
-            if cmd.type != "M":
-                continue
-            if cmd.value == 3:
+    # args - arguments.Arguments of frame
+    def process_begin(self, args):
+        for value in args.M:
+            if value == 3:
                 self.spindle = self.SpindleGroup.spindle_cw
-            elif cmd.value == 4:
+            elif value == 4:
                 self.spindle = self.SpindleGroup.spindle_ccw
-            elif cmd.value == 7:
+            elif value == 7:
                 self.coolant = self.CoolantGroup.coolant_2
-            elif cmd.value == 8:
+            elif value == 8:
                 self.coolant = self.CoolantGroup.coolant_1
-            elif cmd.value == 10:
+            elif value == 10:
                 self.clamp = self.ClampGroup.clamp
-            elif cmd.value == 11:
+            elif value == 11:
                 self.clamp = self.ClampGroup.unclamp
             # TODO: other commands
 
-    def process_end(self, frame):
-        for cmd in frame.commands:
-            if cmd.type != "M":
-                continue
-            if cmd.value == 5:
+    def process_end(self, args):
+        for value in args.M:
+            if value == 5:
                 self.spindle = self.SpindleGroup.spindle_stop
-            elif cmd.value == 9:
+            elif value == 9:
                 self.coolant = self.CoolantGroup.no_coolant
 
     def copy(self):
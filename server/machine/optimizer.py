@@ -1,31 +1,44 @@
 import euclid3
 import math
+import numpy
+
+from common import trace
 
 class Optimizer(object):
 
-    def __init__(self, max_jerk, max_acc, max_feed):
+    # planner = "pairwise" - check each pair of feed limits, O(n^3) on chain
+    # planner = "linear"   - forward and backward pass, O(n) on chain
+    def __init__(self, max_jerk, max_acc, max_feed, planner="linear"):
+        if planner != "pairwise" and planner != "linear":
+            raise Exception("Unknown planner %s" % planner)
         self.max_acc = max_acc
         self.max_jerk = max_jerk / 60.0
         self.max_feed = max_feed / 60.0
+        self.planner = planner
 
     @staticmethod
     def __sc(a, b):
         return a.x * b.x + a.y * b.y + a.z * b.z
 
+    # maximal feed of movement, r - radius of arc
+    def __max_feed(self, feed, r=None):
+        max_feed = min(self.max_feed, feed / 60.0)
+        if r is not None:
+            maxf = (r * self.max_acc)**0.5
+            max_feed = min(maxf, max_feed)
+        return max_feed
+
     def __fill_max_feed(self, actions):
         # set maximal feed for each action
         for action, _ in actions:
-            action.max_feed = min(self.max_feed, action.feed / 60.0)
-            # set maximal feed for arcs
-            try:
-                r = action.r
-                maxf = (r * self.max_acc)**0.5
-                action.max_feed = min(maxf, action.max_feed)
-            except:
-                pass
-
-    def __max_feed_jerk(self, dir1, dir2):
-        cosa = self.__sc(dir1, dir2)
+            # arcs and helixes have curvature, see actions.helix.HelixMovement
+            curvature = getattr(action, "curvature", None)
+            r = 1 / curvature if curvature else None
+            action.max_feed = self.__max_feed(action.feed, r)
+
+    # maximal feed in junction of movements,
+    # cosa - cosine of angle between their directions
+    def __max_feed_jerk(self, cosa):
         if cosa > 1:
             cosa = 1
         if cosa <= 1e-4:
@@ -40,29 +53,40 @@ class Optimizer(object):
                 maxf2 = self.max_feed
             return min(maxf1, maxf2)
 
-    def __fill_max_feed_01(self, actions):
-        # set maximal feed0 and feed1
-        for i in range(len(actions)):
-            action = actions[i][0]
+    # feed limits at begin of chain, at junctions and at end of chain
+    def __junction_limits(self, max_feeds, cosines, entry):
+        n = len(max_feeds)
+        limits = [0] * (n + 1)
+        limits[0] = min(entry, max_feeds[0])
+        for i in range(n - 1):
+            limits[i+1] = min(self.__max_feed_jerk(cosines[i]), max_feeds[i], max_feeds[i+1])
+        return limits
 
-            dir0 = actions[i][1]["dir0"]
-            if i > 0:
-                prevdir = actions[i-1][1]["dir1"]
-                prevmf = actions[i-1][0].max_feed
-            else:
-                prevdir = euclid3.Vector3(0,0,0)
-                prevmf = 0
+    # maximal feeds of movements and feed limits at begin of chain,
+    # at junctions and at end of chain, for whole chain at once
+    #
+    # dir0, dir1 - directions at begin and end of movements, (n, 3) arrays
+    # feeds      - feeds of movements, mm/min
+    # radiuses   - radiuses of curvature of arcs, nan for lines
+    # entry      - feed at the begin of chain
+    def junction_feeds(self, dir0, dir1, feeds, radiuses, entry=0):
+        n = len(feeds)
+        max_feeds = numpy.minimum(self.max_feed, feeds / 60.0)
+        arcs = ~numpy.isnan(radiuses)
+        max_feeds[arcs] = numpy.minimum(max_feeds[arcs], (radiuses[arcs] * self.max_acc)**0.5)
 
-            action.max_feed0 = min([self.__max_feed_jerk(prevdir, dir0), action.max_feed, prevmf])
+        cosa = dir1[:-1, 0] * dir0[1:, 0] + dir1[:-1, 1] * dir0[1:, 1] + dir1[:-1, 2] * dir0[1:, 2]
+        cosa = numpy.minimum(cosa, 1)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            sina = (1 - cosa**2)**0.5
+            jerk = numpy.minimum(self.max_jerk / sina, self.max_jerk / (1 - cosa))
+        jerk = numpy.where(sina > 1e-4, jerk, self.max_feed)
+        jerk = numpy.where(cosa <= 1e-4, 0, jerk)
 
-            dir1 = actions[i][1]["dir1"]
-            if i < len(actions)-1:
-                nextdir = actions[i+1][1]["dir0"]
-                nextmf = actions[i+1][0].max_feed
-            else:
-                nextdir = euclid3.Vector3(0,0,0)
-                nextmf = 0
-            action.max_feed1 = min([self.__max_feed_jerk(nextdir, dir1), action.max_feed, nextmf])
+        limits = numpy.zeros(n + 1)
+        limits[0] = min(entry, max_feeds[0])
+        limits[1:n] = numpy.minimum(jerk, numpy.minimum(max_feeds[:-1], max_feeds[1:]))
+        return max_feeds, limits
 
     def __pos_feed(self, x0, f0, x1, f1):
         x = (x0 + x1) / 2 + (f1**2 - f0**2) / (4*self.max_acc)
@@ -108,30 +132,118 @@ class Optimizer(object):
             f1 = min(self.__feed1(fm, xm, xend), f1m)
             return f0, f0, f1    
     
-    def __process_chain(self, actions):
-        if len(actions) == 0:
-            return
-        limits = [(0, actions[0][0].max_feed0)]
-        x = 0
-        for action, _ in actions:
-            x += action.length()
-            limits.append((x, action.max_feed1))
+    def __set_feeds(self, action, f0, f, f1):
+        action.feed0 = f0*60
+        action.feed = f*60
+        action.feed1 = f1*60
+        if action.feed < 1:
+            trace.planner.warning("Zero feed: %s, f = %s, max_feed = %s, length = %s",
+                                  action, f, action.max_feed, action.length())
 
+    def __process_chain(self, limits):
+        feeds = []
         for i in range(len(limits) - 1):
-            f0, f, f1 = self.__feeds(limits, i)
-            actions[i][0].feed0 = f0*60
-            actions[i][0].feed = min(f, actions[i][0].max_feed)*60
-            actions[i][0].feed1 = f1*60
-            if actions[i][0].feed < 1:
-                print("Zero feed: ", actions[i][0])
-                print("f = ", f)
-                print("max_feed = ", actions[i][0].max_feed)
-                print("length = ", actions[i][0].length())
+            feeds.append(self.__feeds(limits, i))
+        return feeds
+
+    # Each limit (x_k, f_k) gives lines in feed^2 with equal slopes:
+    #   accelerating from limit:   f^2 = f_k^2 - 2*acc*x_k + 2*acc*x
+    #   decelerating to limit:     f^2 = f_k^2 + 2*acc*x_k - 2*acc*x
+    # so the lowest line of limits on the left (right) of segment
+    # doesn't depend on x and can be found with prefix (suffix) minimum.
+    # The pair, selected by __feeds, is the pair of these lowest lines.
+    def __process_chain_linear(self, limits):
+        n = len(limits) - 1
+        acc = self.max_acc
+
+        # forward pass
+        left = [0] * n
+        cl = None
+        for i in range(n):
+            x, f = limits[i]
+            c = f**2 - 2*acc*x
+            if cl is None or c < cl:
+                cl = c
+            left[i] = cl
+
+        # backward pass
+        right = [0] * n
+        cr = None
+        for i in range(n, 0, -1):
+            x, f = limits[i]
+            c = f**2 + 2*acc*x
+            if cr is None or c < cr:
+                cr = c
+            right[i-1] = cr
+
+        feeds = []
+        for i in range(n):
+            cl = left[i]
+            cr = right[i]
+            xbegin, f0m = limits[i]
+            xend, f1m = limits[i+1]
+            xm = (cr - cl) / (4*acc)
+            fm = ((cl + cr) / 2)**0.5
+            if xm >= xbegin and xm <= xend:
+                f0 = min(self.__feed0(fm, xm, xbegin), f0m)
+                f1 = min(self.__feed1(fm, xm, xend), f1m)
+                f = fm
+            elif xm > xend:
+                f0 = min(self.__feed0(fm, xm, xbegin), f0m)
+                f1 = min(self.__feed0(fm, xm, xend), f1m)
+                f = f1
+            else:
+                f0 = min(self.__feed1(fm, xm, xbegin), f0m)
+                f1 = min(self.__feed1(fm, xm, xend), f1m)
+                f = f0
+            feeds.append((f0, f, f1))
+        return feeds
+
+    # find feeds (f0, f, f1) of chain movements, mm/sec
+    #
+    # lengths   - lengths of movements
+    # max_feeds - maximal feeds of movements
+    # cosines   - cosines of angles in junctions of movements
+    # entry     - feed at the begin of chain
+    def chain_feeds(self, lengths, max_feeds, cosines, entry=0):
+        if len(lengths) == 0:
+            return []
+        junctions = self.__junction_limits(max_feeds, cosines, entry)
+        return self.__plan(lengths, max_feeds, junctions)
+
+    # same as chain_feeds, for chain, given by arrays, see junction_feeds
+    def chain_feeds_arrays(self, lengths, dir0, dir1, feeds, radiuses, entry=0):
+        if len(lengths) == 0:
+            return []
+        max_feeds, junctions = self.junction_feeds(dir0, dir1, feeds, radiuses, entry)
+        return self.__plan(lengths, max_feeds.tolist(), junctions.tolist())
+
+    def __plan(self, lengths, max_feeds, junctions):
+        n = len(lengths)
+        limits = [(0, junctions[0])]
+        x = 0
+        for i in range(n):
+            x += lengths[i]
+            limits.append((x, junctions[i+1]))
+
+        if self.planner == "linear":
+            feeds = self.__process_chain_linear(limits)
+        else:
+            feeds = self.__process_chain(limits)
+        return [(f0, min(f, max_feeds[i]), f1) for i, (f0, f, f1) in enumerate(feeds)]
+
     # optimize chain
-    def __optimize_chain(self, actions):
-        self.__fill_max_feed(actions)
-        self.__fill_max_feed_01(actions)
-        self.__process_chain(actions)
+    #
+    # entry - feed at the begin of chain
+    def __optimize_chain(self, actions, entry=0):
+        lengths = [action.length() for action, _ in actions]
+        max_feeds = [action.max_feed for action, _ in actions]
+        cosines = [self.__sc(actions[i][1]["dir1"], actions[i+1][1]["dir0"])
+                   for i in range(len(actions) - 1)]
+        feeds = self.chain_feeds(lengths, max_feeds, cosines, entry)
+        for i in range(len(actions)):
+            f0, f, f1 = feeds[i]
+            self.__set_feeds(actions[i][0], f0, f, f1)
 
     # optimize program
     #
@@ -139,10 +251,11 @@ class Optimizer(object):
     # and optimize each chain
     def optimize(self, program):
         chain = []
-        print("Start optimization")
+        trace.planner.info("Start optimization")
         for (_, action, _, extra) in program.actions:
             if action.is_moving == False or extra is None:
                 if len(chain) > 0:
+                    self.__fill_max_feed(chain)
                     self.__optimize_chain(chain)
                     chain = []
                 continue
@@ -150,5 +263,58 @@ class Optimizer(object):
             chain.append((action, extra))
 
         if len(chain) > 0:
+            self.__fill_max_feed(chain)
             self.__optimize_chain(chain)
-        print("Optimized")
+        trace.planner.info("Optimized")
+
+    # optimize program, stored in columns, see compact_program.CompactProgram
+    def optimize_compact(self, program):
+        trace.planner.info("Start optimization")
+        dir0 = numpy.frombuffer(program.dir0).reshape(-1, 3)
+        dir1 = numpy.frombuffer(program.dir1).reshape(-1, 3)
+        feed = numpy.frombuffer(program.feed)
+        radiuses = numpy.frombuffer(program.radius)
+        for begin, end in program.chains():
+            feeds = self.chain_feeds_arrays(program.length[begin:end],
+                                            dir0[begin:end], dir1[begin:end],
+                                            feed[begin:end], radiuses[begin:end])
+            for i in range(begin, end):
+                f0, f, f1 = feeds[i - begin]
+                program.feed0[i] = f0*60
+                program.feed[i] = f*60
+                program.feed1[i] = f1*60
+        # release buffers of columns
+        del dir0, dir1, feed, radiuses
+        trace.planner.info("Optimized")
+
+    # optimize actions, given by iterator, and give them out
+    #
+    # Chains are planned in windows of `window` movements. Window is
+    # planned with stop at its end, only first half of window is given
+    # out, and it's end feed is the begin feed of next window.
+    def optimize_stream(self, actions, window):
+        chain = []
+        entry = 0
+        for item in actions:
+            (_, action, _, extra) = item
+            if action.is_moving == False or extra is None:
+                if len(chain) > 0:
+                    self.__optimize_chain([(act, ext) for (_, act, _, ext) in chain], entry)
+                    yield from chain
+                    chain = []
+                    entry = 0
+                yield item
+                continue
+
+            self.__fill_max_feed([(action, extra)])
+            chain.append(item)
+            if len(chain) >= window:
+                self.__optimize_chain([(act, ext) for (_, act, _, ext) in chain], entry)
+                n = max(len(chain) // 2, 1)
+                yield from chain[:n]
+                entry = chain[n-1][1].feed1 / 60
+                chain = chain[n:]
+
+        if len(chain) > 0:
+            self.__optimize_chain([(act, ext) for (_, act, _, ext) in chain], entry)
+            yield from chain
@@ -1,12 +1,23 @@
 #!/usr/bin/env python3
 
-import optimizer
+import os
+import math
+import random
 import euclid3
+import numpy
+
+from . import optimizer
+from . import parser
+from .program_builder import ProgramBuilder
+from ..sender import emulatorsender
+from ..sender import spindelemulator
+
+examples = os.path.join(os.path.dirname(__file__), "..", "..", "examples")
 
 class FakeMovement(object):
-    def __init__(self, d):
-        self.delta = euclid3.Vector3(d, 0, 0)
-        self.feed = 600
+    def __init__(self, delta, feed=600):
+        self.delta = delta
+        self.feed = feed
         self.feed0 = 0
         self.feed1 = 0
         self.is_moving = True
@@ -19,28 +30,177 @@ class FakeMovement(object):
         return self.delta / self.length()
 
 class FakeProgram(object):
-    def __init__(self, actions):
-        self.actions = actions
-
-acts = []
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-acts.append((0, FakeMovement(0.1), 0))
-
-
-opt = optimizer.Optimizer(20, 20, 600)
-opt.optimize(FakeProgram(acts))
-
-for (_, act, _) in acts:
-    print(act.feed0, act.feed, act.feed1)
+    def __init__(self, movements):
+        self.actions = []
+        for i in range(len(movements)):
+            mv = movements[i]
+            extra = {
+                "dir0" : mv.dir0(),
+                "dir1" : mv.dir1(),
+            }
+            self.actions.append((i, mv, i, extra))
+
+def straight_chain(n, d):
+    return [FakeMovement(euclid3.Vector3(d, 0, 0)) for _ in range(n)]
+
+def random_chain(n, seed):
+    rnd = random.Random(seed)
+    movements = []
+    for _ in range(n):
+        a = rnd.uniform(-math.pi, math.pi)
+        l = rnd.choice([0.01, 0.1, 1, 10, 100]) * rnd.uniform(0.5, 1.5)
+        delta = euclid3.Vector3(l * math.cos(a), l * math.sin(a), rnd.uniform(-0.1, 0.1))
+        movements.append(FakeMovement(delta, rnd.choice([100, 600, 800, 1200])))
+    return movements
+
+def planned_feeds(program, planner):
+    opt = optimizer.Optimizer(20, 40, 800, planner)
+    opt.optimize(program)
+    feeds = []
+    for (_, action, _, _) in program.actions:
+        if action.is_moving:
+            feeds.append((action.feed0, action.feed, action.feed1))
+    return feeds
+
+def assert_same(feeds_a, feeds_b):
+    assert len(feeds_a) == len(feeds_b)
+    for fa, fb in zip(feeds_a, feeds_b):
+        for a, b in zip(fa, fb):
+            assert abs(a - b) <= 1e-6 * max(1, abs(a), abs(b)), (fa, fb)
+
+def compare_chain(make):
+    assert_same(planned_feeds(FakeProgram(make()), "pairwise"),
+                planned_feeds(FakeProgram(make()), "linear"))
+
+def build_text(text):
+    gp = parser.GLineParser()
+    frames = [gp.parse(line) for line in text.splitlines()]
+    builder = ProgramBuilder(emulatorsender.EmulatorSender(),
+                             spindelemulator.Spindel_EMU(),
+                             {"tools" : {}})
+    return builder.build_program(frames)
+
+def build_example(name):
+    return build_text(open(os.path.join(examples, name)).read())
+
+def test_straight_chain():
+    compare_chain(lambda: straight_chain(14, 0.1))
+    compare_chain(lambda: straight_chain(100, 5))
+
+def test_random_chains():
+    for seed in range(20):
+        compare_chain(lambda: random_chain(60, seed))
+
+def test_straight_chain_profile():
+    feeds = planned_feeds(FakeProgram(straight_chain(14, 0.1)), "linear")
+    assert feeds[0][0] == 0
+    assert feeds[-1][2] == 0
+    for i in range(len(feeds) - 1):
+        assert abs(feeds[i][2] - feeds[i+1][0]) < 1e-6
+
+def test_box_example():
+    assert_same(planned_feeds(build_example("box.gcode"), "pairwise"),
+                planned_feeds(build_example("box.gcode"), "linear"))
+
+def stream_feeds(program, window):
+    opt = optimizer.Optimizer(20, 40, 800)
+    feeds = []
+    for (_, action, _, _) in opt.optimize_stream(iter(program.actions), window):
+        if action.is_moving:
+            feeds.append((action.feed0, action.feed, action.feed1))
+    return feeds
+
+def test_stream_big_window():
+    assert_same(planned_feeds(FakeProgram(random_chain(200, 1)), "linear"),
+                stream_feeds(FakeProgram(random_chain(200, 1)), 1000))
+    assert_same(planned_feeds(build_example("box.gcode"), "linear"),
+                stream_feeds(build_example("box.gcode"), 1000))
+
+def test_stream_small_window():
+    full = planned_feeds(FakeProgram(straight_chain(100, 5)), "linear")
+    for window in [1, 2, 7, 16]:
+        feeds = stream_feeds(FakeProgram(straight_chain(100, 5)), window)
+        assert len(feeds) == len(full)
+        assert feeds[0][0] == 0
+        assert feeds[-1][2] == 0
+        for i in range(len(feeds)):
+            assert feeds[i][1] <= full[i][1] + 1e-6
+            if i > 0:
+                assert abs(feeds[i-1][2] - feeds[i][0]) < 1e-6
+
+def test_stream_order():
+    program = build_example("box.gcode")
+    expected = [action for (_, action, _, _) in program.actions]
+    opt = optimizer.Optimizer(20, 40, 800)
+    streamed = [action for (_, action, _, _) in opt.optimize_stream(iter(program.actions), 4)]
+    assert streamed == expected
+
+def test_unknown_planner():
+    try:
+        optimizer.Optimizer(20, 40, 800, "unknown")
+    except Exception:
+        return
+    assert False
+
+def array_feeds(movements, planner="linear"):
+    opt = optimizer.Optimizer(20, 40, 800, planner)
+    lengths = [mv.length() for mv in movements]
+    dir0 = numpy.array([tuple(mv.dir0()) for mv in movements])
+    dir1 = numpy.array([tuple(mv.dir1()) for mv in movements])
+    feeds = numpy.array([mv.feed for mv in movements], dtype=float)
+    radiuses = numpy.array([1 / mv.curvature if hasattr(mv, "curvature") else numpy.nan for mv in movements])
+    return [(f0*60, f*60, f1*60) for (f0, f, f1) in
+            opt.chain_feeds_arrays(lengths, dir0, dir1, feeds, radiuses)]
+
+def test_arrays_random_chains():
+    for seed in range(20):
+        assert_same(planned_feeds(FakeProgram(random_chain(60, seed)), "linear"),
+                    array_feeds(random_chain(60, seed)))
+
+def test_arrays_arc_radius():
+    def make():
+        movements = random_chain(60, 5)
+        for mv in movements[::3]:
+            mv.curvature = 1 / mv.length()
+        return movements
+    expected = planned_feeds(FakeProgram(make()), "linear")
+    assert_same(expected, array_feeds(make()))
+    # radius limits feed
+    assert expected != planned_feeds(FakeProgram(random_chain(60, 5)), "linear")
+
+def test_arrays_junctions():
+    # straight, almost straight, right angle, reversal
+    deltas = [(1, 0, 0), (1, 0, 0), (1, 1e-6, 0), (0, 1, 0), (0, -1, 0), (1, 0, 0)]
+    def make():
+        return [FakeMovement(euclid3.Vector3(*d) * 10) for d in deltas]
+    assert_same(planned_feeds(FakeProgram(make()), "linear"), array_feeds(make()))
+    opt = optimizer.Optimizer(20, 40, 800)
+    movements = make()
+    _, limits = opt.junction_feeds(numpy.array([tuple(mv.dir0()) for mv in movements]),
+                                   numpy.array([tuple(mv.dir1()) for mv in movements]),
+                                   numpy.full(len(movements), 600.0),
+                                   numpy.full(len(movements), numpy.nan))
+    assert limits[0] == 0 and limits[-1] == 0
+    assert limits[1] == 10 and limits[2] == 10
+    assert limits[4] == 0
+
+# line, tangent fillet, line, tangent arc, tangent line
+fillets = "G1 X10 Y0 F600\nG3 X12 Y2 R2\nG1 Y10\nG2 X20 Y18 R8\nG1 X30\nM2\n"
+
+def test_arc_radius_limit():
+    program = build_text(fillets)
+    optimizer.Optimizer(20, 40, 800).optimize(program)
+    movements = [action for (_, action, _, extra) in program.actions
+                 if action.is_moving and extra is not None]
+    assert [type(action).__name__ for action in movements] == \
+        ["LinearMovement", "HelixMovement", "LinearMovement", "HelixMovement", "LinearMovement"]
+    assert abs(movements[1].r - 2) < 1e-6
+    assert abs(movements[1].curvature - 0.5) < 1e-6
+    # centripetal acceleration in arc is not bigger than max_acc
+    limit = (2 * 40)**0.5 * 60
+    assert abs(movements[1].feed - limit) < 1e-6
+    assert movements[3].feed == 600
+    # tangent junctions are passed without stop
+    for first, second in zip(movements[:-1], movements[1:]):
+        assert first.feed1 > 1 and abs(first.feed1 - second.feed0) < 1e-6
+    assert abs(movements[0].feed1 - limit) < 1e-6
@@ -1,15 +1,38 @@
 #/usr/bin/env python3
 
+import re
+import gc
+
+from . import arguments
+
+# P is id of subprogram (M97) or tolerance (G64)
+def _int_or_float(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
 class GCmd(object):
 
+    # types of values, other values are strings
+    converters = dict([(c, int) for c in "GMTL"] + [(c, float) for c in "FXYZABCIJKSR"] + [("P", _int_or_float)])
+
     def __init__(self, s):
         self.parsed = None
         self.type = s[0]
         self.value = s[1:]
-        if "GMTPL".find(self.type) != -1:
-            self.value = int(self.value)
-        elif "FXYZABCIJKSR".find(self.type) != -1:
-            self.value = float(self.value)
+        convert = GCmd.converters.get(self.type)
+        if convert is not None:
+            self.value = convert(self.value)
+
+    # command with already converted value
+    @staticmethod
+    def make(type, value):
+        cmd = GCmd.__new__(GCmd)
+        cmd.parsed = None
+        cmd.type = type
+        cmd.value = value
+        return cmd
 
     def __repr__(self):
         return str(self.type) + str(self.value)
@@ -19,9 +42,19 @@ class GFrame(object):
     def __init__(self, commands=[]):
         self.commands = commands
         self.comments = []
+        self.args = None
     
     def add_cmd(self, cmd):
         self.commands.append(cmd)
+        self.args = None
+
+    # words of frame, see arguments.Arguments. They are found once,
+    # when they are requested first time, so errors in frame are
+    # reported when program is built, not when it is loaded
+    def decode(self):
+        if self.args is None:
+            self.args = arguments.Arguments(self)
+        return self.args
     
     def add_comment(self, comment):
         self.comments.append(comment)
@@ -101,3 +134,93 @@ class GLineParser(object):
             return GFrame()
         return self.__parse_frame(line)
 
+
+# Parser with same results as GLineParser, which walks line with index
+# instead of slicing it, and can parse whole file at once
+class GFastLineParser(object):
+
+    __number = re.compile(r"[0-9.+\-\[\]#=]*")
+    # line of words without comments
+    __words_line = re.compile(r"(?: *[A-Z][0-9.+\-\[\]#=]*)* *\n?")
+    __word = re.compile(r"([A-Z])([0-9.+\-\[\]#=]*)")
+
+    # parse s[pos:end]
+    def __parse_frame(self, s, pos, end):
+        if self.__words_line.fullmatch(s, pos, end) is not None:
+            words = self.__word.findall(s, pos, end)
+            return GFrame([GCmd(letter + n) for letter, n in words])
+
+        number = self.__number
+        frame = GFrame([])
+        while pos < end:
+            c = s[pos]
+            if c == " ":
+                pos += 1
+            elif c == "\n":
+                break
+            elif c == "(":
+                close = s.find(")", pos + 1, end)
+                if close == -1:
+                    frame.add_comment(s[pos + 1:end])
+                    break
+                frame.add_comment(s[pos + 1:close])
+                pos = close + 1
+            elif c == ";":
+                frame.add_comment(s[pos + 1:end])
+                break
+            elif c.isalpha() and c.isupper():
+                npos = number.match(s, pos + 1, end).end()
+                frame.add_cmd(GCmd(s[pos:npos]))
+                pos = npos
+            else:
+                raise Exception("Invalid call of parse word %s" % s[pos:end])
+        return frame
+
+    def __parse_line(self, s, pos, end):
+        while pos < end and s[pos] == " ":
+            pos += 1
+        if pos == end or s[pos] == "%":
+            return GFrame([])
+        return self.__parse_frame(s, pos, end)
+
+    def parse(self, line):
+        return self.__parse_line(line, 0, len(line))
+
+    # Frames don't have reference cycles, so garbage collector is
+    # disabled while they are created, else it scans all created
+    # frames again and again
+    def parse_lines(self, lines):
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return [self.__parse_line(line, 0, len(line)) for line in lines]
+        finally:
+            if enabled:
+                gc.enable()
+
+    # parse whole file
+    #
+    # data - str, or bytes, or mmap. Bytes are decoded as file,
+    #        opened in text mode, so frames are same as for lines,
+    #        given by readlines()
+    def parse_file(self, data):
+        if not isinstance(data, str):
+            data = str(data, "utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        frames = []
+        pos = 0
+        n = len(data)
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            while pos < n:
+                end = data.find("\n", pos)
+                if end == -1:
+                    end = n
+                else:
+                    end += 1
+                frames.append(self.__parse_line(data, pos, end))
+                pos = end
+        finally:
+            if enabled:
+                gc.enable()
+        return frames
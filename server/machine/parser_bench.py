@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+# Benchmark of G-code parsers
+#
+# Lines of examples/*.gcode are repeated up to given amount of lines.
+# Run from repository root:
+#
+#   python3 -m server.machine.parser_bench [lines]
+
+import os
+import sys
+import glob
+import time
+import mmap
+import tempfile
+
+from . import parser
+
+examples = os.path.join(os.path.dirname(__file__), "..", "..", "examples")
+
+def make_text(amount):
+    lines = []
+    for name in sorted(glob.glob(os.path.join(examples, "*.gcode"))):
+        lines += open(name).readlines()
+    text = "".join(lines)
+    repeat = max(amount // len(lines), 1)
+    return text * repeat, len(lines) * repeat
+
+def measure(name, amount, fun):
+    t = time.time()
+    fun()
+    t = time.time() - t
+    print("%-28s %8.2f s %12.0f lines/s" % (name, t, amount / t))
+
+def main(amount):
+    text, amount = make_text(amount)
+    lines = text.splitlines(keepends=True)
+    print("Lines: %i" % amount)
+
+    slow = parser.GLineParser()
+    fast = parser.GFastLineParser()
+    measure("GLineParser.parse", amount, lambda: [slow.parse(line) for line in lines])
+    measure("GFastLineParser.parse_lines", amount, lambda: fast.parse_lines(lines))
+    measure("GFastLineParser.parse_file", amount, lambda: fast.parse_file(text))
+
+    with tempfile.TemporaryFile() as f:
+        f.write(text.encode("utf-8"))
+        f.flush()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            measure("GFastLineParser (mmap)", amount, lambda: fast.parse_file(m))
+
+if __name__ == "__main__":
+    amount = 1000000
+    if len(sys.argv) > 1:
+        amount = int(sys.argv[1])
+    main(amount)
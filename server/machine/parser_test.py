@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import mmap
+
+from . import parser
+
+examples = os.path.join(os.path.dirname(__file__), "..", "..", "examples")
+
+lines = [
+    "",
+    "\n",
+    "   \n",
+    "%\n",
+    "G1 X1.5 Y-2 Z+3 F600\n",
+    "G1X1.5Y-2\n",
+    "  N10 G0 Z10 ; comment\n",
+    "G0 (first) X1 (second) Y2\n",
+    "G0 (not closed X1\n",
+    "G0 X1",
+    "M97 P3 L5\n",
+    "G1 D1.5 H2 O100 N#1\n",
+    "G0 X1\nY2\n",
+]
+
+def same_frames(a, b):
+    assert repr(a) == repr(b)
+    assert a.comments == b.comments
+    assert [(c.type, c.value) for c in a.commands] == [(c.type, c.value) for c in b.commands]
+    for c1, c2 in zip(a.commands, b.commands):
+        assert type(c1.value) == type(c2.value)
+
+def example_files():
+    return sorted(glob.glob(os.path.join(examples, "*.gcode")))
+
+def test_lines():
+    slow = parser.GLineParser()
+    fast = parser.GFastLineParser()
+    for line in lines:
+        same_frames(slow.parse(line), fast.parse(line))
+
+def test_examples():
+    slow = parser.GLineParser()
+    fast = parser.GFastLineParser()
+    for name in example_files():
+        text = open(name).readlines()
+        expected = [slow.parse(line) for line in text]
+        frames = fast.parse_lines(text)
+        assert len(frames) == len(expected)
+        for a, b in zip(expected, frames):
+            same_frames(a, b)
+
+def test_file():
+    slow = parser.GLineParser()
+    fast = parser.GFastLineParser()
+    for name in example_files():
+        expected = [slow.parse(line) for line in open(name).readlines()]
+        with open(name, "rb") as f:
+            data = f.read()
+            by_bytes = fast.parse_file(data)
+            by_str = fast.parse_file(data.decode("utf-8"))
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                by_mmap = fast.parse_file(m)
+        for frames in [by_bytes, by_str, by_mmap]:
+            assert len(frames) == len(expected)
+            for a, b in zip(expected, frames):
+                same_frames(a, b)
+
+def test_crlf():
+    fast = parser.GFastLineParser()
+    frames = fast.parse_file(b"G0 X1\r\nG1 Y2 ; c\r\n")
+    assert [repr(f) for f in frames] == ["G0 X1.0", "G1 Y2.0"]
+    assert frames[1].comments == [" c\n"]
+
+def test_errors():
+    for line in ["G1 x1\n", "G1 X1\t\n", "G1 X1.5.5\n"]:
+        errors = []
+        for p in [parser.GLineParser(), parser.GFastLineParser()]:
+            try:
+                p.parse(line)
+                errors.append(None)
+            except Exception as e:
+                errors.append(type(e))
+        assert errors[0] is not None
+        assert errors[0] == errors[1]
@@ -12,6 +12,7 @@ from .modals import positioning
 
 from .common import config
 from .common import event
+from common import trace
 
 import euclid3
 
@@ -27,11 +28,17 @@ class Program(object):
         self.update_current_cs_ev = event.EventEmitter()
 
     def __add_action(self, action, extra=None):
+        action.line = self.line
         self.actions.append((self.index, action, self.line, extra))
 
     def inc_index(self):
         self.index += 1
 
+    def get_action(self, i):
+        if i < len(self.actions):
+            return self.actions[i]
+        return None
+
     def insert_reset_coordinates(self, x=None, y=None, z=None):
         def crdcb(hw):
             self.reset_coordinates_ev(hw, x, y, z)
@@ -164,6 +171,8 @@ class Program(object):
             "move_target" : move_target,
             "dir0" : dir0,
             "dir1" : dir1,
+            "tolerance" : table_state.modals.tolerance,
+            "compensation" : table_state.compensation(),
         }
         self.__add_action(movement, extra)
 
@@ -188,7 +197,7 @@ class Program(object):
 
         center, dir0, dir1, arc_angle = helix.HelixMovement.find_geometry(source, target, ccw, axis, r=R)
 
-        print("Center(R) = ", center)
+        trace.planner.debug("Center(R) = %s", center)
         move_source = source + offset * dir0
         move_target = target + offset * dir1
 
@@ -208,6 +217,7 @@ class Program(object):
             "move_target" : move_target,
             "dir0" : dir0,
             "dir1" : dir1,
+            "compensation" : table_state.compensation(),
         }
         self.__add_action(movement, extra)
 
@@ -215,6 +225,21 @@ class Program(object):
         ccw = table_state.modals.motion == positioning.Configuration.MotionGroup.round_ccw
         axis = self.__axis_convert(table_state.modals.plane)
 
+        # full circle (or turn of helix) can not be sent to MCU with one command,
+        # it is sent as 2 halfs
+        normal = helix.HelixMovement.normal(axis)
+        delta = target - source
+        if (delta - normal * delta.dot(normal)).magnitude() < 1e-6:
+            to_center = euclid3.Vector3(I, J, K)
+            to_center -= normal * to_center.dot(normal)
+            if to_center.magnitude() == 0:
+                raise Exception("Empty movement")
+            middle = source + to_center * 2 + delta / 2
+            self.__insert_arc_IJK(source, middle, offset, I, J, K, table_state)
+            to_center = source + to_center - middle
+            self.__insert_arc_IJK(middle, target, offset, to_center.x, to_center.y, to_center.z, table_state)
+            return
+
         center, dir0, dir1, arc_angle = helix.HelixMovement.find_geometry(source, target, ccw, axis, i=I, j=J, k=K)
 
         move_source = source + offset * dir0
@@ -222,7 +247,7 @@ class Program(object):
         #print("Offset = ", offset)
         #print("Src = ", move_source)
         #print("Dst = ", move_target)
-        print("Center(IJK) = ", center)
+        trace.planner.debug("Center(IJK) = %s", center)
         movement = helix.HelixMovement(source_to_center=center - move_source,
                                        delta=move_target - move_source,
                                        axis=axis,
@@ -239,11 +264,12 @@ class Program(object):
             "move_target" : move_target,
             "dir0" : dir0,
             "dir1" : dir1,
+            "compensation" : table_state.compensation(),
         }
         self.__add_action(movement, extra)
 
     def insert_move(self, pos, table_state):
-        print("*** Insert move ", pos.X, pos.Y, pos.Z)
+        trace.planner.debug("Insert move %s %s %s", pos.X, pos.Y, pos.Z)
         #traceback.print_stack()
         #print(table_state.positioning)
 
@@ -305,6 +331,32 @@ class Program(object):
 
         return target
     
+    # parameters of last inserted movement, to repeat it from other position
+    def movement_template(self):
+        _, movement, _, extra = self.actions[-1]
+        params = {
+            "delta" : movement.delta,
+            "feed" : movement.feed,
+            "acc" : movement.acceleration,
+        }
+        if isinstance(movement, helix.HelixMovement):
+            params["source_to_center"] = movement.source_to_center
+            params["axis"] = movement.axis
+            params["ccw"] = movement.ccw
+        extra = dict((name, value.copy() if isinstance(value, euclid3.Vector3) else value)
+                     for name, value in extra.items())
+        return (type(movement), params, extra)
+
+    # insert movement from movement_template, shifted by `shift`
+    def insert_shifted_movement(self, template, shift):
+        cls, params, extra = template
+        movement = cls(sender=self.table_sender, **params)
+        extra = dict(extra)
+        for name in ["source", "target", "move_source", "move_target"]:
+            extra[name] = extra[name] + shift
+        self.__add_action(movement, extra)
+        return extra["target"]
+
     def insert_stop(self):
         self.__add_action(pause.Break())
 
@@ -345,3 +397,45 @@ class Program(object):
         self.actions = None
         self.reset_coordinates_ev.dispose()
         self.update_current_cs_ev.dispose()
+
+# Program, which actions are taken from iterator when they are requested
+#
+# Only last `keep` actions and actions, which are not finished yet,
+# are stored, so memory doesn't depend on length of program
+class StreamProgram(Program):
+
+    def __init__(self, program, source, keep):
+        Program.__init__(self, program.table_sender, program.spindle_sender)
+        self.reset_coordinates_ev = program.reset_coordinates_ev
+        self.update_current_cs_ev = program.update_current_cs_ev
+        self.source = source
+        self.offset = 0
+        self.keep = keep
+
+    def __trim(self, i):
+        if i - self.offset < 2 * self.keep:
+            return
+        n = 0
+        while n < i - self.offset - self.keep and self.actions[n][1].finished.is_set():
+            self.actions[n][1].dispose()
+            n += 1
+        self.actions = self.actions[n:]
+        self.offset += n
+
+    def get_action(self, i):
+        while i >= self.offset + len(self.actions):
+            if self.source is None:
+                return None
+            try:
+                self.actions.append(next(self.source))
+            except StopIteration:
+                self.source = None
+                return None
+        self.__trim(i)
+        return self.actions[i - self.offset]
+
+    def dispose(self):
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+        Program.dispose(self)
@@ -1,7 +1,13 @@
 import euclid3
+import copy
 
 from . import program
-from . import arguments
+from . import blender
+from . import compensation
+from . import merger
+
+import common
+from common import trace
 
 from .modals import positioning
 from .modals import tool
@@ -20,19 +26,28 @@ class ProgramBuilder(object):
         self.table_state.tool_diameter = registers["tools"]
 
         self.__subprograms = {}
+        # items are (frame id, True if it is begin of subprogram call)
         self.program_stack = []
+        self.__entering = False
+        self.__templates = {}
+        self.__recordings = []
+        # amount of subprogram calls, built from templates
+        self.replayed = 0
         self.finish_cb = None
         self.tool_select_cb = None
         self.pause_cb = None
+        self.merger = None
+        if common.config.MERGE_COLINEAR:
+            self.merger = merger.Merger(common.config.MERGE_ANGLE, common.config.MERGE_DISTANCE)
 
     def get_state(self):
         return (self.table_state, self.tool_state)
 
     #region movement options
     def __set_feed(self, feed):
-        if self.table_state.feed_mode != positioning.PositioningState.FeedRateGroup.feed:
-            raise Exception("Unsupported feed mode %s" % self.table_state.feed_mode)
-        self.table_state.feed = feed
+        if self.table_state.modals.feed_mode != positioning.Configuration.FeedRateGroup.feed:
+            raise Exception("Unsupported feed mode %s" % self.table_state.modals.feed_mode)
+        self.table_state.modals.feed = feed
         return None
 
     def set_acceleration(self, acc):
@@ -45,41 +60,173 @@ class ProgramBuilder(object):
     #endregion movement options
 
     #region Subprograms
-    def __use_subprogram(self, id, frame):
-        pr = arguments.ProgramId(frame)
-        if pr.program is None:
-            print("WARNING: no subprogram Id, ignoring")
+    def __use_subprogram(self, id, args):
+        if args.P is None:
+            trace.planner.warning("No subprogram Id, ignoring")
             return None
 
-        pid = pr.program
+        pid = args.P
         subprogram = self.__subprograms[pid]
 
-        self.program_stack.append(id + 1)
+        self.program_stack.append((id + 1, False))
         # for multiple calling
-        for _ in range(pr.num - 1):
-            self.program_stack.append(subprogram)
+        for _ in range(args.num - 1):
+            self.program_stack.append((subprogram, True))
 
+        self.__entering = True
         return subprogram
 
     def __return_from_subprogramm(self):
         if len(self.program_stack) == 0:
-            self.program.insert_program_end(self.finish_cb)
+            self.__emit("insert_program_end", self.finish_cb)
             return -1
 
-        tid = self.program_stack[-1]
+        tid, call = self.program_stack[-1]
         self.program_stack = self.program_stack[:-1]
+        self.__entering = call
         return tid
     #endregion
 
+    #region Subprogram templates
+    # Actions of subprogram call are recorded as operations of builder.
+    # When subprogram is called again with same modal state, operations
+    # are repeated, without processing of frames. Movements are repeated
+    # with modals of recorded call, so relative movements stay relative
+    # and absolute ones are found from current position.
+    #
+    # Calls, which depend on position in other way (G92), or on stack
+    # of modals (M120, M121), are not recorded.
+
+    class Recording(object):
+        def __init__(self, key, depth):
+            self.key = key
+            self.depth = depth
+            self.ops = []
+            self.valid = True
+
+    class Template(object):
+        def __init__(self, ops, modals, tool_state):
+            self.ops = ops
+            self.modals = modals
+            self.tool_state = tool_state
+
+    @staticmethod
+    def __modals_key(configuration):
+        modals = []
+        for name, value in sorted(vars(configuration).items()):
+            if name == "offsets":
+                value = tuple((cs.value, offset.x, offset.y, offset.z) for cs, offset in value.items())
+            modals.append((name, value))
+        return tuple(modals)
+
+    def __state_key(self):
+        # selected tool gives radius of compensation
+        return (self.__modals_key(self.table_state.modals), self.table_state.tool,
+                tuple(sorted(vars(self.tool_state).items())))
+
+    # key of state with position and stack of modals, program built
+    # from same frames in same state is same, see cache.ProgramCache.plan_key
+    def state_key(self):
+        return (self.__state_key(), tuple(self.table_state.pos),
+                tuple(self.__modals_key(modals) for modals in self.table_state.mstack))
+
+    def __apply(self, op, args, kwargs):
+        if op == "line":
+            self.program.line = args[0]
+        elif op == "inc":
+            self.program.inc_index()
+        elif op == "move":
+            pos, modals = args
+            current = self.table_state.modals
+            self.table_state.modals = modals
+            self.table_state.pos = self.program.insert_move(pos, self.table_state)
+            self.table_state.modals = current
+        elif op == "shifted":
+            template, source = args
+            self.table_state.pos = self.program.insert_shifted_movement(template, self.table_state.pos - source)
+        elif op == "pos":
+            for name, value in kwargs.items():
+                setattr(self.table_state.pos, name, value)
+        elif op == "select_tool":
+            self.table_state.select_tool(*args)
+        else:
+            getattr(self.program, op)(*args, **kwargs)
+
+    # apply operation and record it for all recorded calls
+    def __emit(self, op, *args, **kwargs):
+        for recording in self.__recordings:
+            recording.ops.append((op, args, kwargs))
+        self.__apply(op, args, kwargs)
+
+    # relative movements are recorded as ready movements, which are
+    # shifted to current position, absolute ones are found again
+    def __emit_move(self, pos):
+        modals = self.table_state.modals
+        if len(self.__recordings) == 0:
+            self.__apply("move", (pos, modals), {})
+            return
+        if modals.positioning == positioning.Configuration.PositioningGroup.relative:
+            source = self.table_state.pos.copy()
+            self.__apply("move", (pos, modals), {})
+            op = ("shifted", (self.program.movement_template(), source), {})
+        else:
+            modals = copy.copy(modals)
+            self.__apply("move", (pos, modals), {})
+            op = ("move", (pos, modals), {})
+        for recording in self.__recordings:
+            recording.ops.append(op)
+
+    def __invalidate_recordings(self):
+        for recording in self.__recordings:
+            recording.valid = False
+
+    # finish recordings of calls, which are returned from
+    def __finish_recordings(self):
+        while len(self.__recordings) > 0 and \
+              len(self.program_stack) < self.__recordings[-1].depth:
+            recording = self.__recordings.pop()
+            if recording.valid:
+                template = self.Template(recording.ops,
+                                         copy.copy(self.table_state.modals),
+                                         self.tool_state.copy())
+                self.__templates[recording.key] = template
+
+    def __replay(self, template):
+        for op, args, kwargs in template.ops:
+            self.__emit(op, *args, **kwargs)
+        modals = copy.copy(template.modals)
+        modals.offsets = self.table_state.modals.offsets
+        self.table_state.modals = modals
+        self.tool_state = template.tool_state.copy()
+
+    # begin of subprogram call, returns id of next frame
+    def __enter(self, start):
+        if not common.config.SUBPROGRAM_TEMPLATES:
+            self.__entering = False
+            return start
+        while self.__entering:
+            self.__entering = False
+            key = (start, self.__state_key())
+            template = self.__templates.get(key)
+            if template is None:
+                self.__recordings.append(self.Recording(key, len(self.program_stack)))
+                return start
+            self.__replay(template)
+            self.replayed += 1
+            # call is finished with M99
+            start = self.__return_from_subprogramm()
+        return start
+    #endregion
+
     #region spindle control
     def __start_stop_spindle(self, old, new):
         if old != new:
             if new == self.tool_state.SpindleGroup.spindle_stop:
-                self.program.insert_spindle_off()
+                self.__emit("insert_spindle_off")
             elif new == self.tool_state.SpindleGroup.spindle_cw:
-                self.program.insert_spindle_on(True, self.tool_state.speed)
+                self.__emit("insert_spindle_on", True, self.tool_state.speed)
             elif new == self.tool_state.SpindleGroup.spindle_ccw:
-                self.program.insert_spindle_on(False, self.tool_state.speed)
+                self.__emit("insert_spindle_on", False, self.tool_state.speed)
     #endregion spindle control
 
     #region coordinate system
@@ -89,117 +236,129 @@ class ProgramBuilder(object):
     #endregion coordinate system
 
     #region frame processing
-    def __process_begin(self, frame):
+    def __process_begin(self, args):
         old_state = self.tool_state.spindle
-        self.tool_state.process_begin(frame)
+        self.tool_state.process_begin(args)
         new_state = self.tool_state.spindle
 
-        speed = arguments.SpindleSpeed(frame)
+        speed = args.S
 
-        if speed.speed is not None:            
-            if speed.speed != self.tool_state.speed:
-                self.program.insert_set_speed(speed.speed)
-            self.tool_state.speed = speed.speed
+        if speed is not None:
+            if speed != self.tool_state.speed:
+                self.__emit("insert_set_speed", speed)
+            self.tool_state.speed = speed
 
         self.__start_stop_spindle(old_state, new_state)
 
-    def __process_move(self, frame):
-        self.table_state.process_frame(frame)
-        pos = arguments.Positioning(frame)
+    def __process_move(self, args):
+        self.table_state.process_frame(args)
+        pos = args
 
-        if pos is not None and self.table_state.modals.units is positioning.Configuration.UnitsGroup.inches:
-            pos.as_inches()
+        if self.table_state.modals.units is positioning.Configuration.UnitsGroup.inches:
+            pos = args.as_inches()
 
-        feed = arguments.Feed(frame)
-        stop = arguments.ExactStop(frame)
-        tool = arguments.Tool(frame)
-        
         no_motion = False
 
-        for cmd in frame.commands:
-            if cmd.type == "G":
-                if cmd.value == 74:
-                    self.program.insert_homing()
-                    self.table_state.pos.x = 0
-                    self.table_state.pos.y = 0
-                    self.table_state.pos.z = 0
-                    self.program.insert_reset_coordinates(x=self.table_state.pos.x,
-                                                          y=self.table_state.pos.y,
-                                                          z=self.table_state.pos.z)
-                elif cmd.value == 30:
-                    self.program.insert_z_probe()
-                    self.table_state.pos.z = 0
-                    self.program.insert_reset_coordinates(z=self.table_state.pos.z)
-                elif cmd.value == 92:
+        for type, value in args.codes:
+            if type == "G":
+                if value == 74:
+                    self.__emit("insert_homing")
+                    self.__emit("pos", x=0, y=0, z=0)
+                    self.__emit("insert_reset_coordinates", x=self.table_state.pos.x,
+                                                            y=self.table_state.pos.y,
+                                                            z=self.table_state.pos.z)
+                elif value == 30:
+                    self.__emit("insert_z_probe")
+                    self.__emit("pos", z=0)
+                    self.__emit("insert_reset_coordinates", z=self.table_state.pos.z)
+                elif value == 92:
                     # set offset registers
+                    self.__invalidate_recordings()
                     self.__set_coordinates(x=pos.X, y=pos.Y, z=pos.Z)
                     cs = self.table_state.modals.coord_system
                     csstr = str(cs)
                     offset = self.table_state.modals.offsets[cs]
                     offset = euclid3.Vector3(offset.x, offset.y, offset.z)
-                    self.program.insert_coordinate_system_change(csstr, offset)
+                    self.__emit("insert_coordinate_system_change", csstr, offset)
                     no_motion = True
-                elif cmd.value >= 53 and cmd.value <= 59:
+                elif value >= 53 and value <= 59:
                     cs = self.table_state.modals.coord_system
                     csstr = str(cs)
                     offset = self.table_state.modals.offsets[cs]
                     offset = euclid3.Vector3(offset.x, offset.y, offset.z)
-                    self.program.insert_coordinate_system_change(csstr, offset)
-            elif cmd.type == "M":
-                if cmd.value == 6 and tool.tool != None:
-                    self.program.insert_select_tool(tool.tool, self.tool_select_cb)
-                    self.table_state.select_tool(tool.tool)
+                    self.__emit("insert_coordinate_system_change", csstr, offset)
+            else:
+                if value == 6 and args.T != None:
+                    self.__emit("insert_select_tool", args.T, self.tool_select_cb)
+                    self.__emit("select_tool", args.T)
 
-        if feed.feed != None:
-            self.__set_feed(feed.feed)
+        if args.F != None:
+            self.__set_feed(args.F)
 
         if pos.is_moving and not no_motion:
-            self.table_state.pos = self.program.insert_move(pos, self.table_state)
+            self.__emit_move(pos)
             #print("Pos = ", self.table_state.pos)
 
-        if stop.exact_stop is True:
-            self.program.insert_stop()
+        if args.exact_stop is True or \
+           (pos.is_moving and self.table_state.modals.path == positioning.Configuration.PathControlGroup.exact_stop):
+            self.__emit("insert_stop")
 
-    def __process_end(self, id, frame):
+    def __process_end(self, id, args):
 
         old_state = self.tool_state.spindle
-        self.tool_state.process_end(frame)
+        self.tool_state.process_end(args)
         new_state = self.tool_state.spindle
 
         self.__start_stop_spindle(old_state, new_state)
         
-        for cmd in frame.commands:
-            if cmd.type != "M":
-                continue
-            if cmd.value == 0:
-                self.program.insert_pause(self.pause_cb)
-            elif cmd.value == 2 or cmd.value == 30:
-                self.program.insert_program_end(self.finish_cb)
+        for value in args.M:
+            if value == 0:
+                self.__emit("insert_pause", self.pause_cb)
+            elif value == 2 or value == 30:
+                self.__emit("insert_program_end", self.finish_cb)
                 return -1
-            elif cmd.value == 97:
-                return self.__use_subprogram(id, frame)
-            elif cmd.value == 99:
+            elif value == 97:
+                return self.__use_subprogram(id, args)
+            elif value == 99:
                 return self.__return_from_subprogramm()
         return None
 
     def __process(self, id, frame):
-        self.program.line = id
+        self.__emit("line", id)
 
-        self.line_number = arguments.LineNumber(frame)
+        args = frame.decode()
+        self.line_number = args.N
+        if 120 in args.M or 121 in args.M:
+            self.__invalidate_recordings()
 
-        self.__process_begin(frame)
-        self.__process_move(frame)
-        next = self.__process_end(id, frame)
+        self.__process_begin(args)
+        self.__process_move(args)
+        next = self.__process_end(id, args)
 
-        self.program.inc_index()
+        self.__emit("inc")
+        self.__finish_recordings()
         return next
 
     def __save_label(self, id, frame):
-        pid = arguments.LineNumber(frame)
-        if pid.N != None:
-            self.__subprograms[pid.N] = id
-
-    def build_program(self, frames):
+        N = frame.decode().N
+        if N != None:
+            self.__subprograms[N] = id
+
+    def __pop_actions(self):
+        actions = self.program.actions
+        self.program.actions = []
+        return actions
+
+    # generate actions of program frame by frame, offset movements by
+    # radius of tool, merge colinear movements and blend corners,
+    # see compensation.compensate, merger.Merger and blender.blend
+    def generate_program(self, frames):
+        actions = compensation.compensate(self.__generate_program(frames))
+        if self.merger is not None:
+            actions = self.merger.merge(actions)
+        return blender.blend(actions)
+
+    def __generate_program(self, frames):
         for id in range(len(frames)):
             self.__save_label(id, frames[id])
 
@@ -207,12 +366,20 @@ class ProgramBuilder(object):
         self.program.insert_unlock()
         while id < len(frames):
             next = self.__process(id, frames[id])
+            if self.__entering:
+                next = self.__enter(next)
+            yield from self.__pop_actions()
             if next is None:
                 id = id + 1
             elif next < 0:
                 break
             else:
                 id = next
+        yield from self.__pop_actions()
+
+    def build_program(self, frames):
+        actions = list(self.generate_program(frames))
+        self.program.actions = actions
         return self.program
 
     #endregion frame processing
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import common
+
+from . import parser
+from .program_builder import ProgramBuilder
+from ..sender import emulatorsender
+from ..sender import spindelemulator
+
+def make_builder(tools={}):
+    return ProgramBuilder(emulatorsender.EmulatorSender(),
+                          spindelemulator.Spindel_EMU(),
+                          {"tools" : tools})
+
+def build(text):
+    frames = parser.GFastLineParser().parse_file(text)
+    return make_builder().build_program(frames)
+
+def movements(program):
+    result = []
+    for (_, action, _, extra) in program.actions:
+        if not action.is_moving or extra is None:
+            result.append(type(action).__name__)
+            continue
+        points = tuple((name, round(extra[name].x, 6), round(extra[name].y, 6), round(extra[name].z, 6))
+                       for name in ["source", "target", "dir0", "dir1"])
+        result.append((action.command(), points))
+    return result
+
+relative = "G91\nG1 X5 F300\nG2 X10 Y0 I5 J0\nG1 Y-3\nG90\n"
+absolute = "G1 X5 Y5 F300\nG1 Z-1\nG0 Z1\n"
+
+def test_relative_subprogram():
+    called = "G0 X1 Y2\nM97 P10 L3\nG0 X20\nM97 P10\nM2\nN10\n" + relative + "M99\n"
+    inline = "G0 X1 Y2\n" + relative * 3 + "G0 X20\n" + relative + "M2\n"
+    assert movements(build(called)) == movements(build(inline))
+
+def test_absolute_subprogram():
+    called = "G0 X1 Y2\nM97 P10 L2\nG91 G0 X20 G90\nM97 P10\nM2\nN10\n" + absolute + "M99\n"
+    inline = "G0 X1 Y2\n" + absolute * 2 + "G91 G0 X20 G90\n" + absolute + "M2\n"
+    assert movements(build(called)) == movements(build(inline))
+
+def test_nested_subprogram():
+    called = "M97 P20 L2\nM2\nN10\n" + relative + "M99\nN20\nG0 X1\nM97 P10 L2\nM99\n"
+    inline = ("G0 X1\n" + relative * 2) * 2 + "M2\n"
+    assert movements(build(called)) == movements(build(inline))
+
+def test_modal_state():
+    # subprogram changes modals, so each call starts with other state
+    sub = "G1 X1 F100\nG91\nM3 S1000\n"
+    called = "G0 X0\nM97 P10 L3\nM2\nN10\n" + sub + "M99\n"
+    inline = "G0 X0\n" + sub * 3 + "M2\n"
+    assert movements(build(called)) == movements(build(inline))
+
+def test_indexes():
+    program = build("G0 X1\nM97 P10 L2\nM2\nN10\nG91 G1 X1 F100\nM99\n")
+    lines = [line for (_, action, line, _) in program.actions if action.is_moving]
+    assert lines == [0, 4, 4]
+    indexes = [index for (index, action, _, _) in program.actions if action.is_moving]
+    assert indexes == sorted(indexes) and len(set(indexes)) == 3
+
+def test_templates_reused(monkeypatch):
+    # body keeps modal state, so all calls start with the same state
+    text = "G1 X1 Y2 F300\nM97 P10 L5\nM97 P10\nM2\nN10\n" + relative + "M99\n"
+    frames = parser.GFastLineParser().parse_file(text)
+    builder = make_builder()
+    program = builder.build_program(frames)
+    # the first call is processed frame by frame, others are built from template
+    assert builder.replayed == 5
+    monkeypatch.setattr(common.config, "SUBPROGRAM_TEMPLATES", False)
+    builder = make_builder()
+    assert movements(builder.build_program(frames)) == movements(program)
+    assert builder.replayed == 0
+
+def test_template_of_tool():
+    # radius of compensation depends on tool, so template of other tool isn't used
+    text = "G1 X0 F100\nM6 T1\nM97 P10\nM6 T2\nM97 P10\nM6 T1\nM97 P10\nM2\nN10\nG91 G1 X1 F100\nG90\nM99\n"
+    builder = make_builder({1 : 1, 2 : 2})
+    builder.build_program(parser.GFastLineParser().parse_file(text))
+    assert builder.replayed == 1
@@ -0,0 +1,117 @@
+import numpy
+
+from . import compact_program
+from .actions import action
+from .actions import spindle
+from .actions import tools
+
+# Estimation of program time
+#
+# Each movement accelerates from feed0 to feed, moves with feed and
+# decelerates to feed1 (trapezoidal profile, see actions.action.Movement),
+# so time of all movements is found in closed form with array operations.
+# Other actions take no time, except spindle start, which waits for
+# spindle acceleration. Time of pauses is not known and is not counted.
+class Simulation(object):
+
+    def __init__(self, time, lines, tools):
+        # total time, seconds
+        self.time = time
+        # time of each line of program, {line : seconds}
+        self.lines = lines
+        # time of work with each tool, {tool : seconds}, None - tool is not selected
+        self.tools = tools
+        # amount of movements, merged into others, see merger.Merger
+        self.merged = 0
+
+# time of movements with trapezoidal profile, seconds
+#
+# lengths in mm, feeds in mm/min, accelerations in mm/sec^2.
+# It is common.feedprofile.duration for arrays, they give the same times
+def durations(lengths, feed0, feed, feed1, acc):
+    lengths = numpy.asarray(lengths, dtype=numpy.float64)
+    f0 = numpy.asarray(feed0, dtype=numpy.float64) / 60
+    f = numpy.asarray(feed, dtype=numpy.float64) / 60
+    f1 = numpy.asarray(feed1, dtype=numpy.float64) / 60
+    acc = numpy.asarray(acc, dtype=numpy.float64)
+
+    f = numpy.maximum.reduce([f, f0, f1, numpy.full_like(f, 1e-6)])
+    accelerated = acc > 0
+    a = numpy.where(accelerated, acc, 1)
+
+    x0 = (f**2 - f0**2) / (2*a)
+    x1 = (f**2 - f1**2) / (2*a)
+    # feed is not reached
+    short = accelerated & (x0 + x1 > lengths)
+    fm = numpy.sqrt((2*a*lengths + f0**2 + f1**2) / 2)
+    fm = numpy.maximum.reduce([fm, f0, f1])
+    f = numpy.maximum(numpy.where(short, fm, f), 1e-6)
+    x0 = numpy.where(short, numpy.clip((f**2 - f0**2) / (2*a), 0, lengths), x0)
+    x1 = numpy.where(short, lengths - x0, x1)
+
+    cruise = (lengths - x0 - x1) / f
+    ramps = (2*f - f0 - f1) / a
+    return numpy.where(accelerated, ramps + cruise, lengths / f)
+
+def _action_time(item):
+    if isinstance(item, spindle.SpindleOn):
+        return item.delay()
+    if isinstance(item, action.Movement):
+        return item.duration()
+    return 0
+
+# columns of program and its not movement actions: {position : action}
+def _columns(program):
+    if isinstance(program, compact_program.CompactProgram):
+        movements = numpy.frombuffer(program.kind, dtype=numpy.int8) != compact_program.KIND_ACTION
+        columns = [numpy.frombuffer(column, dtype=numpy.float64)
+                   for column in [program.length, program.feed0, program.feed, program.feed1, program.acc]]
+        lines = numpy.frombuffer(program.line, dtype=numpy.int64)
+        objects = {i : item[1] for i, item in program.objects.items()}
+        return movements, columns, lines, objects
+
+    actions = program.actions
+    n = len(actions)
+    movements = numpy.zeros(n, dtype=bool)
+    columns = [numpy.zeros(n) for _ in range(5)]
+    lines = numpy.zeros(n, dtype=numpy.int64)
+    objects = {}
+    for i, (_, item, line, extra) in enumerate(actions):
+        if line is not None:
+            lines[i] = line
+        if not item.is_moving or extra is None:
+            objects[i] = item
+            continue
+        movements[i] = True
+        values = (item.length(), item.feed0, item.feed, item.feed1, item.acceleration)
+        for column, value in zip(columns, values):
+            column[i] = value
+    return movements, columns, lines, objects
+
+def simulate(program):
+    movements, columns, lines, objects = _columns(program)
+    times = numpy.zeros(len(movements))
+    times[movements] = durations(*[column[movements] for column in columns])
+
+    # tool, selected for each item of program
+    changes = []
+    for i in sorted(objects.keys()):
+        item = objects[i]
+        times[i] = _action_time(item)
+        if isinstance(item, tools.WaitTool):
+            changes.append((i, item.tool))
+    tool_ids = numpy.searchsorted(numpy.array([i for i, _ in changes], dtype=numpy.int64),
+                                  numpy.arange(len(times)), side="right")
+    tool_times = numpy.bincount(tool_ids, weights=times, minlength=len(changes) + 1)
+    tool_numbers = [None] + [tool for _, tool in changes]
+    per_tool = {}
+    for tool, t in zip(tool_numbers, tool_times):
+        per_tool[tool] = per_tool.get(tool, 0) + float(t)
+
+    per_line = {}
+    if len(times) > 0:
+        line_times = numpy.bincount(lines, weights=times)
+        used = numpy.nonzero(line_times)[0]
+        per_line = dict(zip(used.tolist(), line_times[used].tolist()))
+
+    return Simulation(float(times.sum()), per_line, per_tool)
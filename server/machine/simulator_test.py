@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import random
+import euclid3
+import numpy
+
+from common import feedprofile
+
+from . import optimizer
+from . import simulator
+from . import compact_program
+from .actions import linear
+from .program_builder_test import build
+from ..sender import emulatorsender
+from ..sender import spindelemulator
+
+text = """G0 X10 Y10
+M6 T1
+M3 S12000
+G1 X20 F600
+G2 X30 Y0 I5 J-5
+G1 Y-10
+M6 T2
+G1 X0 Y0 F1200
+M5
+M2
+"""
+
+def test_durations():
+    random.seed(3)
+    movements = []
+    for _ in range(500):
+        mv = linear.LinearMovement(euclid3.Vector3(random.uniform(0.01, 20), 0, 0),
+                                   random.uniform(10, 1200), random.choice([0, 20, 40]), sender=None)
+        mv.feed0 = random.uniform(0, mv.feed)
+        mv.feed1 = random.uniform(0, mv.feed)
+        movements.append(mv)
+    times = simulator.durations([mv.length() for mv in movements],
+                                [mv.feed0 for mv in movements],
+                                [mv.feed for mv in movements],
+                                [mv.feed1 for mv in movements],
+                                [mv.acceleration for mv in movements])
+    for mv, t in zip(movements, times):
+        assert abs(mv.duration() - t) < 1e-9 * max(t, 1)
+        # profiles from optimizer can be passed
+        if abs((mv.feed0 / 60)**2 - (mv.feed1 / 60)**2) <= 2 * mv.acceleration * mv.length():
+            assert abs(mv.distance(t) - mv.length()) < 1e-6
+
+def test_scalar_profile():
+    # emulator of MCU uses scalar profile, its times are the same
+    random.seed(5)
+    values = [(random.uniform(0, 20), random.uniform(0, 1500), random.uniform(10, 1200),
+               random.uniform(0, 1500), random.choice([0, 20, 40])) for _ in range(500)]
+    values += [(0, 0, 600, 0, 40), (5, 0, 0, 0, 40), (5, 900, 600, 300, 0)]
+    times = simulator.durations(*zip(*values))
+    for args, t in zip(values, times):
+        assert abs(feedprofile.duration(*args) - t) < 1e-9 * max(t, 1)
+
+def optimized(compact):
+    program = build(text)
+    opt = optimizer.Optimizer(20, 40, 800)
+    if not compact:
+        opt.optimize(program)
+        return program
+    cp = compact_program.CompactProgram(program, 16)
+    cp.extend(program.actions)
+    opt.optimize_compact(cp)
+    return cp
+
+def test_program():
+    result = simulator.simulate(optimized(False))
+    expected = sum(action.duration() for (_, action, _, extra) in optimized(False).actions
+                   if action.is_moving and extra is not None)
+    # spindle start at 12000 rpm
+    expected += 5.0 * 12000 / 24000
+    assert abs(result.time - expected) < 1e-9
+    assert abs(sum(result.lines.values()) - result.time) < 1e-9
+    assert abs(sum(result.tools.values()) - result.time) < 1e-9
+    assert set(result.tools.keys()) == {None, 1, 2}
+    # G1 Y-10 with 10 mm/s takes more than 1 second
+    assert result.lines[5] > 1
+    assert 1 not in result.lines
+
+def test_compact():
+    a = simulator.simulate(optimized(False))
+    b = simulator.simulate(optimized(True))
+    assert abs(a.time - b.time) < 1e-9
+    assert a.lines.keys() == b.lines.keys()
+    for line in a.lines:
+        assert abs(a.lines[line] - b.lines[line]) < 1e-9
+    for tool in a.tools:
+        assert abs(a.tools[tool] - b.tools[tool]) < 1e-9
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+# Benchmark of sending movements to table
+#
+# Program of short movements is executed on emulated MCU, which executes
+# movements faster than real time, with waiting answer for each movement
+# and in pipeline mode, with text and binary commands. Run from repository root:
+#
+#   python3 -m server.machine.streaming_bench [movements] [latency] [crc errors]
+
+import sys
+import time
+
+import common
+
+from . import machine
+from . import parser
+from . import simulator
+from ..sender import mcuemulator
+from ..sender import spindelemulator
+
+# speed of emulated MCU
+SPEED = 1000
+
+def make_frames(amount):
+    gp = parser.GLineParser()
+    lines = ["G1 F600"]
+    for i in range(amount):
+        lines.append("X%i Y%i" % (i % 100 + 1, (i % 2) * 2))
+    lines.append("M2")
+    return [gp.parse(line) for line in lines]
+
+def measure(name, frames, pipeline, latency, crc_errors, binary=False):
+    common.config.BINARY_COMMANDS = binary
+    sender = mcuemulator.MCUEmulator(latency=latency, speed=SPEED, crc_errors=crc_errors, seed=1)
+    m = machine.Machine(sender, spindelemulator.Spindel_EMU())
+    m.pipeline = pipeline
+    m.Load(frames)
+    t = time.time()
+    m.WorkStart()
+    t = time.time() - t
+    sender.close()
+    estimated = simulator.simulate(m.user_program).time / SPEED
+    print("%-10s %8.2f s, estimated %8.2f s, %6i commands, %8i bytes, %4i rejected" % \
+          (name, t, estimated, sender.id, sender.bytes, sender.rejected))
+
+def main(amount, latency, crc_errors):
+    frames = make_frames(amount)
+    print("Movements: %i, latency: %.4f s, CRC errors: %.3f" % (amount, latency, crc_errors))
+    measure("wait", frames, False, latency, crc_errors)
+    measure("pipeline", frames, True, latency, crc_errors)
+    measure("binary", frames, True, latency, crc_errors, binary=True)
+
+if __name__ == "__main__":
+    amount = 1000
+    latency = 0.001
+    crc_errors = 0
+    if len(sys.argv) > 1:
+        amount = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        latency = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        crc_errors = float(sys.argv[3])
+    main(amount, latency, crc_errors)
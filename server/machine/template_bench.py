@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Benchmark of subprogram templates
+#
+# Subprogram of relative movements is called many times, program is built
+# with and without templates (see ProgramBuilder, SUBPROGRAM_TEMPLATES).
+# Run from repository root:
+#
+#   python3 -m server.machine.template_bench [calls] [movements of subprogram]
+
+import sys
+import time
+
+import common
+
+from . import parser
+from .program_builder import ProgramBuilder
+from ..sender import emulatorsender
+from ..sender import spindelemulator
+
+def make_text(calls, size):
+    body = "".join("G1 X0.5 Y%.1f\n" % (0.3 if i % 2 == 0 else -0.3) for i in range(size))
+    return "G1 X0 Y0 F600\nG91\nM97 P10 L%i\nG90\nM2\nN10\n%sM99\n" % (calls, body)
+
+def measure(name, frames, templates):
+    common.config.SUBPROGRAM_TEMPLATES = templates
+    builder = ProgramBuilder(emulatorsender.EmulatorSender(),
+                             spindelemulator.Spindel_EMU(),
+                             {"tools" : {}})
+    t = time.time()
+    program = builder.build_program(frames)
+    t = time.time() - t
+    print("%-20s %8.2f s %10i actions %6i calls from template" % (name, t, len(program.actions), builder.replayed))
+    return t
+
+def main(calls, size):
+    frames = parser.GFastLineParser().parse_file(make_text(calls, size))
+    print("Calls: %i, movements of subprogram: %i" % (calls, size))
+    t0 = measure("Frame by frame", frames, False)
+    t1 = measure("Templates", frames, True)
+    print("Speedup: %.2f" % (t0 / t1))
+
+if __name__ == "__main__":
+    calls = 400
+    size = 50
+    if len(sys.argv) > 1:
+        calls = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        size = int(sys.argv[2])
+    main(calls, size)
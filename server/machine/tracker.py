@@ -0,0 +1,99 @@
+import time
+import collections
+import euclid3
+
+# Hardware coordinates of table, found from answers of MCU
+#
+# Coordinates are known, when MCU answers with X:, Y:, Z: (M114, or
+# completed movement, if MCU reports position in answer). When movement
+# is completed without coordinates, position is end of the movement.
+# Between answers position is interpolated along planned feed profile
+# of the current movement, so no commands are sent to MCU for it.
+#
+# Movements are registered in order of sending: sending(action) before
+# command is sent, indexed(nid) when sender gives index to the command.
+class CoordinateTracker(object):
+
+    def __init__(self):
+        # MCU starts with zero coordinates
+        self.position = euclid3.Vector3()
+        self.__sending = None
+        self.__sent = collections.OrderedDict()
+        # current movement: (action, source position, start time)
+        self.__current = None
+
+    @staticmethod
+    def __hw(action, offset):
+        x, y, z = action._convert_axes(offset)
+        return euclid3.Vector3(x, y, z)
+
+    def sending(self, action):
+        if action is not None and not action.is_moving:
+            action = None
+        self.__sending = action
+
+    def indexed(self, nid):
+        if self.__sending is not None:
+            self.__sent[nid] = self.__sending
+            self.__sending = None
+
+    def started(self, nid, t=None):
+        action = self.__sent.get(int(nid))
+        if action is None:
+            return
+        if t is None:
+            t = time.time()
+        self.__current = (action, self.position, t)
+
+    def completed(self, nid, response):
+        nid = int(nid)
+        action = self.__sent.pop(nid, None)
+        # commands are completed in order, older ones are lost or rejected
+        while len(self.__sent) > 0:
+            first = next(iter(self.__sent))
+            if first > nid:
+                break
+            del self.__sent[first]
+
+        if self.__current is not None and self.__current[0] is action:
+            source = self.__current[1]
+        else:
+            source = self.position
+        self.__current = None
+
+        if "X" in response and "Y" in response and "Z" in response:
+            self.reported(response)
+        elif action is not None:
+            self.position = source + self.__hw(action, action.point(action.length()))
+
+    def reported(self, hw):
+        self.position = euclid3.Vector3(hw["X"], hw["Y"], hw["Z"])
+
+    # all sent commands are dropped, MCU starts with zero coordinates
+    def reset(self):
+        self.__sending = None
+        self.__sent.clear()
+        self.__current = None
+        self.position = euclid3.Vector3()
+
+    @staticmethod
+    def __distance(current, t):
+        if t is None:
+            t = time.time()
+        action, _, start = current
+        return action.distance(t - start)
+
+    # current movement and distance, passed on it, or None
+    def progress(self, t=None):
+        # answers come from other thread, current movement can be finished
+        current = self.__current
+        if current is None:
+            return None
+        return current[0], self.__distance(current, t)
+
+    def coordinates(self, t=None):
+        current = self.__current
+        if current is None:
+            return self.position.copy()
+        action, source, _ = current
+        return source + self.__hw(action, action.point(self.__distance(current, t)))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import euclid3
+
+from . import tracker
+from . import machine
+from .actions import linear
+from .machine_test import make_frames
+from ..sender import emulatorsender
+from ..sender import spindelemulator
+
+def movement(x, y, feed=600, acc=40):
+    action = linear.LinearMovement(euclid3.Vector3(x, y, 0), feed, acc, sender=None)
+    action.feed = feed
+    return action
+
+def hw(action, offset):
+    return euclid3.Vector3(*action._convert_axes(offset))
+
+def test_profile():
+    # 10 mm/s, 0.25 s of acceleration and deceleration, 1.25 mm each
+    action = movement(10, 0)
+    assert abs(action.duration() - 1.25) < 1e-9
+    assert abs(action.distance(0.25) - 1.25) < 1e-9
+    assert abs(action.distance(0.5) - 3.75) < 1e-9
+    assert abs(action.distance(1.25) - 10) < 1e-9
+    assert action.distance(5) == 10
+    # feed is not reached
+    action = movement(1, 0)
+    assert abs(action.distance(action.duration()) - 1) < 1e-9
+    assert abs(action.distance(action.duration() / 2) - 0.5) < 1e-9
+    # monotonic
+    values = [action.distance(i * action.duration() / 50) for i in range(51)]
+    assert values == sorted(values)
+
+def test_interpolation():
+    t = tracker.CoordinateTracker()
+    first = movement(10, 0)
+    second = movement(0, 5)
+    for nid, action in [(1, first), (2, second)]:
+        t.sending(action)
+        t.indexed(nid)
+    t.started(1, 100.0)
+    middle = t.coordinates(100.0 + first.duration() / 2)
+    assert (middle - hw(first, euclid3.Vector3(5, 0, 0))).magnitude() < 1e-9
+    t.completed(1, {"N" : 1, "Q" : 8})
+    assert t.coordinates() == hw(first, first.delta)
+    t.started(2, 200.0)
+    t.completed(2, {"N" : 2, "Q" : 8, "X" : 1.0, "Y" : 2.0, "Z" : 3.0})
+    assert t.coordinates() == euclid3.Vector3(1, 2, 3)
+    t.reset()
+    assert t.coordinates() == euclid3.Vector3()
+
+def test_completed_while_reading():
+    t = tracker.CoordinateTracker()
+    action = movement(10, 0)
+    t.sending(action)
+    t.indexed(1)
+    t.started(1, 100.0)
+    distance = action.distance
+    # answer comes from other thread in the middle of reading
+    def completing(dt):
+        t.completed(1, {"N" : 1, "Q" : 8})
+        return distance(dt)
+    action.distance = completing
+    middle = t.coordinates(100.0 + action.duration() / 2)
+    assert (middle - hw(action, euclid3.Vector3(5, 0, 0))).magnitude() < 1e-9
+
+def test_program_position():
+    sender = emulatorsender.EmulatorSender()
+    m = machine.Machine(sender, spindelemulator.Spindel_EMU())
+    m.Load(make_frames(10))
+    m.WorkStart()
+    # last movement of make_frames is to X10 Y5
+    assert m.tracker.coordinates() == hw(movement(0, 0), euclid3.Vector3(10, 5, 0))
+
+def test_idle_requests():
+    sender = emulatorsender.EmulatorSender()
+    m = machine.Machine(sender, spindelemulator.Spindel_EMU())
+    commands = []
+    sender.indexed += commands.append
+    reported = []
+    m.on_coordinates += lambda hw, glob, loc, cs: reported.append(hw)
+    m.ReportCoordinates()
+    m.ReportCoordinates()
+    # rate limited
+    assert len(commands) == 1
+    m.crd_requested = 0
+    m.is_running = True
+    m.ReportCoordinates()
+    # no requests while running
+    assert len(commands) == 1
+    m.is_running = False
+    m.ReportCoordinates()
+    assert len(commands) == 2
+    # coordinates are reported only when changed
+    assert len(reported) == 1
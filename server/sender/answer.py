@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 
+import re
+import types
+
 def get_number(line):
     last = len(line) - 1
     has_dot = False
@@ -98,6 +101,84 @@ def parse_answer(data):
 
     return {"result" : "error", "error" : "unknown answer", "value" : ans}
 
+#region parser of bytes
+
+_no_params = types.MappingProxyType({})
+
+# Answer of MCU
+#
+# event is "queue", "start", "complete", "drop", "init", "error", "debug"
+# or None for unknown answer. action and slots are N and Q, response has
+# other parameters (X, Y, Z, ...), msg is text of error and debug answers
+class Answer(object):
+    __slots__ = ("event", "action", "slots", "response", "msg")
+
+    def __init__(self, event, action=None, slots=None, response=_no_params, msg=None):
+        self.event = event
+        self.action = action
+        self.slots = slots
+        self.response = response
+        self.msg = msg
+
+_word = re.compile(rb"[\s\x00]*([A-Za-z]+)")
+# usual form of answers about commands
+_state = re.compile(rb"[\s\x00]*([a-z]+) N:([0-9]+) Q:([0-9]+)")
+_param = re.compile(rb"([A-Z]):([-+]?[0-9]*\.?[0-9]+)")
+_names = {bytes([c]) : chr(c) for c in range(ord("A"), ord("Z") + 1)}
+
+_events = {
+    b"queued" : "queue",
+    b"started" : "start",
+    b"completed" : "complete",
+    b"dropped" : "drop",
+}
+
+_messages = {
+    b"error" : "error",
+    b"debug" : "debug",
+}
+
+def _number(value):
+    if b"." in value:
+        return float(value)
+    return int(value)
+
+def _params(data, pos):
+    return {_names[letter] : _number(value) for letter, value in _param.findall(data, pos)}
+
+# parse answer, given as bytes, the same as parse_answer, but faster
+def parse(data):
+    match = _state.match(data)
+    if match is not None:
+        word, action, slots = match.groups()
+        event = _events.get(word)
+        if event is not None:
+            answer = Answer(event, int(action), int(slots))
+            if data.find(b":", match.end()) >= 0:
+                answer.response = _params(data, match.end())
+            return answer
+
+    match = _word.match(data)
+    if match is None:
+        return Answer(None, msg=data)
+    word = match.group(1)
+    event = _events.get(word)
+    if event is not None:
+        response = _params(data, match.end())
+        answer = Answer(event, response.pop("N", None), response.pop("Q", None))
+        if len(response) > 0:
+            answer.response = response
+        return answer
+    if word == b"Hello":
+        return Answer("init")
+    event = _messages.get(word)
+    if event is not None:
+        msg = data[match.end():].decode("ascii", "replace").rstrip("\x00\r\n\t ")
+        return Answer(event, msg=msg)
+    return Answer(None, msg=data)
+
+#endregion
+
 if __name__ == "__main__":
     resp = "N:8 Q:8 X:0.00 Y:0.00 Z:0.00"
     print(get_params(resp))
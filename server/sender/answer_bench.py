@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Benchmark of parsing answers of MCU
+#
+# Answers of emulated MCU for program of short movements with M114 after
+# each 10 movements are recorded and parsed with answer.parse_answer (after
+# decoding, as receivers did) and with answer.parse. Run from repository root:
+#
+#   python3 -m server.sender.answer_bench [movements] [repeats]
+
+import sys
+import time
+import threading
+
+from . import answer
+from . import mcuemulator
+
+def record(amount):
+    answers = []
+    sender = mcuemulator.MCUEmulator(depth=amount + 1, speed=1e6, record=answers)
+    done = threading.Event()
+    sender.completed += lambda nid, response: done.set() if nid == amount else None
+    for i in range(amount):
+        if i % 10 == 9:
+            sender.send_command("M114")
+        else:
+            sender.send_command("G1 F600P0L0T40 X0.10 Y%.2f Z0.00" % (i % 2))
+    done.wait()
+    sender.close()
+    return answers
+
+def parse_text(answers):
+    for data in answers:
+        answer.parse_answer(data.decode("ascii").strip())
+
+def parse_bytes(answers):
+    for data in answers:
+        answer.parse(data)
+
+def measure(name, parser, answers, repeats):
+    t = time.perf_counter()
+    for _ in range(repeats):
+        parser(answers)
+    t = time.perf_counter() - t
+    us = t / (repeats * len(answers)) * 1e6
+    print("%-12s %8.3f s, %6.2f us per answer" % (name, t, us))
+    return us
+
+def main(amount, repeats):
+    answers = record(amount)
+    print("Answers: %i, repeats: %i" % (len(answers), repeats))
+    old = measure("parse_answer", parse_text, answers, repeats)
+    new = measure("parse", parse_bytes, answers, repeats)
+    print("Speedup: %.2f" % (old / new))
+
+if __name__ == "__main__":
+    amount = 1000
+    repeats = 20
+    if len(sys.argv) > 1:
+        amount = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        repeats = int(sys.argv[2])
+    main(amount, repeats)
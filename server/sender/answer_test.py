@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import threading
+
+from . import answer
+from . import mcuemulator
+
+answers = [b"queued N:12 Q:15\n",
+           b"started N:12 Q:16\r\n",
+           b"completed N:12 Q:16 X:1.250 Y:-3.000 Z:0.500 P:0\n",
+           b"dropped N:13 Q:16\n",
+           b"completed N:1 Q:16 B:1\n",
+           b"Hello\n",
+           b"error: CRC error\n",
+           b"debug: step\n",
+           b"garbage\x00\x00"]
+
+# new parser gives the same, as parse_answer
+def check(data):
+    old = answer.parse_answer(data.decode("ascii").replace("\x00", ""))
+    new = answer.parse(data)
+    if old["result"] != "ok":
+        assert new.event is None
+        return
+    assert new.event == old["event"]
+    if "action" in old:
+        assert (new.action, new.slots) == (old["action"], old["slots"])
+        params = {name : value for name, value in old["response"].items() if name not in ("N", "Q")}
+        assert dict(new.response) == params
+    if "msg" in old:
+        assert new.msg == old["msg"]
+
+def test_answers():
+    for data in answers:
+        check(data)
+
+def test_recorded_stream():
+    record = []
+    sender = mcuemulator.MCUEmulator(depth=32, speed=1000, record=record)
+    done = threading.Event()
+    sender.completed += lambda nid, response: done.set() if nid == 30 else None
+    for i in range(30):
+        sender.send_command("M114" if i % 5 == 4 else "G1 F600P0L0T40 X0.10 Y0.00 Z0.00")
+    assert done.wait(2)
+    sender.close()
+    assert len(record) == 90
+    for data in record:
+        check(data)
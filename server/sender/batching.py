@@ -0,0 +1,89 @@
+import time
+import threading
+
+# Packing of several commands into one Ethernet frame
+#
+# Payload of frame is list of entries, each entry is length of data
+# (uint16, big endian) and data. Frame with one entry is the same, as
+# frame of one command. Commands, added in `window` seconds after the
+# first one, are sent in one frame, while it fits into `size` bytes.
+# With window = 0 each command is sent at once in its own frame.
+class Batcher(object):
+
+    # send - function, which sends payload of frame
+    def __init__(self, send, window=0, size=1500):
+        self.send = send
+        self.window = window
+        self.size = size
+        # statistics
+        self.frames = 0
+        self.entries = 0
+
+        self.__pending = bytearray()
+        self.__deadline = None
+        self.__cond = threading.Condition()
+        self.__finished = False
+        if self.window > 0:
+            self.__thread = threading.Thread(target=self.__run, daemon=True)
+            self.__thread.start()
+
+    @staticmethod
+    def entry(data):
+        return bytes([len(data) // 256, len(data) % 256]) + data
+
+    def __flush(self):
+        if len(self.__pending) == 0:
+            return
+        payload = bytes(self.__pending)
+        self.__pending = bytearray()
+        self.__deadline = None
+        self.frames += 1
+        self.send(payload)
+
+    def __run(self):
+        with self.__cond:
+            while not self.__finished:
+                if self.__deadline is None:
+                    self.__cond.wait()
+                    continue
+                delay = self.__deadline - time.time()
+                if delay > 0:
+                    self.__cond.wait(delay)
+                    continue
+                self.__flush()
+
+    def add(self, data):
+        entry = self.entry(data)
+        with self.__cond:
+            if len(self.__pending) + len(entry) > self.size:
+                self.__flush()
+            self.__pending += entry
+            self.entries += 1
+            if self.window <= 0:
+                self.__flush()
+            elif self.__deadline is None:
+                self.__deadline = time.time() + self.window
+                self.__cond.notify()
+
+    # send pending commands at once
+    def flush(self):
+        with self.__cond:
+            self.__flush()
+
+    def close(self):
+        with self.__cond:
+            self.__flush()
+            self.__finished = True
+            self.__cond.notify()
+
+# split payload of frame to entries,
+# zero length ends entries (padding of short frame)
+def split(payload):
+    entries = []
+    while len(payload) >= 2:
+        length = payload[0] * 256 + payload[1]
+        if length == 0:
+            break
+        entries.append(payload[2:2 + length])
+        payload = payload[2 + length:]
+    return entries
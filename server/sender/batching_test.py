@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import time
+
+from . import batching
+from . import ethernetsender
+
+class Wire(object):
+
+    def __init__(self):
+        self.frames = []
+
+    def send(self, payload):
+        self.frames.append(payload)
+
+    def entries(self):
+        return [entry for frame in self.frames for entry in batching.split(frame)]
+
+commands = [("N%i G1 F600P0L0T40 X0.10 Y0.00 Z0.00*A%i\n" % (i, i)).encode("ascii") for i in range(100)]
+
+def test_without_window():
+    wire = Wire()
+    batcher = batching.Batcher(wire.send)
+    for command in commands[:3]:
+        batcher.add(command)
+    # frame of one command
+    assert wire.frames == [batching.Batcher.entry(command) for command in commands[:3]]
+
+def test_window():
+    wire = Wire()
+    batcher = batching.Batcher(wire.send, window=0.05)
+    for command in commands:
+        batcher.add(command)
+    assert len(wire.frames) < 10
+    time.sleep(0.1)
+    batcher.close()
+    assert wire.entries() == commands
+    assert batcher.frames == len(wire.frames)
+    assert batcher.entries == len(commands)
+    for frame in wire.frames:
+        assert len(frame) <= 1500
+
+def test_size():
+    wire = Wire()
+    batcher = batching.Batcher(wire.send, window=10, size=100)
+    for command in commands[:10]:
+        batcher.add(command)
+    batcher.close()
+    assert wire.entries() == commands[:10]
+    assert len(wire.frames) == 5
+    for frame in wire.frames:
+        assert len(frame) <= 100
+
+def test_padding():
+    payload = batching.Batcher.entry(b"queued N:1 Q:15") + batching.Batcher.entry(b"started N:1 Q:16")
+    assert batching.split(payload + bytes(20)) == [b"queued N:1 Q:15", b"started N:1 Q:16"]
+
+def test_flush():
+    wire = Wire()
+    batcher = batching.Batcher(wire.send, window=10)
+    for command in commands[:3]:
+        batcher.add(command)
+    assert wire.frames == []
+    # sender has no more ready commands, they are not delayed by window
+    batcher.flush()
+    assert wire.entries() == commands[:3]
+    batcher.close()
+    assert len(wire.frames) == 1
+
+class Socket(object):
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def recv(self, size):
+        return bytes(6) + bytes(6) + bytes([0xFE, 0xFE]) + self.payload
+
+def receive(payload, batched):
+    queued = []
+    receiver = ethernetsender.EthernetSender.EthernetReceiver(Socket(payload), {}, None,
+                                                              None, None, lambda nid, q: None, None,
+                                                              queued.append, None, None, None)
+    receiver.batched = batched
+    assert receiver.receive()
+    return queued
+
+def test_receive():
+    msgs = [b"queued N:1 Q:15", b"queued N:2 Q:14"]
+    assert receive(b"".join(batching.Batcher.entry(msg) for msg in msgs), True) == [1, 2]
+    # without batching length of answer is not used
+    assert receive(bytes([0xAA, 0x55]) + msgs[0] + bytes(20), False) == [1]
@@ -0,0 +1,49 @@
+# Table of handlers for sent commands
+#
+# Handler is registered, when command is sent, and is removed, when
+# command is completed, dropped or rejected, so answer is given only to
+# the action it belongs to.
+#
+# Handler should have methods:
+#   received_queued(nid)
+#   received_started(nid)
+#   received_dropped(nid)
+#   received_completed(nid, response)
+#   received_error(nid, msg)
+class Dispatcher(object):
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, nid, handler):
+        self.handlers[nid] = handler
+
+    def queued(self, nid):
+        handler = self.handlers.get(int(nid))
+        if handler is not None:
+            handler.received_queued(int(nid))
+
+    def started(self, nid):
+        handler = self.handlers.get(int(nid))
+        if handler is not None:
+            handler.received_started(int(nid))
+
+    def dropped(self, nid):
+        handler = self.handlers.pop(int(nid), None)
+        if handler is not None:
+            handler.received_dropped(int(nid))
+
+    def completed(self, nid, response):
+        handler = self.handlers.pop(int(nid), None)
+        if handler is not None:
+            handler.received_completed(int(nid), response)
+
+    def error(self, nid, msg):
+        if nid is None:
+            return
+        handler = self.handlers.pop(int(nid), None)
+        if handler is not None:
+            handler.received_error(int(nid), msg)
+
+    def clear(self):
+        self.handlers = {}
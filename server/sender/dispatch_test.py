@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+from . import dispatch
+from . import emulatorsender
+
+class Handler(object):
+    def __init__(self):
+        self.events = []
+    def received_queued(self, nid):
+        self.events.append(("queued", nid))
+    def received_started(self, nid):
+        self.events.append(("started", nid))
+    def received_dropped(self, nid):
+        self.events.append(("dropped", nid))
+    def received_completed(self, nid, response):
+        self.events.append(("completed", nid))
+    def received_error(self, nid, msg):
+        self.events.append(("error", nid))
+
+def test_dispatch():
+    dispatcher = dispatch.Dispatcher()
+    h1 = Handler()
+    h2 = Handler()
+    dispatcher.register(1, h1)
+    dispatcher.register(2, h2)
+    dispatcher.queued(1)
+    dispatcher.queued("2")
+    dispatcher.started(1)
+    dispatcher.completed(1, {})
+    dispatcher.completed(1, {})
+    dispatcher.error(2, "CRC error")
+    dispatcher.error(None, "CRC error")
+    assert h1.events == [("queued", 1), ("started", 1), ("completed", 1)]
+    assert h2.events == [("queued", 2), ("error", 2)]
+    assert len(dispatcher.handlers) == 0
+
+def test_emulator_dispatch():
+    sender = emulatorsender.EmulatorSender()
+    handlers = [Handler() for _ in range(5)]
+    for h in handlers:
+        sender.send_command("M114", handler=h)
+    for i in range(5):
+        nid = i + 1
+        assert handlers[i].events == [("queued", nid), ("started", nid), ("completed", nid)]
@@ -1,33 +1,127 @@
 import threading
+import time
+import collections
 from common import event
+from common import binary
+from common import trace
+from . import flowcontrol
+from . import dispatch
+from . import stats
 
 class EmulatorSender(object):
-    
-    indexed = event.EventEmitter()
-    queued = event.EventEmitter()
-    completed = event.EventEmitter()
-    started = event.EventEmitter()
-    dropped = event.EventEmitter()
-    mcu_reseted = event.EventEmitter()
-    error = event.EventEmitter()
-    protocol_error = event.EventEmitter()
-
-    has_slots = threading.Event()
-
-    def __init__(self):
+
+    # latency - time between sending command and receiving answers, seconds
+    # slots   - size of emulated MCU queue
+    # supports_binary - emulated MCU accepts binary commands, see common.binary
+    def __init__(self, latency=0, slots=8, supports_binary=False):
+        self.indexed = event.EventEmitter()
+        self.queued = event.EventEmitter()
+        self.completed = event.EventEmitter()
+        self.started = event.EventEmitter()
+        self.dropped = event.EventEmitter()
+        self.mcu_reseted = event.EventEmitter()
+        self.error = event.EventEmitter()
+        self.protocol_error = event.EventEmitter()
+
+        self.has_slots = event.Event()
+
         self.id = 0
+        self.latency = latency
+        self.slots = slots
+        self.supports_binary = supports_binary
+        # send movements in binary encoding
+        self.binary = False
+        # MCU resyncs after CRC error, see flowcontrol.resyncs
+        self.resync = False
+        self.__flow = flowcontrol.FlowControl(self.has_slots)
+        self.__dispatcher = dispatch.Dispatcher()
+        self.stats = stats.Stats()
+        self.__answers = collections.deque()
+        self.__answer_cond = threading.Condition()
+        self.__finished = False
+        if self.latency > 0:
+            self.__thread = threading.Thread(target=self.__answer_thread, daemon=True)
+            self.__thread.start()
         self.has_slots.set()
-    
-    def send_command(self, command, wait=True):
+
+    def __answer_thread(self):
+        while True:
+            answer = self.__next_answer()
+            if answer is None:
+                break
+            self.__answer(*answer)
+
+    def __next_answer(self):
+        with self.__answer_cond:
+            while len(self.__answers) == 0 and not self.__finished:
+                self.__answer_cond.wait()
+            if self.__finished:
+                return None
+            t, answer = self.__answers.popleft()
+        delay = t - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return answer
+
+    def __answer(self, nid, response):
+        if "B" in response:
+            self.binary = binary.accepted(response)
+        if "R" in response:
+            self.resync = flowcontrol.resyncs(response)
+        self.stats.slots(self.slots)
+        self.__flow.answered(nid, self.slots)
+        self.__dispatcher.queued(nid)
+        self.queued(nid)
+        self.__dispatcher.started(nid)
+        self.started(nid)
+        self.__dispatcher.completed(nid, response)
+        self.completed(nid, response)
+
+    def free_slots(self):
+        return self.__flow.free_slots()
+
+    def send_command(self, command, wait=True, handler=None):
         self.id += 1
         self.indexed(self.id)
-        cmd = ("N%i " % self.id) + command + "\n"
-        print("Command %s" % cmd)
-        self.queued(self.id)
+        if handler is not None:
+            self.__dispatcher.register(self.id, handler)
+        self.__flow.sent(self.id)
+        if isinstance(command, bytes):
+            cmd = binary.frame(self.id, command)
+        else:
+            cmd = ("N%i " % self.id) + command + "\n"
+        trace.sender.debug("Command %s", cmd)
+        self.stats.sent(len(cmd))
         oid = self.id
-        self.started(self.id)
-        self.completed(self.id, {})
+        response = {}
+        if command == "M800":
+            # commands are not damaged, so MCU can always receive several of them
+            response = {"R" : 1}
+            if self.supports_binary:
+                response["B"] = binary.VERSION
+        if self.latency > 0:
+            with self.__answer_cond:
+                self.__answers.append((time.time() + self.latency, (oid, response)))
+                self.__answer_cond.notify()
+        else:
+            self.__answer(oid, response)
         return oid
 
+    # commands are sent at once, see ethernetsender.EthernetSender.flush
+    def flush(self):
+        pass
+
+    def close(self):
+        with self.__answer_cond:
+            self.__finished = True
+            self.__answer_cond.notify()
+
+    def clean(self):
+        self.__dispatcher.clear()
+
     def reset(self):
         self.id = 0
+        self.binary = False
+        self.resync = False
+        self.__flow.reset()
+        self.__dispatcher.clear()
@@ -4,9 +4,16 @@ import time
 import sys
 import socket
 from common import event
+from common import binary
+from common import config
+from common import trace
 import threading
 import re
 from . import answer
+from . import flowcontrol
+from . import dispatch
+from . import stats
+from . import batching
 import fcntl
 import struct
 
@@ -31,54 +38,60 @@ class EthernetSender(object):
             self.ev_protocolerror = ev_protocolerror
             self.ev_mcu_reseted = ev_mcu_reseted
             self.ev_error = ev_error
+            # frames contain several answers, see batching.split
+            self.batched = False
 
         def run(self):
             print("START RECEIVER")
             while not self.finish_event.is_set():
-                resp = None
-                try:
-                    resp = self.sock.recv(1500)
-                except Exception as e:
-                    print("Ethernet read error", e)
-                    self.ev_protocolerror(True, "Ethernet read error")
+                if not self.receive():
                     break
-                #dst = resp[0:6]
-                src = resp[6:12]
-                ethtype = resp[12]*256 +resp[13] 
+
+        # receive and process one frame, it can contain several answers,
+        # if batching is enabled. Returns False on error of socket
+        def receive(self):
+            resp = None
+            try:
+                resp = self.sock.recv(1500)
+            except Exception as e:
+                print("Ethernet read error", e)
+                self.ev_protocolerror(True, "Ethernet read error")
+                return False
+            #dst = resp[0:6]
+            src = resp[6:12]
+            ethtype = resp[12]*256 +resp[13] 
+            if ethtype != 0xFEFE:
+                return True
+            self.remote["mac"] = src
+            if not self.batched:
                 #length = resp[14]*256 + resp[15]
-                msg = resp[16:]
-                if ethtype != 0xFEFE:
-                    continue
-                self.remote["mac"] = src
-                try:
-                    ans = msg.decode("ascii").replace("\x00", "")
-                except:
-                    print("Can not decode answer: ", e)
-                    self.ev_protocolerror(False, resp)
-                    continue
-
-                print("Received answer: [%s], len = %i" % (ans, len(ans)))
-                
-                evt = answer.parse_answer(ans)
-                if evt["result"] == "ok":
-                    if evt["event"] == "queue":
-                        self.ev_slots(evt["action"], evt["slots"])
-                        self.ev_queued(evt["action"])
-                    elif evt["event"] == "drop":
-                        self.ev_slots(evt["action"], evt["slots"])
-                        self.ev_dropped(evt["action"])
-                    elif evt["event"] == "start":
-                        self.ev_slots(evt["action"], evt["slots"])
-                        self.ev_started(evt["action"])
-                    elif evt["event"] == "complete":
-                        self.ev_slots(evt["action"], evt["slots"])
-                        self.ev_completed(evt["action"], evt["response"])
-                    elif evt["event"] == "init":
-                        self.ev_mcu_reseted()
-                    elif evt["event"] == "error":
-                        self.ev_error(evt["msg"])
-                else:
-                    print("problem", evt)
+                self.process(resp[16:])
+                return True
+            for msg in batching.split(resp[14:]):
+                self.process(msg)
+            return True
+
+        def process(self, msg):
+            trace.receiver.debug("Received answer: %s", msg)
+            evt = answer.parse(msg)
+            if evt.event == "queue":
+                self.ev_slots(evt.action, evt.slots)
+                self.ev_queued(evt.action)
+            elif evt.event == "drop":
+                self.ev_slots(evt.action, evt.slots)
+                self.ev_dropped(evt.action)
+            elif evt.event == "start":
+                self.ev_slots(evt.action, evt.slots)
+                self.ev_started(evt.action)
+            elif evt.event == "complete":
+                self.ev_slots(evt.action, evt.slots)
+                self.ev_completed(evt.action, evt.response)
+            elif evt.event == "init":
+                self.ev_mcu_reseted()
+            elif evt.event == "error":
+                self.ev_error(evt.msg)
+            elif evt.event is None:
+                trace.receiver.warning("Unknown answer: %s", evt.msg)
 
     indexed = event.EventEmitter()
     queued = event.EventEmitter()
@@ -90,7 +103,12 @@ class EthernetSender(object):
     error = event.EventEmitter()
 
     __reseted_ev = event.EventEmitter()
-    has_slots = threading.Event()
+    has_slots = event.Event()
+
+    # send movements in binary encoding, see common.binary
+    binary = False
+    # MCU resyncs after CRC error, see flowcontrol.resyncs
+    resync = False
     
     @staticmethod
     def __getHwAddr(ifname):
@@ -98,7 +116,10 @@ class EthernetSender(object):
         info = fcntl.ioctl(s.fileno(), 0x8927,  struct.pack('256s', bytes(ifname, 'utf-8')[:15]))
         return info[18:24]
 
-    def __init__(self, ethname, timeout=0, debug=False):
+    # with listen=False answers are not received until attach(loop)
+    # batch_window - time of collecting commands into one frame, seconds,
+    # see batching.Batcher. ETHERNET_BATCH_WINDOW of config by default
+    def __init__(self, ethname, timeout=0, debug=False, listen=True, batch_window=None):
         self.__id = 0
         self.__ethertype = bytes([0xFE, 0xFE])
         self.__remote = {
@@ -109,57 +130,120 @@ class EthernetSender(object):
         self.__qans = threading.Event()
         self.__reseted = False
         self.__slots = event.EventEmitter()
+        self.__errors = event.EventEmitter()
+        self.__flow = flowcontrol.FlowControl(self.has_slots)
+        self.__dispatcher = dispatch.Dispatcher()
+        self.stats = stats.Stats()
         self.__finish_event = threading.Event()
 
         self.__sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
         self.__sock.bind((ethname, socket.htons(0xFEFE)))
         self.timeout = timeout
+        if batch_window is None:
+            batch_window = config.ETHERNET_BATCH_WINDOW
+        self.__batcher = batching.Batcher(self.__send_frame, batch_window)
 
         self.__listener = self.EthernetReceiver(self.__sock, self.__remote, self.__finish_event,
-                                                self.completed, self.started, self.__slots,
-                                                self.dropped, self.queued,
-                                                self.protocol_error, self.__reseted_ev, self.error)
+                                                self.__on_completed, self.__on_started, self.__slots,
+                                                self.__on_dropped, self.__on_queued,
+                                                self.protocol_error, self.__reseted_ev, self.__errors)
+        self.__listener.batched = batch_window > 0
         self.__reseted_ev += self.__on_reset
         self.__slots += self.__on_slots
-        self.__listener.start()
+        self.__errors += self.__on_error
+        self.__loop = None
+        if listen:
+            self.__listener.start()
         self.has_slots.set()
 
+    # receive answers in asyncio loop instead of thread
+    def attach(self, loop):
+        self.__loop = loop
+        loop.add_reader(self.__sock, self.__receive)
+
+    def __receive(self):
+        if not self.__listener.receive():
+            self.__loop.remove_reader(self.__sock)
+
     def __on_reset(self):
-        self.has_slots.set()
+        self.binary = False
+        self.resync = False
+        self.__flow.reset()
+        self.__dispatcher.clear()
         self.mcu_reseted()
 
+    def __on_queued(self, Nid):
+        self.__dispatcher.queued(Nid)
+        self.queued(Nid)
+
+    def __on_started(self, Nid):
+        self.__dispatcher.started(Nid)
+        self.started(Nid)
+
+    def __on_dropped(self, Nid):
+        self.__dispatcher.dropped(Nid)
+        self.dropped(Nid)
+
+    def __on_completed(self, Nid, response):
+        if "B" in response:
+            self.binary = binary.accepted(response)
+        if "R" in response:
+            self.resync = flowcontrol.resyncs(response)
+        self.__dispatcher.completed(Nid, response)
+        self.completed(Nid, response)
+
     def __on_slots(self, Nid, Q):
-        Nid = int(Nid)
-        if Q == 0:
-            self.has_slots.clear()
-        else:
-            self.has_slots.set()
-        if Nid != self.__id:
-            return
+        self.stats.slots(Q)
+        self.__flow.answered(Nid, Q)
+
+    def __on_error(self, msg):
+        nid = self.__flow.failed()
+        self.__dispatcher.error(nid, msg)
+        self.error(nid, msg)
 
-    def send_command(self, command, wait=True):
+    def free_slots(self):
+        return self.__flow.free_slots()
+
+    # handler receives answers for this command, see dispatch.Dispatcher
+    def send_command(self, command, wait=True, handler=None):
         self.__id += 1
         self.__reseted = False
         self.indexed(self.__id)
-        cmd = ("N%i " % self.__id) + command
-        encoded = bytes(cmd, "ascii")
-        s = sum(encoded)
-        crc = bytes("*%X" % s, "ascii")
-        msg = encoded + crc + b'\n'
-        msglen = len(msg)
-        lenb = bytes([int(msglen / 256), int(msglen % 256)])
-        print("Sending command %s" % msg)
-        frame = self.__remote["mac"] + self.__localmac + self.__ethertype + lenb + msg
-        self.__sock.send(frame)
+        if handler is not None:
+            self.__dispatcher.register(self.__id, handler)
+        self.__flow.sent(self.__id)
+        if isinstance(command, bytes):
+            msg = binary.frame(self.__id, command)
+        else:
+            cmd = ("N%i " % self.__id) + command
+            encoded = bytes(cmd, "ascii")
+            s = sum(encoded)
+            crc = bytes("*%X" % s, "ascii")
+            msg = encoded + crc + b'\n'
+        trace.sender.debug("Sending command %s", msg)
+        self.stats.sent(len(msg))
+        self.__batcher.add(msg)
         oid = self.__id
         return oid
 
+    # send collected commands at once, when no more commands are ready
+    def flush(self):
+        self.__batcher.flush()
+
+    def __send_frame(self, payload):
+        frame = self.__remote["mac"] + self.__localmac + self.__ethertype + payload
+        self.__sock.send(frame)
+
     def close(self):
+        self.__batcher.close()
         self.__finish_event.set()
+        if self.__loop is not None:
+            self.__loop.remove_reader(self.__sock)
         self.__sock.close()
 
     def clean(self):
         self.__reseted = True
+        self.__dispatcher.clear()
         self.__qans.set()
 
     def reset(self):
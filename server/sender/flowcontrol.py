@@ -0,0 +1,65 @@
+import threading
+import collections
+
+# Tracks commands, sent to MCU, which are not received by MCU yet
+#
+# MCU answers in order of received commands, so answer for command Nid
+# means, that all commands before Nid are received too.
+# Q from answer is amount of free slots in MCU queue, when answer
+# was sent, so commands, sent after it, are not counted in Q.
+class FlowControl(object):
+
+    def __init__(self, has_slots):
+        self.has_slots = has_slots
+        self.in_flight = collections.deque()
+        self.slots = 1
+        self.lock = threading.Lock()
+
+    def __update(self):
+        if self.slots - len(self.in_flight) > 0:
+            self.has_slots.set()
+        else:
+            self.has_slots.clear()
+
+    def free_slots(self):
+        with self.lock:
+            return self.slots - len(self.in_flight)
+
+    def sent(self, nid):
+        with self.lock:
+            self.in_flight.append(nid)
+            self.__update()
+
+    def answered(self, nid, Q):
+        nid = int(nid)
+        with self.lock:
+            while len(self.in_flight) > 0 and self.in_flight[0] <= nid:
+                self.in_flight.popleft()
+            self.slots = Q
+            self.__update()
+
+    # error answer doesn't contain Nid, it is the oldest sent command
+    def failed(self):
+        with self.lock:
+            if len(self.in_flight) == 0:
+                return None
+            nid = self.in_flight.popleft()
+            self.__update()
+            return nid
+
+    def reset(self):
+        with self.lock:
+            self.in_flight.clear()
+            self.slots = 1
+            self.__update()
+
+# does MCU, which answered response to M800, resync after CRC error
+#
+# Such MCU reports R:1. After CRC error it rejects all commands, which are
+# sent before host received "error: CRC error", with the same error, and
+# accepts commands, sent after it. So host can send rejected commands
+# again in the same order, while other commands are in flight. MCU, which
+# doesn't report it, can queue commands after damaged one, so commands
+# are sent to it one by one, see machine.Machine (pipeline mode).
+def resyncs(response):
+    return response.get("R", 0) >= 1
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import threading
+
+from . import flowcontrol
+
+def test_slots():
+    has_slots = threading.Event()
+    flow = flowcontrol.FlowControl(has_slots)
+    flow.reset()
+    assert has_slots.is_set()
+    flow.sent(1)
+    assert not has_slots.is_set()
+    flow.answered(1, 4)
+    assert flow.free_slots() == 4
+    for nid in range(2, 6):
+        flow.sent(nid)
+    assert flow.free_slots() == 0
+    assert not has_slots.is_set()
+    # answer for 3 means 2 is received too
+    flow.answered(3, 2)
+    assert flow.free_slots() == 0
+    flow.answered(5, 3)
+    assert flow.free_slots() == 3
+    assert has_slots.is_set()
+
+def test_failed():
+    has_slots = threading.Event()
+    flow = flowcontrol.FlowControl(has_slots)
+    assert flow.failed() is None
+    flow.answered(0, 8)
+    flow.sent(1)
+    flow.sent(2)
+    assert flow.failed() == 1
+    assert flow.failed() == 2
+    assert flow.failed() is None
+    assert flow.free_slots() == 8
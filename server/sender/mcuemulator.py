@@ -0,0 +1,312 @@
+import re
+import math
+import time
+import heapq
+import random
+import threading
+import collections
+
+from common import event
+from common import binary
+from common import feedprofile
+from . import answer
+from . import flowcontrol
+from . import dispatch
+from . import stats
+
+# Sender with virtual MCU, which executes commands in time
+#
+# MCU runs on its own thread. It has queue of `depth` commands and reports
+# free slots in answers (Q:), executes movements for time of their feed
+# profile (F feed, P feed0, L feed1, T acceleration), divided by `speed`,
+# and answers M114 with its position. Commands and answers are delivered
+# with `latency` seconds of wire delay. With `supports_binary` MCU accepts
+# binary movements and reports it in answer to M800, see common.binary.
+# Answers of MCU are appended to `record`, if it is given.
+#
+# Faults are injected with probabilities `crc_errors` and `drops` for each
+# command, and with inject_reset(). With `resync` MCU reports R:1 in answer
+# to M800 and after CRC error rejects all commands, which are sent before
+# host received the error, so host can send them again in order, see
+# flowcontrol.resyncs. Without it MCU rejects only damaged command and
+# queues the next ones. M999 resets MCU in both modes.
+class MCUEmulator(object):
+
+    __word = re.compile(r"([A-Z])([-+]?[0-9]*\.?[0-9]+)")
+
+    # planes of arcs, as they are sent by actions.helix.HelixMovement
+    __planes = {17 : (0, 1, 2), 18 : (1, 2, 0), 19 : (2, 0, 1)}
+
+    def __init__(self, depth=16, latency=0, speed=1.0, crc_errors=0, drops=0, seed=None,
+                 supports_binary=True, record=None, resync=True):
+        self.indexed = event.EventEmitter()
+        self.queued = event.EventEmitter()
+        self.completed = event.EventEmitter()
+        self.started = event.EventEmitter()
+        self.dropped = event.EventEmitter()
+        self.mcu_reseted = event.EventEmitter()
+        self.error = event.EventEmitter()
+        self.protocol_error = event.EventEmitter()
+
+        self.has_slots = event.Event()
+
+        self.id = 0
+        self.depth = depth
+        self.latency = latency
+        self.speed = speed
+        self.crc_errors = crc_errors
+        self.drops = drops
+        self.random = random.Random(seed)
+        self.supports_binary = supports_binary
+        self.record = record
+        self.supports_resync = resync
+        # send movements in binary encoding
+        self.binary = False
+        # MCU resyncs after CRC error
+        self.resync = False
+        # statistics
+        self.executed = 0
+        self.rejected = 0
+        self.overflows = 0
+        # bytes of sent commands
+        self.bytes = 0
+
+        self.__flow = flowcontrol.FlowControl(self.has_slots)
+        self.__dispatcher = dispatch.Dispatcher()
+        self.stats = stats.Stats()
+
+        # events of MCU and wire: (time, order, handler, args)
+        self.__events = []
+        self.__order = 0
+        self.__cond = threading.Condition()
+        self.__finished = False
+
+        # state of MCU
+        self.__queue = collections.deque()
+        self.__current = None
+        self.__position = [0.0, 0.0, 0.0]
+        # after CRC error: None - host doesn't know about error yet,
+        # else index of last command, sent before host knew it
+        self.__rejecting = False
+        self.__resync = None
+
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        self.has_slots.set()
+
+    #region scheduler
+    def __schedule(self, delay, handler, *args):
+        with self.__cond:
+            self.__order += 1
+            heapq.heappush(self.__events, (time.time() + delay, self.__order, handler, args))
+            self.__cond.notify()
+
+    def __next_event(self):
+        with self.__cond:
+            while not self.__finished:
+                if len(self.__events) == 0:
+                    self.__cond.wait()
+                    continue
+                delay = self.__events[0][0] - time.time()
+                if delay <= 0:
+                    return heapq.heappop(self.__events)
+                self.__cond.wait(delay)
+            return None
+
+    def __run(self):
+        while True:
+            item = self.__next_event()
+            if item is None:
+                break
+            _, _, handler, args = item
+            handler(*args)
+    #endregion scheduler
+
+    #region virtual MCU
+    def __answer(self, data):
+        if self.record is not None:
+            self.record.append(data + b"\n")
+        self.__schedule(self.latency, self.__receive, data)
+
+    def __slots(self):
+        return self.depth - len(self.__queue)
+
+    # time and delta of movement command
+    def __movement(self, words):
+        codes = [int(value) for letter, value in words if letter == "G"]
+        params = {letter : float(value) for letter, value in words if letter != "G"}
+        delta = [params.get("X", 0), params.get("Y", 0), params.get("Z", 0)]
+        if codes[0] in (2, 3):
+            a, b, c = self.__planes[codes[1]] if len(codes) > 1 else self.__planes[17]
+            d = math.hypot(delta[a], delta[b])
+            hcl = params.get("D", 0)
+            r = math.hypot(hcl, d / 2)
+            angle = 2 * math.asin(min(d / 2 / r, 1)) if r > 0 else 0
+            if hcl != 0 and (hcl > 0) == (codes[0] == 3):
+                angle = 2 * math.pi - angle
+            length = math.hypot(angle * r, delta[c])
+        else:
+            length = math.sqrt(sum(x**2 for x in delta))
+        duration = feedprofile.duration(length, params.get("P", 0), params.get("F", 0),
+                                        params.get("L", 0), params.get("T", 0))
+        return duration / self.speed, delta
+
+    # words of command without N, None if it can not be decoded
+    def __words(self, data):
+        if not isinstance(data, bytes):
+            return self.__word.findall(data)[1:]
+        if not self.supports_binary:
+            return None
+        parsed = binary.parse(data)
+        if parsed is None:
+            return None
+        return parsed[1]
+
+    def __arrive(self, nid, data, corrupted):
+        words = self.__words(data)
+        if not corrupted and words is not None and ("M", "999") in words:
+            self.__reset()
+            return
+        if self.__rejecting:
+            if self.__resync is None or nid <= self.__resync:
+                self.rejected += 1
+                self.__answer(b"error: CRC error")
+                return
+            self.__rejecting = False
+            self.__resync = None
+        if corrupted or words is None:
+            self.rejected += 1
+            self.__rejecting = self.supports_resync
+            self.__answer(b"error: CRC error")
+            return
+        if len(self.__queue) >= self.depth:
+            self.overflows += 1
+            self.__answer(b"error: queue is full")
+            return
+        if self.random.random() < self.drops:
+            self.__answer(b"dropped N:%i Q:%i" % (nid, self.__slots()))
+            return
+
+        if len(words) > 0 and words[0][0] == "G" and int(words[0][1]) in (0, 1, 2, 3):
+            duration, delta = self.__movement(words)
+        else:
+            duration, delta = 0, None
+        self.__queue.append((nid, duration, delta, words))
+        self.__answer(b"queued N:%i Q:%i" % (nid, self.__slots()))
+        self.__start()
+
+    def __start(self):
+        if self.__current is not None or len(self.__queue) == 0:
+            return
+        self.__current = self.__queue.popleft()
+        nid, duration, _, _ = self.__current
+        self.__answer(b"started N:%i Q:%i" % (nid, self.__slots()))
+        self.__schedule(duration, self.__complete, self.__current)
+
+    def __complete(self, command):
+        if self.__current is not command:
+            # MCU was reseted
+            return
+        nid, _, delta, words = command
+        self.__current = None
+        self.executed += 1
+        if delta is not None:
+            self.__position = [p + d for p, d in zip(self.__position, delta)]
+        text = b"completed N:%i Q:%i" % (nid, self.__slots())
+        if ("M", "114") in words:
+            x, y, z = self.__position
+            text += b" X:%.3f Y:%.3f Z:%.3f P:0" % (x, y, z)
+        if ("M", "800") in words and self.supports_binary:
+            text += b" B:%i" % binary.VERSION
+        if ("M", "800") in words and self.supports_resync:
+            text += b" R:1"
+        self.__answer(text)
+        self.__start()
+
+    def __reset(self):
+        self.__queue.clear()
+        self.__current = None
+        self.__position = [0.0, 0.0, 0.0]
+        self.__rejecting = False
+        self.__resync = None
+        self.__answer(b"Hello")
+
+    def inject_reset(self):
+        self.__schedule(0, self.__reset)
+    #endregion virtual MCU
+
+    #region host
+    def __receive(self, data):
+        if data.startswith(b"error: CRC error") and self.__rejecting and self.__resync is None:
+            # commands, sent after it, are not rejected
+            self.__resync = self.id
+        evt = answer.parse(data)
+        if evt.event in ["queue", "drop", "start", "complete"]:
+            self.stats.slots(evt.slots)
+            self.__flow.answered(evt.action, evt.slots)
+        if evt.event == "queue":
+            self.__dispatcher.queued(evt.action)
+            self.queued(evt.action)
+        elif evt.event == "drop":
+            self.__dispatcher.dropped(evt.action)
+            self.dropped(evt.action)
+        elif evt.event == "start":
+            self.__dispatcher.started(evt.action)
+            self.started(evt.action)
+        elif evt.event == "complete":
+            if "B" in evt.response:
+                self.binary = binary.accepted(evt.response)
+            if "R" in evt.response:
+                self.resync = flowcontrol.resyncs(evt.response)
+            self.__dispatcher.completed(evt.action, evt.response)
+            self.completed(evt.action, evt.response)
+        elif evt.event == "init":
+            self.binary = False
+            self.resync = False
+            self.__flow.reset()
+            self.__dispatcher.clear()
+            self.mcu_reseted()
+        elif evt.event == "error":
+            nid = self.__flow.failed()
+            self.__dispatcher.error(nid, evt.msg)
+            self.error(nid, evt.msg)
+
+    def free_slots(self):
+        return self.__flow.free_slots()
+
+    def send_command(self, command, wait=True, handler=None):
+        with self.__cond:
+            self.id += 1
+            nid = self.id
+        self.indexed(nid)
+        if handler is not None:
+            self.__dispatcher.register(nid, handler)
+        self.__flow.sent(nid)
+        if isinstance(command, bytes):
+            data = binary.frame(nid, command)
+            size = len(data)
+        else:
+            data = ("N%i " % nid) + command
+            size = len(data) + len("*%X\n" % sum(bytes(data, "ascii")))
+        self.bytes += size
+        self.stats.sent(size)
+        corrupted = self.random.random() < self.crc_errors
+        self.__schedule(self.latency, self.__arrive, nid, data, corrupted)
+        return nid
+
+    # commands are sent at once, see ethernetsender.EthernetSender.flush
+    def flush(self):
+        pass
+
+    def close(self):
+        with self.__cond:
+            self.__finished = True
+            self.__cond.notify()
+
+    def clean(self):
+        self.__dispatcher.clear()
+
+    def reset(self):
+        self.__flow.reset()
+        self.__dispatcher.clear()
+    #endregion host
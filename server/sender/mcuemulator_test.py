@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+
+import common
+from common import binary
+
+from . import mcuemulator
+
+class Handler(object):
+
+    def __init__(self):
+        self.answers = []
+        self.done = threading.Event()
+
+    def received_queued(self, nid):
+        self.answers.append("queued")
+
+    def received_started(self, nid):
+        self.answers.append("started")
+
+    def received_dropped(self, nid):
+        self.answers.append("dropped")
+        self.done.set()
+
+    def received_completed(self, nid, response):
+        self.answers.append("completed")
+        self.response = response
+        self.done.set()
+
+    def received_error(self, nid, msg):
+        self.answers.append("error")
+        self.msg = msg
+        self.done.set()
+
+def test_movement_time():
+    sender = mcuemulator.MCUEmulator(speed=10)
+    handler = Handler()
+    t = time.time()
+    # 10 mm with 600 mm/min, 1 second
+    sender.send_command("G1 F600P0L0T0 X10.00 Y0.00 Z0.00", handler=handler)
+    assert handler.done.wait(2)
+    t = time.time() - t
+    sender.close()
+    assert handler.answers == ["queued", "started", "completed"]
+    assert 0.09 < t < 0.2
+
+def test_arc_time():
+    sender = mcuemulator.MCUEmulator(speed=10)
+    handler = Handler()
+    t = time.time()
+    # half of circle with r = 5 mm, 15.7 mm with 600 mm/min
+    sender.send_command("G2 F600P0L0T0 D0.00 G17 X10.00Y0.00Z0.00 ", handler=handler)
+    assert handler.done.wait(2)
+    t = time.time() - t
+    sender.close()
+    assert 0.15 < t < 0.25
+
+def test_coordinates():
+    sender = mcuemulator.MCUEmulator(speed=1000)
+    handlers = [Handler() for _ in range(3)]
+    sender.send_command("G1 F600P0L0T0 X10.00 Y0.00 Z0.00", handler=handlers[0])
+    sender.send_command("G0 F600P0L0T0 X0.00 Y-5.00 Z1.00", handler=handlers[1])
+    sender.send_command("M114", handler=handlers[2])
+    assert handlers[2].done.wait(2)
+    sender.close()
+    response = handlers[2].response
+    assert (response["X"], response["Y"], response["Z"]) == (10, -5, 1)
+
+def test_slots():
+    sender = mcuemulator.MCUEmulator(depth=4, speed=1)
+    assert sender.has_slots.is_set()
+    sender.send_command("G1 F600P0L0T0 X100.00 Y0.00 Z0.00")
+    assert not sender.has_slots.is_set()
+    assert sender.has_slots.wait(1)
+    time.sleep(0.05)
+    # first command is started, queue is empty
+    assert sender.free_slots() == 4
+    for _ in range(4):
+        sender.send_command("G1 F600P0L0T0 X100.00 Y0.00 Z0.00")
+    assert sender.free_slots() == 0
+    handler = Handler()
+    time.sleep(0.05)
+    sender.send_command("G1 F600P0L0T0 X100.00 Y0.00 Z0.00", handler=handler)
+    assert handler.done.wait(1)
+    sender.close()
+    assert handler.answers == ["error"]
+    assert sender.overflows == 1
+
+def test_crc_error():
+    sender = mcuemulator.MCUEmulator(latency=0.01, speed=1000, crc_errors=1, seed=1)
+    handlers = [Handler() for _ in range(3)]
+    for handler in handlers:
+        sender.send_command("G1 F600P0L0T0 X1.00 Y0.00 Z0.00", handler=handler)
+    for handler in handlers:
+        assert handler.done.wait(1)
+        assert handler.answers == ["error"]
+        assert handler.msg.endswith("CRC error")
+
+    # commands, sent after host received error, are accepted
+    sender.crc_errors = 0
+    handler = Handler()
+    sender.send_command("G1 F600P0L0T0 X1.00 Y0.00 Z0.00", handler=handler)
+    assert handler.done.wait(1)
+    sender.close()
+    assert handler.answers == ["queued", "started", "completed"]
+
+def test_crc_error_without_resync():
+    for resync in [True, False]:
+        sender = mcuemulator.MCUEmulator(latency=0.01, speed=1000, resync=resync)
+        handler = Handler()
+        sender.send_command("M800", handler=handler)
+        assert handler.done.wait(1)
+        assert sender.resync == resync
+        handlers = [Handler() for _ in range(2)]
+        sender.crc_errors = 1
+        sender.send_command("G1 F600P0L0T0 X1.00 Y0.00 Z0.00", handler=handlers[0])
+        sender.crc_errors = 0
+        sender.send_command("G1 F600P0L0T0 X1.00 Y0.00 Z0.00", handler=handlers[1])
+        for handler in handlers:
+            assert handler.done.wait(1)
+        sender.close()
+        assert handlers[0].answers == ["error"]
+        # MCU without resync queues command, sent after damaged one
+        if resync:
+            assert handlers[1].answers == ["error"]
+        else:
+            assert handlers[1].answers == ["queued", "started", "completed"]
+
+def test_reset_while_rejecting():
+    sender = mcuemulator.MCUEmulator(latency=0.01, speed=1000, crc_errors=1)
+    reseted = threading.Event()
+    sender.mcu_reseted += reseted.set
+    handler = Handler()
+    sender.send_command("G1 F600P0L0T0 X1.00 Y0.00 Z0.00", handler=handler)
+    sender.crc_errors = 0
+    # M999 is sent before error is received, but it isn't rejected
+    sender.send_command("M999")
+    assert reseted.wait(1)
+    sender.close()
+
+def test_reset():
+    sender = mcuemulator.MCUEmulator(speed=1)
+    reseted = threading.Event()
+    sender.mcu_reseted += reseted.set
+    handler = Handler()
+    sender.send_command("G1 F600P0L0T0 X100.00 Y0.00 Z0.00", handler=handler)
+    sender.inject_reset()
+    assert reseted.wait(1)
+    time.sleep(0.05)
+    sender.close()
+    assert "completed" not in handler.answers
+
+def test_binary_frames():
+    body = binary.arc(True, 600, 100.4, 0, 40, (10, -0.0025, 1), 17, -2.5)
+    data = binary.frame(7, body)
+    assert len(data) < len("N7 G3 F600P100L0T40 D-2.50 G17 X10.00Y-0.00Z1.00 *FFF\n")
+    nid, words = binary.parse(data)
+    assert nid == 7
+    params = {letter : float(value) for letter, value in words if letter != "G"}
+    assert [value for letter, value in words if letter == "G"] == ["3", "17"]
+    assert params == {"F" : 600, "P" : 100, "L" : 0, "T" : 40,
+                      "X" : 10, "Y" : -0.0025, "Z" : 1, "D" : -2.5}
+    damaged = bytearray(data)
+    damaged[10] ^= 1
+    assert binary.parse(bytes(damaged)) is None
+
+def test_binary_negotiation(monkeypatch):
+    for enabled, supported in [(True, True), (False, True), (True, False)]:
+        monkeypatch.setattr(common.config, "BINARY_COMMANDS", enabled)
+        sender = mcuemulator.MCUEmulator(speed=1000, supports_binary=supported)
+        handler = Handler()
+        sender.send_command("M800", handler=handler)
+        assert handler.done.wait(1)
+        sender.close()
+        assert sender.binary == (enabled and supported)
+
+def test_binary_movements(monkeypatch):
+    monkeypatch.setattr(common.config, "BINARY_COMMANDS", True)
+    sender = mcuemulator.MCUEmulator(speed=1000)
+    handlers = [Handler() for _ in range(4)]
+    sender.send_command("M800", handler=handlers[0])
+    sender.send_command(binary.line(600, 0, 0, 0, (10, 0, 0)), handler=handlers[1])
+    sender.send_command(binary.arc(False, 600, 0, 0, 0, (0, -5, 1), 17, 0), handler=handlers[2])
+    sender.send_command("M114", handler=handlers[3])
+    assert handlers[3].done.wait(2)
+    sender.close()
+    assert handlers[1].answers == ["queued", "started", "completed"]
+    response = handlers[3].response
+    assert (response["X"], response["Y"], response["Z"]) == (10, -5, 1)
+    # binary commands are rejected by MCU, which doesn't support them
+    sender = mcuemulator.MCUEmulator(speed=1000, supports_binary=False)
+    handler = Handler()
+    sender.send_command(binary.line(600, 0, 0, 0, (10, 0, 0)), handler=handler)
+    assert handler.done.wait(1)
+    sender.close()
+    assert handler.answers == ["error"]
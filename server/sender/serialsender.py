@@ -4,9 +4,14 @@ import time
 import sys
 import serial
 from common import event
+from common import binary
+from common import trace
 import threading
 import re
 from . import answer
+from . import flowcontrol
+from . import dispatch
+from . import stats
 
 class SerialSender(object):
 
@@ -39,34 +44,24 @@ class SerialSender(object):
                     self.ev_protocolerror(True, "Serial port read error")
                     break
 
-                try:
-                    ans = resp.decode("ascii")
-                except:
-                    print("Can not decode answer: ", e)
-                    self.ev_protocolerror(False, resp)
-                    continue
-
-                ans = str(ans).strip()
-                print("Received answer: [%s], len = %i" % (ans, len(ans)))
-                
-                evt = answer.parse_answer(ans)
-                if evt["result"] == "ok":
-                    if evt["event"] == "queue":
-                        self.ev_slots(evt["action"], evt["slots"])
-                        self.ev_queued(evt["action"])
-                    elif evt["event"] == "drop":
-                        self.ev_slots(evt["action"], evt["slots"])
-                        self.ev_dropped(evt["action"])
-                    elif evt["event"] == "start":
-                        self.ev_slots(evt["action"], evt["slots"])
-                        self.ev_started(evt["action"])
-                    elif evt["event"] == "complete":
-                        self.ev_slots(evt["action"], evt["slots"])
-                        self.ev_completed(evt["action"], evt["response"])
-                    elif evt["event"] == "init":
-                        self.ev_mcu_reseted()
-                    elif evt["event"] == "error":
-                        self.ev_error(evt["msg"])
+                trace.receiver.debug("Received answer: %s", resp)
+                evt = answer.parse(resp)
+                if evt.event == "queue":
+                    self.ev_slots(evt.action, evt.slots)
+                    self.ev_queued(evt.action)
+                elif evt.event == "drop":
+                    self.ev_slots(evt.action, evt.slots)
+                    self.ev_dropped(evt.action)
+                elif evt.event == "start":
+                    self.ev_slots(evt.action, evt.slots)
+                    self.ev_started(evt.action)
+                elif evt.event == "complete":
+                    self.ev_slots(evt.action, evt.slots)
+                    self.ev_completed(evt.action, evt.response)
+                elif evt.event == "init":
+                    self.ev_mcu_reseted()
+                elif evt.event == "error":
+                    self.ev_error(evt.msg)
 
     indexed = event.EventEmitter()
     queued = event.EventEmitter()
@@ -78,13 +73,22 @@ class SerialSender(object):
     error = event.EventEmitter()
 
     __reseted_ev = event.EventEmitter()
-    has_slots = threading.Event()
+    has_slots = event.Event()
+
+    # send movements in binary encoding, see common.binary
+    binary = False
+    # MCU resyncs after CRC error, see flowcontrol.resyncs
+    resync = False
     
     def __init__(self, port, bdrate, timeout):
         self.__id = 0
         self.__qans = threading.Event()
         self.__reseted = False
         self.__slots = event.EventEmitter()
+        self.__errors = event.EventEmitter()
+        self.__flow = flowcontrol.FlowControl(self.has_slots)
+        self.__dispatcher = dispatch.Dispatcher()
+        self.stats = stats.Stats()
         self.__finish_event = threading.Event()
 
         self.port = port
@@ -95,48 +99,88 @@ class SerialSender(object):
                                    rtscts=False, dsrdtr=False)
         
         self.__listener = self.SerialReceiver(self.__ser, self.__finish_event,
-                                              self.completed, self.started, self.__slots,
-                                              self.dropped, self.queued,
-                                              self.protocol_error, self.__reseted_ev, self.error)
+                                              self.__on_completed, self.__on_started, self.__slots,
+                                              self.__on_dropped, self.__on_queued,
+                                              self.protocol_error, self.__reseted_ev, self.__errors)
         self.__reseted_ev += self.__on_reset
         self.__slots += self.__on_slots
+        self.__errors += self.__on_error
         self.__listener.start()
         self.has_slots.set()
 
     def __on_reset(self):
-        self.has_slots.set()
+        self.binary = False
+        self.resync = False
+        self.__flow.reset()
+        self.__dispatcher.clear()
         self.mcu_reseted()
 
+    def __on_queued(self, Nid):
+        self.__dispatcher.queued(Nid)
+        self.queued(Nid)
+
+    def __on_started(self, Nid):
+        self.__dispatcher.started(Nid)
+        self.started(Nid)
+
+    def __on_dropped(self, Nid):
+        self.__dispatcher.dropped(Nid)
+        self.dropped(Nid)
+
+    def __on_completed(self, Nid, response):
+        if "B" in response:
+            self.binary = binary.accepted(response)
+        if "R" in response:
+            self.resync = flowcontrol.resyncs(response)
+        self.__dispatcher.completed(Nid, response)
+        self.completed(Nid, response)
+
     def __on_slots(self, Nid, Q):
-        Nid = int(Nid)
-        if Q == 0:
-            self.has_slots.clear()
-        else:
-            self.has_slots.set()
-        if Nid != self.__id:
-            return
+        self.stats.slots(Q)
+        self.__flow.answered(Nid, Q)
+
+    def __on_error(self, msg):
+        nid = self.__flow.failed()
+        self.__dispatcher.error(nid, msg)
+        self.error(nid, msg)
+
+    def free_slots(self):
+        return self.__flow.free_slots()
 
-    def send_command(self, command, wait=True):
+    # handler receives answers for this command, see dispatch.Dispatcher
+    def send_command(self, command, wait=True, handler=None):
         self.__id += 1
         self.__reseted = False
         self.indexed(self.__id)
-        cmd = ("N%i " % self.__id) + command
-        encoded = bytes(cmd, "ascii")
-        s = sum(encoded)
-        crc = bytes("*%X" % s, "ascii")
-        msg = encoded + crc + b'\n'
-        print("Sending command %s" % msg)
+        if handler is not None:
+            self.__dispatcher.register(self.__id, handler)
+        self.__flow.sent(self.__id)
+        if isinstance(command, bytes):
+            msg = binary.frame(self.__id, command)
+        else:
+            cmd = ("N%i " % self.__id) + command
+            encoded = bytes(cmd, "ascii")
+            s = sum(encoded)
+            crc = bytes("*%X" % s, "ascii")
+            msg = encoded + crc + b'\n'
+        trace.sender.debug("Sending command %s", msg)
+        self.stats.sent(len(msg))
         self.__ser.write(msg)
         self.__ser.flush()
         oid = self.__id
         return oid
 
+    # commands are sent at once, see ethernetsender.EthernetSender.flush
+    def flush(self):
+        pass
+
     def close(self):
         self.__finish_event.set()
         self.__ser.close()
 
     def clean(self):
         self.__reseted = True
+        self.__dispatcher.clear()
         self.__qans.set()
 
     def reset(self):
@@ -0,0 +1,111 @@
+import time
+import bisect
+
+# Histogram of latencies with fixed buckets
+#
+# counts[i] is amount of values not above bounds[i] (and above bounds[i-1]),
+# the last one is amount of values above all bounds. Values are in seconds.
+class Histogram(object):
+
+    bounds = [0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+              0.1, 0.2, 0.5, 1, 2, 5, 10]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.count = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return {
+            "bounds" : self.bounds,
+            "counts" : list(self.counts),
+            "mean" : self.total / self.count if self.count > 0 else 0,
+            "max" : self.max,
+        }
+
+# Statistics of commands, sent to MCU
+#
+# Sender counts sent bytes and free slots of MCU queue, actions give their
+# timestamps (see machine.actions.action.MCUAction), which are turned into
+# latencies of stages:
+#   send    - from start of action to send_command
+#   queue   - from send_command to "queued" answer
+#   wait    - from "queued" to "started", time in MCU queue
+#   execute - from "started" to "completed"
+#   total   - from start of action to "completed"
+class Stats(object):
+
+    stages = ["send", "queue", "wait", "execute", "total"]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.histograms = {stage : Histogram() for stage in self.stages}
+        self.commands = 0
+        self.segments = 0
+        self.bytes = 0
+        self.crc_errors = 0
+        self.drops = 0
+        self.min_slots = None
+        self.begin = None
+        self.end = None
+
+    def sent(self, size):
+        now = time.monotonic()
+        if self.begin is None:
+            self.begin = now
+        self.bytes += size
+
+    def slots(self, Q):
+        if self.min_slots is None or Q < self.min_slots:
+            self.min_slots = Q
+
+    # times - (enqueued, sent, queued, started, completed), None if not known
+    def completed(self, times, moving):
+        enqueued, sent, queued, started, completed = times
+        self.commands += 1
+        if moving:
+            self.segments += 1
+        self.end = completed
+        if sent is not None:
+            self.histograms["send"].add(sent - enqueued)
+        if queued is not None:
+            self.histograms["queue"].add(queued - sent)
+            if started is not None:
+                self.histograms["wait"].add(started - queued)
+        if started is not None:
+            self.histograms["execute"].add(completed - started)
+        self.histograms["total"].add(completed - enqueued)
+
+    def dropped(self):
+        self.drops += 1
+
+    def error(self, crc):
+        if crc:
+            self.crc_errors += 1
+
+    def snapshot(self):
+        elapsed = 0
+        if self.begin is not None:
+            elapsed = (self.end if self.end is not None else time.monotonic()) - self.begin
+        return {
+            "elapsed" : elapsed,
+            "commands" : self.commands,
+            "segments" : self.segments,
+            "segments_per_second" : self.segments / elapsed if elapsed > 0 else 0,
+            "bytes" : self.bytes,
+            "bytes_per_second" : self.bytes / elapsed if elapsed > 0 else 0,
+            "crc_errors" : self.crc_errors,
+            "drops" : self.drops,
+            "min_slots" : self.min_slots,
+            "latency" : {stage : histogram.snapshot() for stage, histogram in self.histograms.items()},
+        }
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+from . import stats
+
+def test_histogram():
+    histogram = stats.Histogram()
+    for value in [0.00005, 0.0001, 0.0003, 0.003, 20]:
+        histogram.add(value)
+    counts = histogram.counts
+    assert counts[0] == 2
+    assert counts[2] == 1
+    assert counts[5] == 1
+    assert counts[-1] == 1
+    snapshot = histogram.snapshot()
+    assert snapshot["max"] == 20
+    assert abs(snapshot["mean"] - sum([0.00005, 0.0001, 0.0003, 0.003, 20]) / 5) < 1e-12
+
+def test_stages():
+    s = stats.Stats()
+    s.sent(30)
+    s.slots(12)
+    s.slots(3)
+    s.slots(8)
+    s.completed([1.0, 1.001, 1.003, 1.5, 2.5], True)
+    # command without "queued" answer
+    s.completed([3.0, 3.001, None, None, 3.2], False)
+    s.dropped()
+    s.error(True)
+    s.error(False)
+    snapshot = s.snapshot()
+    assert (snapshot["commands"], snapshot["segments"]) == (2, 1)
+    assert (snapshot["crc_errors"], snapshot["drops"], snapshot["min_slots"]) == (1, 1, 3)
+    latency = snapshot["latency"]
+    assert sum(latency["queue"]["counts"]) == 1
+    assert abs(latency["wait"]["max"] - 0.497) < 1e-9
+    assert abs(latency["execute"]["max"] - 1.0) < 1e-9
+    assert sum(latency["total"]["counts"]) == 2
+    s.reset()
+    assert s.snapshot()["commands"] == 0
@@ -3,9 +3,11 @@
 import common
 import common.jsonwait
 import common.config
+import common.trace
 
 import sender
 import sender.emulatorsender
+import sender.mcuemulator
 import sender.serialsender
 import sender.ethernetsender
 import sender.spindelemulator
@@ -20,68 +22,112 @@ import sys
 
 import os
 import signal
-import socket
 import json
 import time
 
-import threading
+import asyncio
 
 crd_timeout = None
 
+# Server for UI and monitoring clients
+#
+# All clients, answers of MCU and coordinate requests are processed in one
+# asyncio loop. Messages of machine are sent to all connected clients,
+# commands are processed in order of receiving. Execution and loading of
+# program are asyncio tasks, so commands, like reset, are processed while
+# they run. Error in one message is reported and does not stop the server.
 class Controller(object):
-    class RequestThread(threading.Thread):
-        def __init__(self, machine):
-            threading.Thread.__init__(self)
-            self.machine = machine
-        
-        def run(self):
-            if crd_timeout is None:
-                return
+
+    # connection with one client
+    class Client(asyncio.BufferedProtocol):
+        def __init__(self, controller):
+            self.controller = controller
+            self.receiver = common.jsonwait.JsonReceiver(None)
+            self.sender = common.jsonwait.JsonSender(None)
+            self.transport = None
+            # lines of program, which is being uploaded by chunks
+            self.upload = []
+
+        def connection_made(self, transport):
+            self.transport = transport
+            self.controller.client_connected(self)
+
+        def connection_lost(self, exc):
+            self.transport = None
+            self.controller.client_disconnected(self)
+
+        def get_buffer(self, sizehint):
+            return self.receiver.get_buffer()
+
+        def buffer_updated(self, nbytes):
+            self.receiver.buffer_updated(nbytes)
             while True:
-                time.sleep(0.1)
-                self.machine.RequestCoordinates()
+                msg = self.receiver.next_message()
+                if msg is None:
+                    break
+                self.controller.client_message(self, msg)
+
+        def send_message(self, msg):
+            if self.transport is not None and not self.transport.is_closing():
+                self.transport.write(self.sender.encode(msg))
 
+    # messages can be emited from any thread, they are sent in loop
     def __emit_message(self, msg):
-        try:
-            print("Emiting message %s" % str(msg))
-            if self.msg_sender is not None:
-                self.msg_sender.send_message(msg)
-            else:
-                print("sender is None")
-        except OSError:
-            self.msg_sender.sock.close()
-            self.msg_sender = None
-            self.msg_receiver = None
-        except Exception as e:
-            print("Error", type(e), ":", e)
+        self.loop.call_soon_threadsafe(self.__broadcast, msg)
+
+    def __broadcast(self, msg):
+        common.trace.protocol.debug("Emit message %s", msg)
+        for client in list(self.clients):
+            try:
+                client.send_message(msg)
+            except Exception as e:
+                common.trace.protocol.error("Can not send message: %s: %s", type(e).__name__, e)
 
     def __init__(self, table_sender, spindel_sender, listen):
         self.listen = listen
         self.state = "init"
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.bind(listen)
-        self.socket.listen(1)
 
-        self.msg_sender = None
-        self.msg_receiver = None
+        self.loop = None
+        self.clients = set()
+        self.commands = None
 
         self.running = False
-        self.clientaddr = None
 
         self.table_sender = table_sender
         self.table_sender.protocol_error += self.__protocol_error
 
         self.spindel_sender = spindel_sender
         self.machine = machine.machine.Machine(self.table_sender, self.spindel_sender)
-        self.parser = machine.parser.GLineParser()
+        self.parser = machine.parser.GFastLineParser()
         self.machine.paused += self.__continue_on_pause
         self.machine.finished += self.__done
         self.machine.tool_selected += self.__tool_selected
         self.machine.line_selected += self.__line_selected
         self.machine.on_coordinates += self.__coordinates
 
-        self.reqthr = self.RequestThread(self.machine)
-        self.work_thread = None
+        self.work_task = None
+        self.load_task = None
+
+    #region clients
+    def client_connected(self, client):
+        common.trace.protocol.info("Client connected")
+        self.clients.add(client)
+
+    def client_disconnected(self, client):
+        common.trace.protocol.info("Client disconnected")
+        self.clients.discard(client)
+
+    def client_message(self, client, msg):
+        self.commands.put_nowait((client, msg))
+    #endregion clients
+
+    async def __request_coordinates(self):
+        while True:
+            await asyncio.sleep(crd_timeout)
+            if common.config.COORDINATE_SUBSCRIPTION:
+                self.machine.ReportCoordinates()
+            else:
+                self.machine.RequestCoordinates()
 
     def __coordinates(self, hw, glob, loc, cs):
         self.__print_coordinates(hw, glob, loc, cs)
@@ -116,13 +162,114 @@ class Controller(object):
         self.state = "init"
         self.__print_state()
 
-    def __load_lines(self, lines):
-        frames = []
-        for line in lines:
-            frame = self.parser.parse(line)
-            frames.append(frame)
-        self.__emit_message({"type":"loadlines", "lines":lines})
-        self.machine.Load(frames)
+    # returns frames and key of program in cache
+    def __parse_lines(self, lines):
+        cache = self.machine.cache
+        frames = None
+        key = None
+        if cache is not None:
+            key = cache.lines_key(lines)
+            frames = cache.load_frames(key)
+        if frames is None:
+            frames = self.parser.parse_lines(lines)
+            if cache is not None:
+                cache.save_frames(key, frames)
+        return frames, key
+
+    # parsing takes time, so it is done in executor. Loading is a task,
+    # it waits for previous loading, so the last loaded program wins
+    async def __load_lines(self, client, lines, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            frames, key = await self.loop.run_in_executor(None, self.__parse_lines, lines)
+            self.machine.Load(frames, key)
+        except Exception as e:
+            self.__print_state("Can not load G-Code: " + str(e))
+            return
+        self.__emit_lines(client, lines)
+        self.state = "init"
+        self.__print_state("G-Code loaded")
+
+    # run function, when program, which is being loaded, is ready
+    def __after_load(self, fun, *args):
+        if self.load_task is None or self.load_task.done():
+            fun(*args)
+            return
+        self.load_task.add_done_callback(lambda task: fun(*args))
+
+    # other clients get loaded program, uploader with protocol 2 gets
+    # only acknowledge with hash of program, it has the program already
+    def __emit_lines(self, uploader, lines):
+        for client in list(self.clients):
+            if client is uploader and client.sender.protocol >= 2:
+                client.send_message({"type":"loaded", "count":len(lines),
+                                     "hash":common.jsonwait.program_hash(lines)})
+                continue
+            if client.sender.protocol < 2:
+                client.send_message({"type":"loadlines", "lines":lines})
+                continue
+            for offset, chunk, _ in common.jsonwait.chunks(lines):
+                client.send_message({"type":"loadlines", "lines":chunk, "offset":offset})
+
+    # program is uploaded by chunks with protocol 2, returns True when last chunk received
+    def __upload_lines(self, client, msg):
+        offset = msg.get("offset", 0)
+        if offset == 0:
+            client.upload = []
+        if offset != len(client.upload):
+            client.upload = []
+            raise Exception("Invalid offset of program chunk: %i" % offset)
+        client.upload += msg["lines"]
+        return not msg.get("more", False)
+
+    def __hello(self, client, msg):
+        protocol = min(msg.get("protocol", 1), common.jsonwait.PROTOCOL)
+        client.send_message({"type":"hello", "protocol":protocol})
+        client.sender.protocol = protocol
+
+    # simulation takes time, so it is done in executor,
+    # result is sent, when it is finished
+    def __simulate(self):
+        future = self.loop.run_in_executor(None, self.machine.Simulate)
+        future.add_done_callback(self.__simulated)
+
+    def __simulated(self, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.__print_state("Simulation error: " + str(future.exception()))
+            return
+        result = future.result()
+        self.__emit_message({
+            "type" : "simulation",
+            "time" : result.time,
+            "lines" : sorted(result.lines.items()),
+            "tools" : [[tool, t] for tool, t in result.tools.items()],
+            "merged" : result.merged,
+        })
+
+    # statistics of commands, sent to table, see sender.stats.Stats
+    def __stats(self, client, msg):
+        stats = self.table_sender.stats
+        result = stats.snapshot()
+        result["type"] = "stats"
+        client.send_message(result)
+        if msg.get("reset", False):
+            stats.reset()
+
+    # formatting of trace takes time, so it is done in executor
+    def __dump_trace(self, path):
+        future = self.loop.run_in_executor(None, common.trace.dump, path)
+        future.add_done_callback(lambda future: self.__trace_dumped(future, path))
+
+    def __trace_dumped(self, future, path):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.__print_state("Can not dump trace: " + str(future.exception()))
+            return
+        self.__print_state("Trace dumped: %i entries to %s" % (future.result(), path))
 
     def __print_coordinates(self, hw, glob, loc, cs):
         msg = {
@@ -134,13 +281,10 @@ class Controller(object):
         }
         self.__emit_message(msg)
 
-    def __execute_lines(self, lines):
+    async def __execute_lines(self, lines):
         #try:
-            frames = []
-            for line in lines:
-                frame = self.parser.parse(line)
-                frames.append(frame)
-            self.machine.Execute(frames)
+            frames = self.parser.parse_lines(lines)
+            await self.machine.ExecuteAsync(frames)
         #except Exception as e:
         #    self.__done(True, "Process error: " + str(e))
 
@@ -151,78 +295,106 @@ class Controller(object):
             "message" : message
         })
 
-    def __run_cmd(self, cmd, *args, wait=True):
-        if not wait and self.work_thread is not None:
-            if not self.machine.is_running:
-                self.work_thread.join()
-            else:
-                print("Can not run ", cmd, " - still waiting")
+    def __work_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            common.trace.state.error("Work failed: %s: %s", type(task.exception()).__name__, task.exception())
+
+    # run machine work as task, only one task can run at once
+    def __run_work(self, cmd, *args):
+        if self.work_task is not None and not self.work_task.done():
+            if self.machine.is_running:
+                common.trace.state.warning("Can not run %s - still waiting", cmd.__name__)
                 return
-        print("RUN = ", cmd)
-        self.work_thread = threading.Thread(target=cmd, args=args)
-        self.work_thread.start()
-        if wait:
-            self.work_thread.join()
-            self.work_thread = None
+            # task of stopped machine waits forever
+            self.work_task.cancel()
+        common.trace.state.info("Run %s", cmd.__name__)
+        self.work_task = self.loop.create_task(cmd(*args))
+        self.work_task.add_done_callback(self.__work_done)
+
+    async def __process(self, client, msg):
+        common.trace.protocol.debug("Received %s", msg)
+
+        if not ("type" in msg):
+            return
+        if msg["type"] == "hello":
+            self.__hello(client, msg)
+        elif msg["type"] == "getstate":
+            self.__print_state()
+        elif msg["type"] == "stats":
+            self.__stats(client, msg)
+        elif msg["type"] == "command":
+            if msg["command"] == "reset":
+                self.machine.WorkReset()
+                self.state = "init"
+                self.__print_state()
+            elif msg["command"] == "start":
+                self.state = "running"
+                self.__print_state()
+                self.__after_load(self.__run_work, self.machine.WorkStartAsync)
+            elif msg["command"] == "continue":
+                self.state = "running"
+                self.__print_state()
+                self.__run_work(self.machine.WorkContinueAsync)
+            elif msg["command"] == "execute":
+                self.state = "running"
+                self.__print_state()
+                self.__run_work(self.__execute_lines, msg["lines"])
+            elif msg["command"] == "exit":
+                self.state = "exit"
+                self.__print_state()
+                self.running = False
+            elif msg["command"] == "load":
+                try:
+                    if not self.__upload_lines(client, msg):
+                        return
+                except Exception as e:
+                    self.__print_state(str(e))
+                    return
+                lines = client.upload
+                client.upload = []
+                self.load_task = self.loop.create_task(self.__load_lines(client, lines, self.load_task))
+            elif msg["command"] == "simulate":
+                self.__after_load(self.__simulate)
+            elif msg["command"] == "trace":
+                try:
+                    common.trace.configure(msg.get("levels", {}), msg.get("echo"))
+                except Exception as e:
+                    self.__print_state(str(e))
+            elif msg["command"] == "dumptrace":
+                self.__dump_trace(msg.get("path", common.config.TRACE_FILE))
+            elif msg["command"] == "stop":
+                self.machine.WorkStop()
+                self.state = "init"
+                self.__print_state()
+            else:
+                pass
+
+    async def __serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.commands = asyncio.Queue()
+        if hasattr(self.table_sender, "attach"):
+            self.table_sender.attach(self.loop)
+        server = await self.loop.create_server(lambda: self.Client(self), self.listen[0], self.listen[1])
+        poller = None
+        if crd_timeout is not None:
+            poller = self.loop.create_task(self.__request_coordinates())
+        print("WAIT ACCEPT")
+        async with server:
+            while self.running:
+                client, msg = await self.commands.get()
+                try:
+                    await self.__process(client, msg)
+                except Exception as e:
+                    common.trace.protocol.error("Can not process message: %s: %s", type(e).__name__, e)
+                    self.__print_state("Can not process message: %s: %s" % (type(e).__name__, e))
+            # send last messages
+            await asyncio.sleep(0)
+        if poller is not None:
+            poller.cancel()
 
     def run(self):
         self.running = True
-        self.reqthr.start()
-        while self.running:
-            print("WAIT ACCEPT")
-            self.connection, _ = self.socket.accept()
-            self.msg_receiver = common.jsonwait.JsonReceiver(self.connection)
-            self.msg_sender = common.jsonwait.JsonSender(self.connection)
-            print("ACCEPTED")
-            
-            while self.running and self.msg_sender is not None:
-                print("Waiting command")
-                msg, dis = self.msg_receiver.receive_message()
-                if dis:
-                    self.msg_sender = None
-                    self.msg_receiver = None
-                    self.connection.close()
-                    break
-                if msg is None:
-                    continue
-                print("Received: %s" % str(msg))
-
-                if not ("type" in msg):
-                    continue
-                if msg["type"] == "getstate":
-                    self.__print_state()
-                elif msg["type"] == "command":
-                    if msg["command"] == "reset":
-                        self.__run_cmd(self.machine.WorkReset)
-                        self.state = "init"
-                        self.__print_state()
-                    elif msg["command"] == "start":
-                        self.state = "running"
-                        self.__print_state()
-                        self.__run_cmd(self.machine.WorkStart, wait=False)
-                    elif msg["command"] == "continue":
-                        self.state = "running"
-                        self.__print_state()
-                        self.__run_cmd(self.machine.WorkContinue, wait=False)
-                    elif msg["command"] == "execute":
-                        self.state = "running"
-                        self.__print_state()
-                        self.__run_cmd(self.__execute_lines, msg["lines"], wait=False)
-                    elif msg["command"] == "exit":
-                        self.state = "exit"
-                        self.__print_state()
-                        self.running = False
-                    elif msg["command"] == "load":
-                        lines = msg["lines"]
-                        self.__load_lines(lines)
-                        self.state = "init"
-                        self.__print_state("G-Code loaded")
-                    elif msg["command"] == "stop":
-                        self.__run_cmd(self.machine.WorkStop)
-                        self.state = "init"
-                        self.__print_state()
-                    else:
-                        pass
+        asyncio.run(self.__serve())
 
 port = common.config.TABLE_PORT
 brate = common.config.TABLE_BAUDRATE
@@ -231,9 +403,10 @@ n700e_id = common.config.N700E_ID
 
 emulate_t = common.config.EMULATE_TABLE
 emulate_s = common.config.EMULATE_SPINDEL
+emulate_mcu = common.config.EMULATE_MCU
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "eEp:b:r:", ["port=", "baudrate=", "rs485="])
+    opts, args = getopt.getopt(sys.argv[1:], "emEp:b:r:", ["port=", "baudrate=", "rs485="])
 except getopt.GetoptError as err:
     # print help information and exit:
     print(err) # will print something like "option -a not recognized"
@@ -242,6 +415,9 @@ except getopt.GetoptError as err:
 for o, a in opts:
     if o == "-e":
         emulate_t = True
+    elif o == "-m":
+        emulate_t = True
+        emulate_mcu = True
     elif o == "-E":
         emulate_s = True
     elif o in ("-p", "--port"):
@@ -254,11 +430,14 @@ for o, a in opts:
         assert False, "unhandled option"
 
 
-if emulate_t:
+if emulate_t and emulate_mcu:
+    table_sender = sender.mcuemulator.MCUEmulator(depth=common.config.EMULATE_MCU_QUEUE,
+                                                  latency=common.config.EMULATE_MCU_LATENCY)
+elif emulate_t:
     table_sender = sender.emulatorsender.EmulatorSender()
 else:
     crd_timeout = common.config.COORDINATE_REQUEST_TIMEOUT
-    table_sender = sender.ethernetsender.EthernetSender(port, debug=True)
+    table_sender = sender.ethernetsender.EthernetSender(port, debug=True, listen=False)
 #    table_sender = sender.serialsender.SerialSender(port, brate)
 
 if emulate_s: